@@ -241,6 +241,8 @@ int get_inactive_core_count(const struct kcas_cache_info *cache_info);
 
 int open_ctrl_device_quiet();
 int open_ctrl_device();
+int ctrl_device_keep_open();
+void ctrl_device_release();
 int *get_cache_ids(int *cache_count);
 struct cache_device *get_cache_device_by_id_fd(int cache_id, int fd);
 struct cache_device **get_cache_devices(int *caches_count);
@@ -143,9 +143,16 @@ void set_safe_lib_constraint_handler()
 	set_str_constraint_handler_s(safe_lib_constraint_handler);
 }
 
+/* Control device kept open for multiple commands (e.g. in batch mode) */
+static int ctrl_fd = -1;
+
 int _open_ctrl_device(int quiet)
 {
 	int fd;
+
+	if (ctrl_fd >= 0)
+		return dup(ctrl_fd);
+
 	fd = open(CTRL_DEV_PATH, 0);
 
 	if (fd < 0) {
@@ -173,6 +180,29 @@ int open_ctrl_device()
 	return _open_ctrl_device(false);
 }
 
+/**
+ * keeps control device open, so that following open_ctrl_device() calls
+ * don't have to open it again; returns SUCCESS or FAILURE
+ */
+int ctrl_device_keep_open()
+{
+	if (ctrl_fd < 0)
+		ctrl_fd = open(CTRL_DEV_PATH, 0);
+
+	return ctrl_fd < 0 ? FAILURE : SUCCESS;
+}
+
+/**
+ * closes control device kept open by ctrl_device_keep_open()
+ */
+void ctrl_device_release()
+{
+	if (ctrl_fd >= 0) {
+		close(ctrl_fd);
+		ctrl_fd = -1;
+	}
+}
+
 /**
  * @brief print spinning wheel
  */
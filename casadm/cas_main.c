@@ -15,6 +15,8 @@
 #include <fstab.h>
 #include <sys/ioctl.h>
 #include <sys/stat.h>
+#include <sys/types.h>
+#include <sys/wait.h>
 #include <linux/fs.h>
 #include "argp.h"
 #include "cas_lib.h"
@@ -1867,6 +1869,31 @@ int handle_zero()
 	return zero_md(zero_params.device);
 }
 
+static int handle_batch();
+
+struct {
+	const char *file;
+} static batch_params = {
+	.file = NULL,
+};
+
+static cli_option batch_options[] = {
+	{'f', "file", "Read commands from file instead of standard input", 1, "FILE", 0},
+	{0}
+};
+
+/* Parser of option for batch command */
+int batch_handle_option(char *opt, const char **arg)
+{
+	if (!strcmp(opt, "file")) {
+		batch_params.file = arg[0];
+	} else {
+		return FAILURE;
+	}
+
+	return SUCCESS;
+}
+
 static cli_command cas_commands[] = {
 		{
 			.name = "start-cache",
@@ -2053,6 +2080,19 @@ static cli_command cas_commands[] = {
 			.flags = CLI_SU_REQUIRED,
 			.help = NULL
 		},
+		{
+			.name = "batch",
+			.desc = "Run multiple commands in single casadm process",
+			.long_desc = "Run commands read line by line from standard input "
+				"or file (without leading casadm). For each command single "
+				"line with JSON object holding its line number, exit code, "
+				"standard output and standard error is printed",
+			.options = batch_options,
+			.command_handle_opts = batch_handle_option,
+			.handle = handle_batch,
+			.flags = CLI_SU_REQUIRED,
+			.help = NULL,
+		},
 		{
 			.name = "script",
 			.options = script_params_options,
@@ -2080,6 +2120,233 @@ static int handle_help()
 	return 0;
 }
 
+#define BATCH_MAX_ARGS 64
+#define BATCH_MAX_LINE 4096
+
+/*
+ * Split batch command line into arguments in place. Arguments are separated
+ * by whitespaces, single or double quotes group characters into argument,
+ * line starting with '#' is a comment. Returns number of arguments or -1
+ * if line is invalid.
+ */
+static int batch_split_line(char *line, const char **args, int max_args)
+{
+	char *src = line, *dst = line;
+	char quote;
+	int count = 0;
+
+	while (true) {
+		while (isspace((unsigned char)*src))
+			src++;
+
+		if (!*src || (!count && *src == '#'))
+			break;
+
+		if (count == max_args)
+			return -1;
+
+		args[count++] = dst;
+		quote = 0;
+		while (*src && (quote || !isspace((unsigned char)*src))) {
+			if (quote && *src == quote) {
+				quote = 0;
+				src++;
+			} else if (!quote && (*src == '\'' || *src == '"')) {
+				quote = *src++;
+			} else {
+				*dst++ = *src++;
+			}
+		}
+
+		if (quote)
+			return -1;
+
+		if (*src)
+			src++;
+		*dst++ = '\0';
+	}
+
+	return count;
+}
+
+/*
+ * Print content of file as JSON string. Bytes outside of ASCII are printed
+ * as \u00XX escapes, so that output is valid JSON also for non UTF-8 device
+ * paths or messages - reader maps escapes back to bytes and decodes them.
+ */
+static void batch_print_json_string(FILE *out, FILE *in)
+{
+	int c;
+
+	fputc('"', out);
+	rewind(in);
+	while ((c = fgetc(in)) != EOF) {
+		switch (c) {
+		case '"':
+			fputs("\\\"", out);
+			break;
+		case '\\':
+			fputs("\\\\", out);
+			break;
+		case '\n':
+			fputs("\\n", out);
+			break;
+		case '\t':
+			fputs("\\t", out);
+			break;
+		default:
+			if (c < 0x20 || c >= 0x7f)
+				fprintf(out, "\\u%04x", c);
+			else
+				fputc(c, out);
+		}
+	}
+	fputc('"', out);
+}
+
+static void batch_print_result(int line_no, int exit_code, FILE *out_file,
+		FILE *err_file)
+{
+	printf("{\"line\": %d, \"exit_code\": %d, \"stdout\": ", line_no, exit_code);
+	batch_print_json_string(stdout, out_file);
+	printf(", \"stderr\": ");
+	batch_print_json_string(stdout, err_file);
+	printf("}\n");
+	fflush(stdout);
+}
+
+/*
+ * Run single command in forked child process, so that each command starts
+ * with clean parser and handler state. Child parses its arguments on its own,
+ * batch only saves exec of casadm and opening of control device for every
+ * command. Child writes its output to given files.
+ */
+static int batch_run_command(app *app_values, int argc, const char **argv,
+		FILE *out_file, FILE *err_file)
+{
+	pid_t pid;
+	int status, null_fd;
+
+	fflush(stdout);
+	fflush(stderr);
+
+	pid = fork();
+	if (pid < 0) {
+		fprintf(err_file, "Failed to run command\n");
+		return FAILURE;
+	}
+
+	if (pid == 0) {
+		/* Commands must not consume following lines of batch */
+		null_fd = open("/dev/null", O_RDONLY);
+		if (null_fd >= 0)
+			dup2(null_fd, STDIN_FILENO);
+		dup2(fileno(out_file), STDOUT_FILENO);
+		dup2(fileno(err_file), STDERR_FILENO);
+		exit(args_parse(app_values, cas_commands, argc, argv));
+	}
+
+	if (waitpid(pid, &status, 0) < 0 || !WIFEXITED(status)) {
+		fprintf(err_file, "Command terminated abnormally\n");
+		return FAILURE;
+	}
+
+	return WEXITSTATUS(status);
+}
+
+static int handle_batch()
+{
+	app app_values;
+	FILE *in = stdin;
+	FILE *out_file, *err_file;
+	char line[BATCH_MAX_LINE];
+	const char *args[BATCH_MAX_ARGS + 1];
+	int count, exit_code, c;
+	int line_no = 0, status = SUCCESS;
+	size_t len;
+
+	app_values.name = MAN_PAGE;
+	app_values.info = "<command> [option...]";
+	app_values.title = HELP_HEADER;
+	app_values.doc = HELP_FOOTER;
+	app_values.man = MAN_PAGE;
+	app_values.block = 0;
+
+	if (batch_params.file) {
+		in = fopen(batch_params.file, "r");
+		if (!in) {
+			cas_printf(LOG_ERR, "Couldn't open file %s\n", batch_params.file);
+			return FAILURE;
+		}
+	}
+
+	/* Control device is opened once and shared by all commands. If it
+	 * fails, each command reports the error on its own. */
+	ctrl_device_keep_open();
+
+	while (fgets(line, sizeof(line), in)) {
+		line_no++;
+
+		out_file = tmpfile();
+		err_file = tmpfile();
+		if (!out_file || !err_file) {
+			cas_printf(LOG_ERR, "Failed to create temporary file\n");
+			status = FAILURE;
+			if (out_file)
+				fclose(out_file);
+			if (err_file)
+				fclose(err_file);
+			break;
+		}
+
+		len = strnlen(line, sizeof(line));
+		if (len && line[len - 1] == '\n') {
+			line[len - 1] = '\0';
+			count = batch_split_line(line, &args[1], BATCH_MAX_ARGS);
+		} else if (feof(in)) {
+			count = batch_split_line(line, &args[1], BATCH_MAX_ARGS);
+		} else {
+			/* Skip remaining part of too long line */
+			while ((c = fgetc(in)) != EOF && c != '\n')
+				;
+			count = -1;
+		}
+
+		if (count == 0) {
+			fclose(out_file);
+			fclose(err_file);
+			continue;
+		}
+
+		if (count < 0) {
+			fprintf(err_file, "Invalid command line\n");
+			exit_code = FAILURE;
+		} else if (!strcmp(args[1], "--batch")) {
+			fprintf(err_file, "Nested batch is not allowed\n");
+			exit_code = FAILURE;
+		} else {
+			args[0] = app_values.name;
+			args[count + 1] = NULL;
+			exit_code = batch_run_command(&app_values, count + 1, args,
+					out_file, err_file);
+		}
+
+		batch_print_result(line_no, exit_code, out_file, err_file);
+		if (exit_code != SUCCESS)
+			status = FAILURE;
+
+		fclose(out_file);
+		fclose(err_file);
+	}
+
+	ctrl_device_release();
+
+	if (in != stdin)
+		fclose(in);
+
+	return status;
+}
+
 int main(int argc, const char *argv[])
 {
 	int blocked = 0;
@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: BSD-3-Clause-Clear
 #
 
+import pytest
 import sys
 
 
@@ -13,3 +14,13 @@ def pytest_configure(config):
         raise Exception("Couldn't import helpers")
 
     sys.path.append(helpers.find_repo_root() + "/utils")
+
+
+@pytest.fixture(autouse=True)
+def invalidate_device_state():
+    # Runtime device state is cached process-wide - don't leak it between tests
+    import opencas
+
+    opencas.DeviceStateSnapshot.invalidate()
+    yield
+    opencas.DeviceStateSnapshot.invalidate()
@@ -4,6 +4,8 @@
 #
 
 import unittest.mock as mock
+import ctypes
+import errno
 import re
 import os
 from io import StringIO
@@ -121,3 +123,141 @@ class CopyableMock(mock.Mock):
         copy = mock.Mock(spec=self)
         self.copies += [copy]
         return copy
+
+
+class FakeCtrlDevice(object):
+    """
+    Stand-in for /dev/cas_ctrl - answers cas_ioctl requests from in-memory
+    description of caches, cores and core pool, as kernel module would.
+
+    caches: {cache_id: {"device", "state", "mode", "dirty", "flushed",
+                        "params", "stats", "io_classes", "cores": {core_id: {
+                        "device", "state", "dirty", "flushed", "params",
+                        "stats", "io_classes"}}}}
+
+    io_classes: {io_class_id: stats} - stats of configured io classes
+    """
+
+    def __init__(self, caches=None, core_pool=None, check_device=None):
+        import cas_ioctl
+
+        self.ioctl_mod = cas_ioctl
+        self.caches = caches or {}
+        self.core_pool = core_pool or []
+        self.check_device = check_device or {}
+        self.requests = []
+        self.handlers = {
+            cas_ioctl.KCAS_IOCTL_GET_CACHE_COUNT: self._cache_count,
+            cas_ioctl.KCAS_IOCTL_LIST_CACHE: self._list_cache,
+            cas_ioctl.KCAS_IOCTL_CACHE_INFO: self._cache_info,
+            cas_ioctl.KCAS_IOCTL_CORE_INFO: self._core_info,
+            cas_ioctl.KCAS_IOCTL_GET_CORE_POOL_COUNT: self._core_pool_count,
+            cas_ioctl.KCAS_IOCTL_GET_CORE_POOL_PATHS: self._core_pool_paths,
+            cas_ioctl.KCAS_IOCTL_CACHE_CHECK_DEVICE: self._check_device,
+            cas_ioctl.KCAS_IOCTL_GET_CACHE_PARAM: self._cache_param,
+            cas_ioctl.KCAS_IOCTL_GET_CORE_PARAM: self._core_param,
+            cas_ioctl.KCAS_IOCTL_GET_STATS: self._stats,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    def ioctl(self, request, cmd):
+        self.requests += [request]
+        if request not in self.handlers:
+            raise self.ioctl_mod.IoctlError(request, errno.ENOTTY)
+        self.handlers[request](request, cmd)
+
+    def _fail(self, request, cmd, err=None):
+        cmd.ext_err_code = 1
+        raise self.ioctl_mod.IoctlError(request, err or errno.EINVAL, 1)
+
+    def _cache(self, request, cmd):
+        if cmd.cache_id not in self.caches:
+            self._fail(request, cmd, errno.ENODEV)
+        return self.caches[cmd.cache_id]
+
+    def _cache_count(self, request, cmd):
+        cmd.cache_count = len(self.caches)
+
+    def _list_cache(self, request, cmd):
+        ids = sorted(self.caches)[cmd.id_position:]
+        ids = ids[:cmd.in_out_num]
+        for i, cache_id in enumerate(ids):
+            cmd.cache_id_tab[i] = cache_id
+        cmd.in_out_num = len(ids)
+        if len(ids) < self.ioctl_mod.CACHE_LIST_ID_LIMIT:
+            raise self.ioctl_mod.IoctlError(request, errno.EINVAL)
+
+    def _cache_info(self, request, cmd):
+        cache = self._cache(request, cmd)
+        cmd.cache_path_name = cache["device"].encode()
+        cmd.info.state = cache.get("state", 1)
+        cmd.info.cache_mode = self.ioctl_mod.cache_modes.index(
+            cache.get("mode", "wt")
+        )
+        cmd.info.dirty = cache.get("dirty", 0)
+        cmd.info.flushed = cache.get("flushed", 0)
+        cores = sorted(cache.get("cores", {}))
+        cmd.info.core_count = len(cores)
+        for i, core_id in enumerate(cores):
+            cmd.core_id[i] = core_id
+
+    def _core(self, request, cmd):
+        cores = self._cache(request, cmd).get("cores", {})
+        if cmd.core_id not in cores:
+            self._fail(request, cmd, errno.ENODEV)
+        return cores[cmd.core_id]
+
+    def _core_info(self, request, cmd):
+        core = self._core(request, cmd)
+        cmd.core_path_name = core["device"].encode()
+        cmd.state = self.ioctl_mod.core_states.index(core.get("state", "Active"))
+        cmd.info.dirty = core.get("dirty", 0)
+        cmd.info.flushed = core.get("flushed", 0)
+
+    def _core_pool_count(self, request, cmd):
+        cmd.core_pool_count = len(self.core_pool)
+
+    def _core_pool_paths(self, request, cmd):
+        for i, path in enumerate(self.core_pool[:cmd.core_pool_count]):
+            data = path.encode() + b"\0"
+            ctypes.memmove(
+                cmd.core_path_tab + i * self.ioctl_mod.MAX_STR_LEN, data, len(data)
+            )
+
+    def _check_device(self, request, cmd):
+        path = cmd.path_name.decode()
+        if path not in self.check_device:
+            self._fail(request, cmd, errno.ENODEV)
+        for field, value in self.check_device[path].items():
+            setattr(cmd, field, value)
+
+    def _cache_param(self, request, cmd):
+        params = self._cache(request, cmd).get("params", {})
+        cmd.param_value = params.get(cmd.param_id, 0)
+
+    def _core_param(self, request, cmd):
+        params = self._core(request, cmd).get("params", {})
+        cmd.param_value = params.get(cmd.param_id, 0)
+
+    def _stats(self, request, cmd):
+        if cmd.core_id == self.ioctl_mod.OCF_CORE_ID_INVALID:
+            device = self._cache(request, cmd)
+        else:
+            device = self._core(request, cmd)
+        if cmd.part_id == self.ioctl_mod.OCF_IO_CLASS_INVALID:
+            stats = device.get("stats", {})
+        elif cmd.part_id in device.get("io_classes", {}):
+            stats = device["io_classes"][cmd.part_id]
+        else:
+            self._fail(request, cmd, errno.ENOENT)
+        for group, counters in stats.items():
+            for name, value in counters.items():
+                getattr(getattr(cmd, group), name).value = value
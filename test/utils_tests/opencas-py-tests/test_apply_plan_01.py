@@ -0,0 +1,157 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import pytest
+from unittest.mock import patch
+
+import opencas
+import helpers as h
+
+
+def get_config(caches, cores):
+    config = opencas.cas_config()
+    for cache_id, device, mode, params in caches:
+        config.insert_cache(opencas.cas_config.cache_config(cache_id, device, mode, **params))
+    for cache_id, core_id, device in cores:
+        config.insert_core(opencas.cas_config.core_config(cache_id, core_id, device))
+    return config
+
+
+def get_state(caches, cores):
+    dev_list = []
+    for cache_id, disk, mode in caches:
+        dev_list.append({"type": "cache", "id": str(cache_id), "disk": disk,
+                         "status": "Running", "write policy": mode, "device": "-"})
+        for core_cache_id, core_id, core_disk, status in cores:
+            if core_cache_id == cache_id:
+                dev_list.append({"type": "core", "id": str(core_id), "disk": core_disk,
+                                 "status": status, "write policy": "-",
+                                 "device": "/dev/cas{0}-{1}".format(cache_id, core_id)})
+    return opencas.DeviceStateSnapshot(dev_list)
+
+
+def get_descriptions(plan):
+    return [[operation.description for operation in step] for step in plan.steps]
+
+
+@pytest.fixture(autouse=True)
+def params():
+    with patch("opencas.get_params") as mock_params:
+        mock_params.return_value = {"Cleaning policy type": "alru",
+                                    "Promotion policy type": "always"}
+        yield mock_params
+
+
+def test_apply_plan_no_changes():
+    config = get_config([(1, "/dev/nvme0n1", "wt", {})], [(1, 1, "/dev/sda")])
+    state = get_state([(1, "/dev/nvme0n1", "wt")], [(1, 1, "/dev/sda", "Active")])
+
+    plan = opencas.apply_plan.compute(config, state)
+
+    assert plan.is_empty()
+    assert plan.conflicts == []
+
+
+def test_apply_plan_minimal_operations(tmp_path):
+    ioclass_file = tmp_path / "ioclass.csv"
+    ioclass_file.write_text("IO class id,IO class name,Eviction priority,Allocation\n"
+                            "0,unclassified,22,1\n1,metadata&done,0,1\n")
+    config = get_config(
+        [(1, "/dev/nvme0n1", "wb", {"cleaning_policy": "acp"}),
+         (2, "/dev/nvme1n1", "wt", {"ioclass_file": str(ioclass_file),
+                                    "promotion_policy": "always"}),
+         (3, "/dev/nvme2n1", "wt", {})],
+        [(1, 1, "/dev/sda"), (1, 2, "/dev/sdx"), (1, 4, "/dev/sdd"),
+         (2, 1, "/dev/sde"), (3, 1, "/dev/sdf")])
+    state = get_state(
+        [(1, "/dev/nvme0n1", "wt"), (2, "/dev/nvme1n1", "wt"), (4, "/dev/nvme3n1", "wb")],
+        [(1, 1, "/dev/sda", "Active"), (1, 2, "/dev/sdb", "Active"),
+         (1, 3, "/dev/sdc", "Inactive"), (2, 1, "/dev/sde", "Active"),
+         (4, 1, "/dev/sdg", "Active")])
+
+    with patch("opencas.casadm.run_cmd") as mock_run:
+        mock_run.return_value = h.get_process_mock(
+            0, "IO class id,IO class name,Eviction priority,Allocation\n"
+            "0,unclassified,22,1\n1,metadata&done,0,1\n", "")
+        plan = opencas.apply_plan.compute(config, state)
+
+    assert get_descriptions(plan) == [
+        ["remove core 2 (/dev/sdb) from cache 1"],
+        ["remove inactive core 3 (/dev/sdc) from cache 1"],
+        ["stop cache 4 (/dev/nvme3n1)"],
+        ["start cache 3 (/dev/nvme2n1) in wt mode",
+         "set cache 1 mode wt -> wb",
+         "set cache 1 cleaning policy alru -> acp"],
+        ["add core 2 (/dev/sdx) to cache 1",
+         "add core 4 (/dev/sdd) to cache 1",
+         "add core 1 (/dev/sdf) to cache 3"],
+    ]
+    # Io classes matched loaded configuration, so weren't reloaded
+    mock_run.assert_called_once_with(
+        opencas.casadm.io_class_list_cmd(2))
+
+
+def test_apply_plan_stacked_cores():
+    config = get_config([(1, "/dev/nvme0n1", "wt", {}), (2, "/dev/nvme1n1", "wt", {})],
+                        [(1, 2, "/dev/sdz")])
+    state = get_state([(1, "/dev/nvme0n1", "wt"), (2, "/dev/nvme1n1", "wt")],
+                      [(1, 1, "/dev/sda", "Active"), (2, 1, "/dev/cas1-1", "Active")])
+
+    plan = opencas.apply_plan.compute(config, state)
+
+    # Upper core using exported volume of lower one goes first
+    assert get_descriptions(plan) == [
+        ["remove core 1 (/dev/cas1-1) from cache 2"],
+        ["remove core 1 (/dev/sda) from cache 1"],
+        ["add core 2 (/dev/sdz) to cache 1"],
+    ]
+
+
+def test_apply_plan_cache_device_conflict():
+    config = get_config([(1, "/dev/nvme1n1", "wb", {})], [(1, 2, "/dev/sdb")])
+    state = get_state([(1, "/dev/nvme0n1", "wt")], [(1, 1, "/dev/sda", "Active")])
+
+    plan = opencas.apply_plan.compute(config, state)
+
+    assert plan.is_empty()
+    assert len(plan.conflicts) == 1
+    assert "/dev/nvme0n1" in plan.conflicts[0]
+
+
+def test_apply_plan_leaving_write_back_flushes():
+    config = get_config([(1, "/dev/nvme0n1", "wt", {})], [])
+    state = get_state([(1, "/dev/nvme0n1", "wb")], [])
+
+    plan = opencas.apply_plan.compute(config, state)
+
+    cmd = plan.steps[0][0].cmds[0]
+    assert cmd[cmd.index("--cache-mode") + 1] == "wt"
+    assert cmd[cmd.index("--flush-cache") + 1] == "yes"
+
+
+@patch("opencas.casadm.run_batch")
+def test_apply_plan_run(mock_batch):
+    config = get_config([(1, "/dev/nvme0n1", "wb", {}), (2, "/dev/nvme1n1", "wt", {})],
+                        [(1, 1, "/dev/sda"), (1, 2, "/dev/sdb"), (2, 1, "/dev/sdc")])
+    state = get_state([(1, "/dev/nvme0n1", "wt"), (2, "/dev/nvme1n1", "wt")], [])
+    plan = opencas.apply_plan.compute(config, state)
+
+    def run_batch(cmds):
+        return [opencas.casadm.batch_result(
+            1 if "/dev/sdb" in cmd else 0, "", "No such device" if "/dev/sdb" in cmd else "")
+            for cmd in cmds]
+
+    mock_batch.side_effect = run_batch
+
+    results = plan.run(jobs=2)
+
+    assert [(operation.description, error) for operation, error in results] == [
+        ("set cache 1 mode wt -> wb", None),
+        ("add core 1 (/dev/sda) to cache 1", None),
+        ("add core 2 (/dev/sdb) to cache 1", "No such device"),
+        ("add core 1 (/dev/sdc) to cache 2", None),
+    ]
+    # One batch per cache in each step
+    assert mock_batch.call_count == 3
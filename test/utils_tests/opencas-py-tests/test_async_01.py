@@ -0,0 +1,175 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import asyncio
+import os
+import socket
+import sys
+import pytest
+from unittest.mock import patch
+
+import opencas
+from test_device_state_01 import get_stacked_list
+from test_udev_monitor_01 import kernel_event
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def fake_casadm(tmp_path, monkeypatch):
+    """Script recording its arguments, failing when called with --fail"""
+    log = tmp_path / "casadm.log"
+    script = tmp_path / "casadm"
+    script.write_text(
+        "#!{0}\n"
+        "import sys\n"
+        "with open({1!r}, 'a') as f:\n"
+        "    f.write(' '.join(sys.argv[1:]) + '\\n')\n"
+        "if '--fail' in sys.argv:\n"
+        "    sys.stderr.write('failed\\n')\n"
+        "    sys.exit(3)\n"
+        "print('ok')\n".format(sys.executable, str(log))
+    )
+    os.chmod(str(script), 0o755)
+    monkeypatch.setattr(opencas.casadm, "casadm_path", str(script))
+    return log
+
+
+def test_async_casadm_run_cmd(fake_casadm):
+    result = run(opencas.async_casadm.get_version())
+
+    assert result.exit_code == 0
+    assert result.stdout == "ok\n"
+    assert fake_casadm.read_text() == "--version --output-format csv\n"
+
+    with pytest.raises(opencas.casadm.CasadmError) as e:
+        run(opencas.async_casadm.run_cmd([opencas.casadm.casadm_path, "--fail"]))
+
+    assert e.value.result.exit_code == 3
+    assert e.value.result.stderr == "failed\n"
+
+
+def test_async_casadm_timeline(fake_casadm, tmp_path):
+    journal = str(tmp_path / "timeline.jsonl")
+    opencas.timeline.open("casctl stop", journal)
+    try:
+        run(opencas.async_casadm.add_core("/dev/sda", 1, core_id=2))
+    finally:
+        opencas.timeline.close()
+
+    span, = opencas.timeline.load(journal)
+    assert span["name"] == opencas.casadm.get_operation(
+        opencas.casadm.add_core_cmd("/dev/sda", 1, core_id=2))
+    assert span["devices"] == ["/dev/sda"]
+    assert span["exit_code"] == 0
+    assert span["result"] == "ok"
+
+
+@patch("opencas.DeviceStateSnapshot.invalidate")
+def test_async_casadm_invalidates_device_state(mock_invalidate, fake_casadm):
+    run(opencas.async_casadm.list_caches())
+    mock_invalidate.assert_not_called()
+
+    run(opencas.async_casadm.add_core("/dev/sda", 1, core_id=2))
+
+    mock_invalidate.assert_called_once()
+    assert fake_casadm.read_text().splitlines()[-1] == \
+        "--script --add-core --core-device /dev/sda --cache-id 1 --core-id 2"
+
+
+def test_run_parallel_async_bounded():
+    running = [0]
+    max_running = [0]
+
+    async def func(item):
+        running[0] += 1
+        max_running[0] = max(max_running[0], running[0])
+        await asyncio.sleep(0.01 * (5 - item))
+        running[0] -= 1
+        if item == 3:
+            raise ValueError("bad item")
+        return item * 10
+
+    tasks = run(opencas.run_parallel_async(func, [1, 2, 3, 4, 5], jobs=2))
+
+    assert max_running[0] == 2
+    assert [task.result for task in tasks] == [10, 20, None, 40, 50]
+    assert isinstance(tasks[2].error, ValueError)
+
+
+@patch("opencas.async_casadm.stop_cache")
+@patch("opencas.async_casadm.remove_core")
+@patch("opencas.get_caches_list_async")
+def test_stop_async(mock_list, mock_remove, mock_stop):
+    calls = []
+
+    async def get_caches_list():
+        return get_stacked_list()
+
+    async def remove_core(cache_id, core_id, detach, force):
+        calls.append((cache_id, core_id))
+        if (cache_id, core_id) == (2, 1):
+            raise opencas.casadm.CasadmError(opencas.casadm.batch_result(1, "", "busy"))
+
+    async def stop_cache(cache_id, no_flush):
+        calls.append(cache_id)
+
+    mock_list.side_effect = get_caches_list
+    mock_remove.side_effect = remove_core
+    mock_stop.side_effect = stop_cache
+
+    with pytest.raises(opencas.CompoundException) as e:
+        run(opencas.stop_async(flush=True, jobs=4))
+
+    # Upper level first, core under failed one is not detached
+    assert set(calls[:2]) == {(2, 1), (2, 2)}
+    assert calls[2] == (1, 10)
+    # Caches are stopped one after another, in the same order as by stop()
+    assert calls[3:] == [1, 2]
+    assert len(e.value.exception_list) == 2
+    assert "Core /dev/cas2-1 using it could not be detached" in \
+        str(e.value.exception_list[1])
+
+
+@patch("opencas.get_caches_list_async")
+@patch("opencas.cas_config.from_file")
+def test_wait_for_startup_async_wakes_up_on_event(mock_config, mock_list):
+    mock_config.return_value.get_startup_cores.return_value = [
+        opencas.cas_config.core_config(1, 1, "/dev/sda")
+    ]
+    started = [False]
+
+    async def get_caches_list():
+        return get_stacked_list() if started[0] else []
+
+    mock_list.side_effect = get_caches_list
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    async def add_core():
+        await asyncio.sleep(0.2)
+        started[0] = True
+        sender.send(kernel_event("add", "cas1-1"))
+
+    async def main():
+        with opencas.udev_monitor(receiver, ["/dev/sda"]) as monitor:
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            result, _ = await asyncio.gather(
+                opencas.wait_for_startup_async(timeout=10, interval=5, monitor=monitor),
+                add_core())
+            return result, loop.time() - start
+
+    result, duration = run(main())
+    sender.close()
+
+    assert result == []
+    assert duration < 1
+    assert mock_list.call_count == 2
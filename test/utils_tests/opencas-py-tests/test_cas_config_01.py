@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: BSD-3-Clause-Clear
 #
 
+import os
 import pytest
 from unittest.mock import patch, mock_open
 from textwrap import dedent
@@ -272,37 +273,88 @@ def test_cas_config_add_same_core_symlinked_02(mock_realpath):
         config.insert_core(core_symlinked)
 
 
-@patch("os.path.realpath")
-@patch("os.listdir")
-def test_cas_config_get_by_id_path(mock_listdir, mock_realpath):
-    mock_listdir.return_value = [
-        "wwn-1337deadbeef-x0x0",
-        "wwn-1337deadbeef-x0x0-part1",
-        "nvme-INTEL_SSDAAAABBBBBCCC_0984547ASDDJHHHFH",
-    ]
-    mock_realpath.side_effect = (
-        lambda x: "/dev/dummy1"
-        if x == "/dev/disk/by-id/wwn-1337deadbeef-x0x0-part1"
-        else x
-    )
+@pytest.fixture
+def by_id_dir(tmp_path, monkeypatch):
+    """
+    Fake /dev/disk/by-id with links to devices in fake /dev
+    """
+    dev = tmp_path / "dev"
+    dev.mkdir()
+    for name in ["sda", "sda1", "nvme0n1"]:
+        (dev / name).write_text("")
 
-    path = opencas.cas_config.get_by_id_path("/dev/dummy1")
+    by_id = tmp_path / "by-id"
+    by_id.mkdir()
+    (by_id / "wwn-1337deadbeef-x0x0").symlink_to("../dev/sda")
+    (by_id / "wwn-1337deadbeef-x0x0-part1").symlink_to("../dev/sda1")
+    (by_id / "nvme-INTEL_SSDAAAABBBBBCCC_0984547ASDDJHHHFH").symlink_to("../dev/nvme0n1")
 
-    assert path == "/dev/disk/by-id/wwn-1337deadbeef-x0x0-part1"
+    monkeypatch.setattr(opencas.cas_config, "by_id_dir", str(by_id))
+    return tmp_path
 
 
-@patch("os.path.realpath")
-@patch("os.listdir")
-def test_cas_config_get_by_id_path_not_found(mock_listdir, mock_realpath):
-    mock_listdir.return_value = [
-        "wwn-1337deadbeef-x0x0",
-        "wwn-1337deadbeef-x0x0-part1",
-        "nvme-INTEL_SSDAAAABBBBBCCC_0984547ASDDJHHHFH",
-    ]
-    mock_realpath.side_effect = lambda x: x
+def test_cas_config_get_by_id_path(by_id_dir):
+    path = opencas.cas_config.get_by_id_path(str(by_id_dir / "dev/sda1"))
+
+    assert path == str(by_id_dir / "by-id/wwn-1337deadbeef-x0x0-part1")
+
+
+def test_cas_config_get_by_id_path_not_found(by_id_dir):
+    (by_id_dir / "dev/dummy1").write_text("")
 
     with pytest.raises(ValueError):
-        path = opencas.cas_config.get_by_id_path("/dev/dummy1")
+        path = opencas.cas_config.get_by_id_path(str(by_id_dir / "dev/dummy1"))
+
+
+def test_cas_config_get_by_id_path_single_scan(by_id_dir):
+    """
+    Check that links are scanned once and rescanned only if directory changes
+    """
+    with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+        for name in ["sda", "sda1", "nvme0n1"]:
+            opencas.cas_config.get_by_id_path(str(by_id_dir / "dev" / name))
+
+        assert mock_scandir.call_count == 1
+
+        (by_id_dir / "dev/sdb").write_text("")
+        (by_id_dir / "by-id/wwn-2").symlink_to("../dev/sdb")
+        os.utime(str(by_id_dir / "by-id"), ns=(0, 10 ** 9))
+
+        path = opencas.cas_config.get_by_id_path(str(by_id_dir / "dev/sdb"))
+
+        assert path == str(by_id_dir / "by-id/wwn-2")
+        assert mock_scandir.call_count == 2
+
+
+def test_cas_config_get_by_id_path_stale_link(by_id_dir):
+    """
+    Check that cached link no longer pointing at device isn't returned
+    """
+    by_id = by_id_dir / "by-id"
+    opencas.cas_config.get_by_id_path(str(by_id_dir / "dev/sda"))
+    mtime = os.stat(str(by_id)).st_mtime_ns
+
+    # Retarget links keeping directory mtime, so only validation catches it
+    (by_id / "wwn-1337deadbeef-x0x0").unlink()
+    (by_id / "wwn-1337deadbeef-x0x0").symlink_to("../dev/nvme0n1")
+    (by_id / "scsi-1").symlink_to("../dev/sda")
+    os.utime(str(by_id), ns=(0, mtime))
+
+    path = opencas.cas_config.get_by_id_path(str(by_id_dir / "dev/sda"))
+
+    assert path == str(by_id / "scsi-1")
+
+
+def test_cas_config_get_by_id_path_deterministic(by_id_dir):
+    """
+    Check that first link in name order is chosen if several point at device
+    """
+    (by_id_dir / "by-id/scsi-35000c500a1b2c3d4").symlink_to("../dev/sda")
+    (by_id_dir / "by-id/ata-DUMMY_DISK_SERIAL").symlink_to("../dev/sda")
+
+    path = opencas.cas_config.get_by_id_path(str(by_id_dir / "dev/sda"))
+
+    assert path == str(by_id_dir / "by-id/ata-DUMMY_DISK_SERIAL")
 
 
 @pytest.mark.parametrize(
@@ -358,6 +410,7 @@ def test_cas_config_from_file_to_file(
     mock_file,
     caches_config,
     cores_config,
+    tmp_path,
 ):
     """
     1. Read config from mocked file with parametrized caches and cores section
@@ -384,10 +437,11 @@ def test_cas_config_from_file_to_file(
 
     config = opencas.cas_config.from_file("/dummy/file.conf")
 
-    config.write("/dummy/file.conf")
+    # Config is written through temporary file, so target real directory
+    config.write(str(tmp_path / "file.conf"))
 
-    f = mock_file("/dummy/file.conf", "r")
-    contents_hashed = h.get_hashed_config_list(f)
+    contents = (tmp_path / "file.conf").read_text().splitlines()
+    contents_hashed = h.get_hashed_config_list(contents)
 
     assert contents_hashed[0] == "version=3.8.0"
     assert contents_hashed.count("[caches]") == 1
@@ -452,6 +506,7 @@ def test_cas_config_from_file_insert_cache_insert_core_to_file(
     mock_file,
     caches_config,
     cores_config,
+    tmp_path,
 ):
     """
     1. Read config from mocked file with parametrized caches and cores section
@@ -478,10 +533,11 @@ def test_cas_config_from_file_insert_cache_insert_core_to_file(
     config.insert_cache(opencas.cas_config.cache_config(5, "/dev/mango", "WT"))
     config.insert_core(opencas.cas_config.core_config(5, 1, "/dev/mango_core"))
 
-    config.write("/dummy/file.conf")
+    # Config is written through temporary file, so target real directory
+    config.write(str(tmp_path / "file.conf"))
 
-    f = mock_file("/dummy/file.conf", "r")
-    contents_hashed = h.get_hashed_config_list(f)
+    contents = (tmp_path / "file.conf").read_text().splitlines()
+    contents_hashed = h.get_hashed_config_list(contents)
 
     caches_index = contents_hashed.index("[caches]")
     cores_index = contents_hashed.index("[cores]")
@@ -495,3 +551,70 @@ def test_cas_config_from_file_insert_cache_insert_core_to_file(
     assert set(contents_hashed[cores_index + 1 :]) - set(cores_hashed) == set(
         ["51/dev/mango_core"]
     )
+
+
+def get_multilevel_config(cores):
+    config = opencas.cas_config()
+    for cache_id in [1, 2, 3]:
+        config.insert_cache(
+            opencas.cas_config.cache_config(cache_id, "/dev/cache{}".format(cache_id), "WT")
+        )
+    for cache_id, core_id, device in cores:
+        config.insert_core(opencas.cas_config.core_config(cache_id, core_id, device))
+    return config
+
+
+def get_levels_ids(levels):
+    return [[(core.cache_id, core.core_id) for core in level] for level in levels]
+
+
+@patch("opencas.cas_config.get_by_id_path")
+def test_cas_config_get_core_levels(mock_by_id):
+    mock_by_id.side_effect = ValueError()
+    config = get_multilevel_config(
+        [
+            (3, 1, "/dev/cas2-1"),
+            (1, 1, "/dev/sda"),
+            (2, 1, "/dev/cas1-1"),
+            (1, 2, "/dev/sdb"),
+            (2, 2, "/dev/cas1-2"),
+            (2, 3, "/dev/sdc"),
+        ]
+    )
+
+    levels = config.get_core_levels()
+
+    assert get_levels_ids(levels) == [
+        [(1, 1), (1, 2), (2, 3)],
+        [(2, 1), (2, 2)],
+        [(3, 1)],
+    ]
+
+
+@patch("opencas.cas_config.get_by_id_path")
+def test_cas_config_get_core_levels_unknown_lower_core(mock_by_id):
+    """
+    Exported device of core not present in config is not a dependency
+    """
+    mock_by_id.side_effect = ValueError()
+    config = get_multilevel_config([(2, 1, "/dev/cas1-5"), (1, 1, "/dev/sda")])
+
+    assert get_levels_ids(config.get_core_levels()) == [[(2, 1), (1, 1)]]
+
+
+@patch("opencas.cas_config.get_by_id_path")
+def test_cas_config_get_core_levels_cycle(mock_by_id):
+    mock_by_id.side_effect = ValueError()
+    config = get_multilevel_config(
+        [
+            (1, 1, "/dev/sda"),
+            (1, 2, "/dev/cas3-1"),
+            (2, 1, "/dev/cas1-2"),
+            (3, 1, "/dev/cas2-1"),
+        ]
+    )
+
+    with pytest.raises(opencas.cas_config.RecursiveCoreConfigException) as e:
+        config.get_core_levels()
+
+    assert (e.value.core.cache_id, e.value.core.core_id) == (1, 2)
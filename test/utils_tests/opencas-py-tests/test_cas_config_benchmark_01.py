@@ -0,0 +1,58 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import time
+from unittest.mock import patch
+
+import opencas
+
+CACHES = 4
+CORES_PER_CACHE = 4000
+
+
+def write_synthetic_config(path):
+    """
+    Config with CACHES * (CORES_PER_CACHE + 1) (~16k) device lines
+    """
+    lines = ["version=19.3.0", "[caches]"]
+    for cache_id in range(1, CACHES + 1):
+        lines.append("{0}\t/dev/nvme{0}n1\tWB".format(cache_id))
+    lines.append("[cores]")
+    for cache_id in range(1, CACHES + 1):
+        for core_id in range(1, CORES_PER_CACHE + 1):
+            lines.append("{0}\t{1}\t/dev/disk{0}-{1}".format(cache_id, core_id))
+
+    path.write_text("\n".join(lines) + "\n")
+    return len(lines)
+
+
+@patch("opencas.cas_config.get_by_id_path")
+@patch("opencas.cas_config.core_config.validate_config")
+@patch("opencas.cas_config.cache_config.validate_config")
+@patch("os.path.realpath")
+def test_cas_config_benchmark_load_16k(
+    mock_realpath, mock_validate_cache, mock_validate_core, mock_by_id, tmp_path
+):
+    """
+    Load synthetic ~16k line config - conflict detection must resolve each
+    device path once instead of comparing it against all configured devices
+    """
+    mock_realpath.side_effect = lambda x: x
+    mock_by_id.side_effect = ValueError
+    config_file = tmp_path / "opencas.conf"
+    line_count = write_synthetic_config(config_file)
+    devices = CACHES * (CORES_PER_CACHE + 1)
+
+    start = time.time()
+    config = opencas.cas_config.from_file(str(config_file))
+    duration = time.time() - start
+
+    print("Loaded {0} lines in {1:.3f} s ({2} realpath calls)".format(
+        line_count, duration, mock_realpath.call_count))
+
+    assert line_count > 16000
+    assert len(config.cores) == CACHES * CORES_PER_CACHE
+    assert mock_realpath.call_count == devices
+    assert duration < 10
@@ -11,6 +11,39 @@ import helpers as h
 import opencas
 
 
+@pytest.fixture(autouse=True)
+def empty_sysfs(tmp_path, monkeypatch):
+    """
+    Devices aren't found in sysfs unless test builds fake tree, so that
+    partition probing falls back to (mocked) lsblk
+    """
+    monkeypatch.setattr(opencas, "sysfs_block_dir", str(tmp_path / "sysfs"))
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path, monkeypatch):
+    """
+    Fake /sys/class/block: sda with partitions sda1 and sda2, sdb used by
+    dm-0, empty sdc
+    """
+    devices = tmp_path / "devices"
+    block = tmp_path / "block"
+    block.mkdir()
+    for disk, parts in [("sda", ["sda1", "sda2"]), ("sdb", []), ("sdc", [])]:
+        disk_dir = devices / disk
+        (disk_dir / "holders").mkdir(parents=True)
+        (disk_dir / "queue").mkdir()
+        (block / disk).symlink_to(disk_dir)
+        for part in parts:
+            (disk_dir / part).mkdir()
+            (disk_dir / part / "partition").write_text("1")
+            (block / part).symlink_to(disk_dir / part)
+    (devices / "sdb/holders/dm-0").symlink_to(devices)
+
+    monkeypatch.setattr(opencas, "sysfs_block_dir", str(block))
+    return block
+
+
 @pytest.mark.parametrize(
     "line",
     [
@@ -132,6 +165,34 @@ def test_cache_config_from_line_device_without_partitions(
     opencas.cas_config.cache_config.from_line("1    /dev/sda    WT")
 
 
+def test_get_block_device_children(fake_sysfs):
+    assert opencas.get_block_device_children("/dev/sda") == ["sda1", "sda2"]
+    assert opencas.get_block_device_children("/dev/sdb") == ["dm-0"]
+    assert opencas.get_block_device_children("/dev/sdc") == []
+    assert opencas.get_block_device_children("/dev/sda1") == []
+    assert opencas.get_block_device_children("/dev/sdx") is None
+
+
+@pytest.mark.parametrize("device", ["/dev/sda", "/dev/sdb"])
+@mock.patch("subprocess.run")
+def test_cache_config_device_children_from_sysfs(mock_run, fake_sysfs, device):
+    cache = opencas.cas_config.cache_config(cache_id="1", device=device, cache_mode="WT")
+
+    with pytest.raises(ValueError, match="Partitions"):
+        cache.check_cache_device_empty()
+
+    mock_run.assert_not_called()
+
+
+@mock.patch("subprocess.run")
+def test_cache_config_empty_device_from_sysfs(mock_run, fake_sysfs):
+    cache = opencas.cas_config.cache_config(cache_id="1", device="/dev/sdc", cache_mode="WT")
+
+    cache.check_cache_device_empty()
+
+    mock_run.assert_not_called()
+
+
 @pytest.mark.parametrize("device", ["/dev/cas1-1", "/dev/cas1-300"])
 @mock.patch("os.path.exists")
 @mock.patch("os.stat")
@@ -0,0 +1,95 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+import opencas
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "opencas.conf"
+    path.write_text(
+        "version=19.3.0\n"
+        "[caches]\n"
+        "1\t/dev/nvme0n1\tWT\n"
+        "2\t/dev/nvme1n1\tXX\n"
+        "# comment\n"
+        "3\t/dev/nvme2n1\tWB\n"
+        "[cores]\n"
+        "1\t1\t/dev/sda\n"
+        "1\t1\t/dev/sdb\n"
+        "9\t1\t/dev/sdc\n"
+        "3\t1\t/dev/missing\n"
+    )
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def devices():
+    def check_block_device(path):
+        if "missing" in path:
+            raise ValueError("{0} not found".format(path))
+
+    with patch("opencas.cas_config.get_by_id_path", side_effect=ValueError), \
+            patch("opencas.cas_config.check_block_device",
+                  side_effect=check_block_device) as mock_check, \
+            patch("opencas.get_block_device_children", return_value=[]):
+        yield mock_check
+
+
+def test_validate_file_collects_all_errors(config_file):
+    errors = opencas.cas_config.validate_file(config_file)
+
+    assert [(number, type(error)) for number, error in errors] == [
+        (4, ValueError),
+        (9, opencas.cas_config.ConflictingConfigException),
+        (10, KeyError),
+        (11, ValueError),
+    ]
+    assert "missing" in str(errors[3][1])
+
+
+def test_validate_file_allow_incomplete(config_file, devices):
+    errors = opencas.cas_config.validate_file(config_file, allow_incomplete=True)
+
+    assert [number for number, _ in errors] == [4, 9, 10]
+    devices.assert_not_called()
+
+
+def test_from_file_raises_first_error(config_file):
+    with pytest.raises(ValueError, match="Invalid cache mode"):
+        opencas.cas_config.from_file(config_file)
+
+
+def test_validate_file_devices_checked_concurrently(tmp_path, devices):
+    path = tmp_path / "opencas.conf"
+    path.write_text("version=19.3.0\n[caches]\n1\t/dev/nvme0n1\tWT\n[cores]\n" +
+                    "".join("1\t{0}\t/dev/sd{0}\n".format(i) for i in range(1, 9)))
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def check_block_device(path):
+        with lock:
+            active.append(path)
+            peak.append(len(active))
+        time.sleep(0.1)
+        with lock:
+            active.remove(path)
+
+    devices.side_effect = check_block_device
+
+    start = time.time()
+    errors = opencas.cas_config.validate_file(str(path), jobs=9)
+    duration = time.time() - start
+
+    assert errors == []
+    assert devices.call_count == 9
+    assert max(peak) > 1
+    assert duration < 0.5
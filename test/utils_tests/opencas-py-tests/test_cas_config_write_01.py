@@ -0,0 +1,80 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import os
+import time
+import pytest
+from unittest.mock import patch
+
+import opencas
+
+# Time [s] allowed for writing config with 10000 core lines
+WRITE_BUDGET_S = 0.5
+
+
+def get_config(caches, cores_per_cache):
+    config = opencas.cas_config(version_tag="version=19.3.0")
+    for cache_id in range(1, caches + 1):
+        config.insert_cache(opencas.cas_config.cache_config(
+            cache_id, "/dev/nvme{0}n1".format(cache_id), "wt"))
+        for core_id in range(1, cores_per_cache + 1):
+            config.insert_core(opencas.cas_config.core_config(
+                cache_id, core_id, "/dev/disk{0}-{1}".format(cache_id, core_id)))
+    return config
+
+
+@pytest.fixture(autouse=True)
+def by_id():
+    with patch("opencas.cas_config.get_by_id_path", side_effect=ValueError):
+        yield
+
+
+def test_cas_config_write_replaces_file(tmp_path, monkeypatch):
+    path = tmp_path / "opencas.conf"
+    path.write_text("version=19.3.0\n[caches]\n[cores]\n")
+    os.chmod(str(path), 0o600)
+    monkeypatch.setattr(opencas.compiled_config, "cache_dir", str(tmp_path / "run"))
+    (tmp_path / "run").mkdir()
+    compiled = opencas.compiled_config.get_path(str(path))
+    with open(compiled, "w") as f:
+        f.write("{}")
+
+    get_config(2, 2).write(str(path))
+
+    config = opencas.cas_config.from_file(str(path), allow_incomplete=True)
+    assert sorted(config.caches) == [1, 2]
+    assert len(config.cores) == 4
+    assert oct(os.stat(str(path)).st_mode & 0o777) == oct(0o600)
+    assert sorted(os.listdir(str(tmp_path))) == ["opencas.conf", "run"]
+    assert not os.path.exists(compiled)
+
+
+def test_cas_config_write_failure_keeps_old_file(tmp_path):
+    path = tmp_path / "opencas.conf"
+    path.write_text("version=19.3.0\n[caches]\n1\t/dev/nvme0n1\tWT\n[cores]\n")
+
+    with patch("os.fsync", side_effect=OSError("No space left on device")):
+        with pytest.raises(Exception, match="Couldn't write config file"):
+            get_config(2, 2).write(str(path))
+
+    assert path.read_text() == "version=19.3.0\n[caches]\n1\t/dev/nvme0n1\tWT\n[cores]\n"
+    assert os.listdir(str(tmp_path)) == ["opencas.conf"]
+
+
+def test_cas_config_write_benchmark(tmp_path):
+    path = str(tmp_path / "opencas.conf")
+    config = get_config(10, 1000)
+
+    start = time.time()
+    config.write(path)
+    duration = time.time() - start
+
+    with open(path) as conf:
+        lines = conf.read().splitlines()
+    assert sum(1 for line in lines if "/dev/disk" in line) == 10000
+    assert duration < WRITE_BUDGET_S
+
+    written = opencas.cas_config.from_file(path, allow_incomplete=True)
+    assert written.to_text() == config.to_text()
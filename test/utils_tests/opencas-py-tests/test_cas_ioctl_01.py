@@ -0,0 +1,232 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import pytest
+import ctypes
+import unittest.mock as mock
+
+import cas_ioctl
+import opencas
+import helpers as h
+
+
+def get_fake_device():
+    return h.FakeCtrlDevice(
+        caches={
+            1: {
+                "device": "/dev/dummy_cache",
+                "mode": "wb",
+                "cores": {
+                    1: {"device": "/dev/dummy_core1"},
+                    2: {"device": "/dev/dummy_core2", "state": "Inactive"},
+                },
+            },
+            2: {"device": "/dev/dummy_cache2", "state": 1 << 3, "cores": {}},
+        },
+        core_pool=["/dev/dummy_pool"],
+    )
+
+
+def test_ioctl_request_codes():
+    """
+    Check that request codes are built as by linux/ioctl.h macros
+    """
+    assert cas_ioctl.KCAS_IOCTL_GET_CACHE_COUNT == (
+        (2 << 30) | (8 << 16) | (0xBA << 8) | 16
+    )
+    assert cas_ioctl.KCAS_IOCTL_LIST_CACHE == (
+        (3 << 30) | (ctypes.sizeof(cas_ioctl.kcas_cache_list) << 16) | (0xBA << 8) | 17
+    )
+    assert ctypes.sizeof(cas_ioctl.kcas_cache_list) == 52
+
+
+@mock.patch("os.path.realpath", new=lambda x: x)
+def test_ioctl_list_caches_same_as_casadm():
+    """
+    Check that native list has same shape as parsed `casadm -L` output
+    """
+    dev_list = cas_ioctl.list_caches(get_fake_device())
+
+    assert dev_list == [
+        {"type": "core pool", "id": "-", "disk": "-", "status": "-",
+            "write policy": "-", "device": "-"},
+        {"type": "core", "id": "-", "disk": "/dev/dummy_pool", "status": "Detached",
+            "write policy": "-", "device": "-"},
+        {"type": "cache", "id": "1", "disk": "/dev/dummy_cache", "status": "Running",
+            "write policy": "wb", "device": "-"},
+        {"type": "core", "id": "1", "disk": "/dev/dummy_core1", "status": "Active",
+            "write policy": "-", "device": "/dev/cas1-1"},
+        {"type": "core", "id": "2", "disk": "/dev/dummy_core2", "status": "Inactive",
+            "write policy": "-", "device": "/dev/cas1-2"},
+        {"type": "cache", "id": "2", "disk": "/dev/dummy_cache2", "status": "Incomplete",
+            "write policy": "wt", "device": "-"},
+    ]
+
+
+@mock.patch("os.path.realpath", new=lambda x: x)
+def test_ioctl_list_caches_many_caches():
+    """
+    Check that cache list is fetched in CACHE_LIST_ID_LIMIT sized chunks
+    """
+    fake = h.FakeCtrlDevice(
+        caches={i: {"device": "/dev/dummy{}".format(i)} for i in range(1, 46)}
+    )
+
+    ids = cas_ioctl.get_cache_ids(fake)
+
+    assert ids == list(range(1, 46))
+    assert fake.requests.count(cas_ioctl.KCAS_IOCTL_LIST_CACHE) == 3
+
+
+@mock.patch("os.path.realpath", new=lambda x: x)
+def test_ioctl_list_caches_flushing():
+    fake = h.FakeCtrlDevice(
+        caches={
+            1: {
+                "device": "/dev/dummy_cache",
+                "mode": "wt",
+                "dirty": 30,
+                "flushed": 10,
+                "cores": {1: {"device": "/dev/dummy_core", "dirty": 0}},
+            }
+        }
+    )
+
+    dev_list = cas_ioctl.list_caches(fake)
+
+    assert dev_list[0]["status"] == "Flushing (25.0 %)"
+    assert dev_list[0]["write policy"] == "wb->wt"
+    assert dev_list[1]["status"] == "Flushing (100.0 %)"
+
+
+def test_ioctl_check_cache_device():
+    fake = h.FakeCtrlDevice(
+        check_device={
+            "/dev/dirty": {"is_cache_device": True, "cache_dirty": True},
+            "/dev/empty": {"is_cache_device": False},
+        }
+    )
+
+    assert cas_ioctl.check_cache_device(fake, "/dev/dirty") == {
+        "Is cache": "yes",
+        "Clean Shutdown": "no",
+        "Cache dirty": "yes",
+    }
+    assert cas_ioctl.check_cache_device(fake, "/dev/empty")["Is cache"] == "no"
+
+    with pytest.raises(OSError):
+        cas_ioctl.check_cache_device(fake, "/dev/missing")
+
+
+def test_ioctl_get_params():
+    fake = h.FakeCtrlDevice(
+        caches={
+            1: {
+                "device": "/dev/dummy_cache",
+                "params": {cas_ioctl.cache_param_cleaning_policy_type: 2},
+                "cores": {
+                    1: {
+                        "device": "/dev/dummy_core",
+                        "params": {
+                            cas_ioctl.core_param_seq_cutoff_threshold: 1024 * 1024,
+                            cas_ioctl.core_param_seq_cutoff_policy: 1,
+                        },
+                    }
+                },
+            }
+        }
+    )
+
+    assert cas_ioctl.get_params(fake, "cleaning", 1) == {
+        "Cleaning policy type": "acp"
+    }
+    assert cas_ioctl.get_params(fake, "seq-cutoff", 1, 1) == {
+        "Sequential cutoff threshold [KiB]": "1024",
+        "Sequential cutoff policy": "full",
+    }
+
+    with pytest.raises(ValueError):
+        cas_ioctl.get_params(fake, "seq-cutoff", 1)
+
+
+def test_ioctl_get_stats():
+    fake = h.FakeCtrlDevice(
+        caches={
+            1: {
+                "device": "/dev/dummy_cache",
+                "stats": {"usage": {"occupancy": 100}, "req": {"rd_hits": 7}},
+                "cores": {1: {"device": "/dev/dummy_core",
+                              "stats": {"blocks": {"core_volume_rd": 3}}}},
+            }
+        }
+    )
+
+    cache_stats = cas_ioctl.get_stats(fake, 1)
+    core_stats = cas_ioctl.get_stats(fake, 1, 1)
+
+    assert cache_stats["usage"]["occupancy"] == 100
+    assert cache_stats["req"]["rd_hits"] == 7
+    assert core_stats["blocks"]["core_volume_rd"] == 3
+    assert set(core_stats) == {"usage", "req", "blocks", "errors"}
+
+
+@mock.patch("os.path.realpath", new=lambda x: x)
+@mock.patch("opencas.casadm.list_caches")
+@mock.patch("opencas.ctrl_ioctl.open")
+def test_get_caches_list_native(mock_open, mock_list):
+    mock_open.return_value = get_fake_device()
+
+    dev_list = opencas.get_caches_list()
+
+    assert len(dev_list) == 6
+    mock_list.assert_not_called()
+
+
+@mock.patch("opencas.casadm.list_caches")
+@mock.patch("opencas.ctrl_ioctl.open")
+def test_get_caches_list_fallback(mock_open, mock_list):
+    """
+    Check that casadm is used if control device can't be used natively
+    """
+    mock_open.side_effect = FileNotFoundError()
+    mock_list.return_value = mock.Mock(
+        stdout="type,id,disk,status,write policy,device\n"
+        "cache,1,/dev/dummy_cache,Running,wt,-\n"
+    )
+
+    dev_list = opencas.get_caches_list()
+
+    assert len(dev_list) == 1
+    assert dev_list[0]["disk"] == "/dev/dummy_cache"
+    mock_list.assert_called_once()
+
+
+@mock.patch("opencas.casadm.check_cache_device")
+@mock.patch("opencas.ctrl_ioctl.open")
+def test_check_cache_device_fallback_on_ioctl_error(mock_open, mock_check):
+    """
+    Check that casadm is used (and reports error) if native call fails
+    """
+    mock_open.return_value = h.FakeCtrlDevice()
+    mock_check.side_effect = opencas.casadm.CasadmError(mock.Mock(stderr="err"))
+
+    with pytest.raises(opencas.casadm.CasadmError):
+        opencas.check_cache_device("/dev/missing")
+
+    mock_check.assert_called_once_with("/dev/missing")
+
+
+@mock.patch("opencas.casadm.get_params")
+@mock.patch("opencas.ctrl_ioctl.open")
+def test_get_params_fallback(mock_open, mock_get_params):
+    mock_open.side_effect = PermissionError()
+    mock_get_params.return_value = mock.Mock(
+        stdout="Parameter name,Value\nWake up time [s],20\nFlush max buffers,100\n"
+    )
+
+    params = opencas.get_params("cleaning-alru", 1)
+
+    assert params == {"Wake up time [s]": "20", "Flush max buffers": "100"}
+    mock_get_params.assert_called_once_with("cleaning-alru", 1)
@@ -0,0 +1,94 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import json
+import pytest
+from unittest.mock import patch
+
+import opencas
+from opencas import casadm
+from helpers import get_process_mock
+
+
+def batch_output(*results):
+    return "".join(
+        json.dumps({"line": i + 1, "exit_code": code, "stdout": out, "stderr": err}) + "\n"
+        for i, (code, out, err) in enumerate(results)
+    )
+
+
+@patch("subprocess.run")
+def test_run_batch_01(mock_run):
+    mock_run.return_value = get_process_mock(
+        1, batch_output((0, "", ""), (1, "", "Cache already running\n")), "")
+
+    results = casadm.run_batch([
+        casadm.start_cache_cmd("/dev/disk/by-id/my disk", cache_id=1, cache_mode="wb"),
+        casadm.set_param_cmd("cleaning", cache_id=1, policy="acp"),
+    ])
+
+    assert [r.exit_code for r in results] == [0, 1]
+    assert results[1].stderr == "Cache already running\n"
+    args, kwargs = mock_run.call_args
+    assert args[0] == [casadm.casadm_path, "--batch"]
+    assert kwargs["input"] == (
+        "--start-cache --cache-device '/dev/disk/by-id/my disk' --cache-id 1 --cache-mode wb\n"
+        "--set-param --name cleaning --cache-id 1 --policy acp\n"
+    )
+
+
+@patch("subprocess.run")
+def test_run_batch_02(mock_run):
+    """Missing results mean that batch itself failed"""
+    mock_run.return_value = get_process_mock(1, batch_output((0, "", "")), "Killed")
+
+    with pytest.raises(casadm.CasadmError) as e:
+        casadm.run_batch([casadm.add_core_cmd("/dev/sda", 1), casadm.add_core_cmd("/dev/sdb", 1)])
+
+    assert e.value.result.stderr == "Killed"
+
+
+@patch("subprocess.run")
+def test_run_batch_03(mock_run):
+    mock_run.return_value = get_process_mock(1, "not json\n", "")
+
+    with pytest.raises(casadm.CasadmError):
+        casadm.run_batch([casadm.add_core_cmd("/dev/sda", 1)])
+
+
+@patch("subprocess.run")
+def test_run_batch_non_utf8_output(mock_run):
+    """Non-ASCII bytes are escaped by casadm, valid UTF-8 is restored"""
+    mock_run.return_value = get_process_mock(
+        0, '{"line": 1, "exit_code": 0, "stdout": "\\u00e2\\u0094\\u0080", '
+        '"stderr": "/dev/disk/by-id/x\\u00ff"}\n', "")
+
+    result, = casadm.run_batch([casadm.add_core_cmd("/dev/sda", 1)])
+
+    assert result.stdout == "\u2500"
+    assert result.stderr == "/dev/disk/by-id/x\ufffd"
+
+
+@patch("subprocess.run")
+@patch("opencas.DeviceStateSnapshot.invalidate")
+def test_run_batch_invalidates_device_state(mock_invalidate, mock_run):
+    mock_run.return_value = get_process_mock(0, batch_output((0, "", "")), "")
+
+    casadm.run_batch([casadm.add_core_cmd("/dev/sda", 1)])
+
+    mock_invalidate.assert_called_once()
+
+
+def test_configure_cache_cmds():
+    cache = opencas.cas_config.cache_config(
+        2, "/dev/nvme0n1", "wt",
+        cleaning_policy="alru", ioclass_file="/etc/opencas/ioclass.csv")
+
+    assert opencas.configure_cache_cmds(cache) == [
+        [casadm.casadm_path, "--set-param", "--name", "cleaning",
+            "--cache-id", "2", "--policy", "alru"],
+        [casadm.casadm_path, "--io-class", "--load-config",
+            "--cache-id", "2", "--file", "/etc/opencas/ioclass.csv"],
+    ]
@@ -0,0 +1,163 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import io
+import json
+import pytest
+from unittest.mock import patch
+
+import opencas
+import helpers as h
+
+DEV_LIST = [
+    {"type": "cache", "id": "1", "disk": "/dev/nvme0n1", "status": "Running",
+        "write policy": "wb", "device": "-"},
+    {"type": "core", "id": "1", "disk": "/dev/sda", "status": "Active",
+        "write policy": "-", "device": "/dev/cas1-1"},
+    {"type": "core", "id": "2", "disk": "/dev/sdb", "status": "Active",
+        "write policy": "-", "device": "/dev/cas1-2"},
+]
+
+ALRU_PARAMS = {
+    "Wake up time [s]": "20",
+    "Stale buffer time [s]": "120",
+    "Flush max buffers": "100",
+    "Activity threshold [ms]": "10000",
+}
+
+
+class workload(object):
+    """
+    Generates consecutive samples of cache dirty occupancy and /sys/block
+    stat of its cores' backing devices
+    """
+
+    def __init__(self):
+        self.time = 0
+        self.disks = {disk: dict.fromkeys(opencas.disk_stat_fields, 0)
+                      for disk in ["/dev/sda", "/dev/sdb"]}
+
+    def step(self, dirty, latency=1, disk="/dev/sda"):
+        self.time += 1
+        stat = self.disks[disk]
+        stat["writes"] += 100
+        stat["write_ticks"] += 100 * latency
+        stat["io_ticks"] += 500
+        stat["time_in_queue"] += 1000
+        usage = {"occupancy": 1000, "free": 0, "clean": 1000 - dirty, "dirty": dirty}
+        return opencas.stats_sample(
+            self.time, {(1, None): {"usage": usage}}, {},
+            opencas.DeviceStateSnapshot(DEV_LIST))
+
+
+@pytest.fixture
+def load():
+    load = workload()
+
+    def get_params(namespace, cache_id, core_id=None):
+        return {"Cleaning policy type": "alru"} if namespace == "cleaning" \
+            else ALRU_PARAMS
+
+    with patch("time.monotonic", new=lambda: load.time), \
+            patch("opencas.get_disk_stat",
+                  new=lambda disk: dict(load.disks[disk])), \
+            patch("opencas.get_params", side_effect=get_params), \
+            patch("opencas.casadm.run_cmd") as mock_run:
+        load.run_cmd = mock_run
+        yield load
+
+
+def run(tuner, load, steps, **kwargs):
+    entries = []
+    previous = load.step(**kwargs)
+    for _ in range(steps):
+        sample = load.step(**kwargs)
+        entries += tuner.update(previous, sample)
+        previous = sample
+    return entries
+
+
+def test_get_disk_load():
+    before = dict.fromkeys(opencas.disk_stat_fields, 0)
+    after = dict(before, reads=30, writes=70, read_ticks=300, write_ticks=1700,
+                 io_ticks=1500, time_in_queue=8000)
+
+    assert opencas.get_disk_load(before, after, 2) == \
+        {"utilization": 75, "queue_depth": 4, "latency": 20}
+    assert opencas.get_disk_load(before, before, 2)["latency"] is None
+
+
+def test_cleaning_tuner_faster_over_target(load):
+    log = io.StringIO()
+    tuner = opencas.cleaning_tuner(target_dirty=30, tolerance=10, hold=2, log=log)
+
+    entries = run(tuner, load, 5, dirty=600)
+
+    assert len(entries) == 2
+    assert entries[0]["changes"] == {
+        "wake_up": [20, 10],
+        "staleness_time": [120, 60],
+        "flush_max_buffers": [100, 200],
+        "activity_threshold": [10000, 5000],
+    }
+    assert entries[1]["changes"]["flush_max_buffers"] == [200, 400]
+    assert entries[0]["dirty"] == 60
+    cmd = load.run_cmd.call_args_list[0][0][0]
+    assert cmd[cmd.index("--name") + 1] == "cleaning-alru"
+    assert cmd[cmd.index("--flush-max-buffers") + 1] == "200"
+    assert [json.loads(line) for line in log.getvalue().splitlines()] == entries
+
+
+def test_cleaning_tuner_respects_latency_budget(load):
+    tuner = opencas.cleaning_tuner(latency_budget=10, hold=1)
+
+    # Over target, but backing device already over latency budget
+    assert run(tuner, load, 3, dirty=600, latency=15) == []
+
+    # Within target and over budget - cleaning backs off
+    entries = run(tuner, load, 1, dirty=300, latency=15, disk="/dev/sdb")
+    assert entries[0]["reason"] == "foreground latency budget exceeded"
+    assert entries[0]["latency"] == 15
+    assert entries[0]["changes"]["flush_max_buffers"] == [100, 50]
+    assert entries[0]["changes"]["wake_up"] == [20, 40]
+
+
+def test_cleaning_tuner_bounds(load):
+    tuner = opencas.cleaning_tuner(hold=1, dry_run=True)
+
+    entries = run(tuner, load, 30, dirty=0)
+
+    load.run_cmd.assert_not_called()
+    final = {param: change[1] for entry in entries
+             for param, change in entry["changes"].items()}
+    assert final == {"wake_up": 3600, "staleness_time": 3600,
+                     "flush_max_buffers": 1, "activity_threshold": 1000000}
+
+
+def test_cleaning_tuner_error_rereads_settings(load):
+    load.run_cmd.side_effect = opencas.casadm.CasadmError(
+        h.get_process_mock(1, "", "Cache is stopping"))
+    tuner = opencas.cleaning_tuner(hold=1)
+
+    entries = run(tuner, load, 3, dirty=600)
+
+    assert [e["error"] for e in entries] == ["Cache is stopping"]
+    assert opencas.get_params.call_count == 4
+
+
+@patch("opencas.get_params")
+def test_cleaning_tuner_skips_other_policies(mock_params):
+    mock_params.return_value = {"Cleaning policy type": "nop"}
+    tuner = opencas.cleaning_tuner()
+    sample = opencas.stats_sample(1, {}, {}, opencas.DeviceStateSnapshot(DEV_LIST))
+
+    assert tuner.update(sample, sample) == []
+    assert tuner.caches[1].params is None
+    mock_params.assert_called_once_with("cleaning", 1)
+
+
+def test_cleaning_tuner_invalid_target():
+    with pytest.raises(ValueError):
+        opencas.cleaning_tuner(target_dirty=95, tolerance=10)
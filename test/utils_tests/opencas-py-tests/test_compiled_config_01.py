@@ -0,0 +1,136 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import os
+import pytest
+from unittest.mock import patch
+
+import opencas
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    """
+    Config with one cache and two cores on devices linked from fake by-id
+    """
+    dev = tmp_path / "dev"
+    dev.mkdir()
+    by_id = tmp_path / "by-id"
+    by_id.mkdir()
+    for name in ["nvme0n1", "sda", "sdb", "sdc"]:
+        (dev / name).write_text("")
+        (by_id / "wwn-{}".format(name)).symlink_to("../dev/{}".format(name))
+    monkeypatch.setattr(opencas.cas_config, "by_id_dir", str(by_id))
+    monkeypatch.setattr(opencas.compiled_config, "cache_dir", str(tmp_path / "run"))
+
+    (tmp_path / "opencas.conf").write_text(
+        "version=19.3.0\n"
+        "[caches]\n"
+        "1\t{0}/by-id/wwn-nvme0n1\tWB\tcleaning_policy=acp\n"
+        "[cores]\n"
+        "1\t1\t{0}/by-id/wwn-sda\n"
+        "1\t2\t{0}/dev/sdb\n".format(tmp_path)
+    )
+
+    return tmp_path
+
+
+def test_compiled_config_find(config_dir):
+    compiled = opencas.compiled_config.load(str(config_dir / "opencas.conf"))
+
+    cache = compiled.find(str(config_dir / "dev/nvme0n1"))
+    core = compiled.find(str(config_dir / "dev/sda"),
+                         [str(config_dir / "by-id/wwn-sda"), "/dev/other_link"])
+
+    assert isinstance(cache, opencas.cas_config.cache_config)
+    assert cache.cache_id == 1
+    assert cache.cache_mode == "wb"
+    assert cache.params == {"cleaning_policy": "acp"}
+    assert isinstance(core, opencas.cas_config.core_config)
+    assert (core.cache_id, core.core_id) == (1, 1)
+    assert compiled.find(str(config_dir / "dev/sdc")) is None
+    assert compiled.find(str(config_dir / "dev/sdc"),
+                         [str(config_dir / "by-id/wwn-sdc")]) is None
+
+
+def test_compiled_config_stored_and_reused(config_dir):
+    config_file = str(config_dir / "opencas.conf")
+
+    opencas.compiled_config.load(config_file)
+
+    path = opencas.compiled_config.get_path(config_file)
+    assert path.startswith(str(config_dir / "run") + "/")
+    assert os.path.exists(path)
+    assert not os.path.exists(config_file + opencas.compiled_config.suffix)
+
+    with patch("opencas.cas_config.from_file") as mock_from_file, \
+            patch("hashlib.sha256") as mock_sha256:
+        compiled = opencas.compiled_config.load(config_file)
+
+    mock_from_file.assert_not_called()
+    mock_sha256.assert_not_called()
+    assert compiled.find(str(config_dir / "dev/sdb")).core_id == 2
+
+
+def test_compiled_config_rebuilt_when_stale(config_dir):
+    config_file = str(config_dir / "opencas.conf")
+    opencas.compiled_config.load(config_file)
+
+    # Same size, different mtime - hash tells that config has changed
+    st = os.stat(config_file)
+    content = (config_dir / "opencas.conf").read_text()
+    (config_dir / "opencas.conf").write_text(content.replace("1\t2\t", "1\t3\t"))
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    compiled = opencas.compiled_config.load(config_file)
+
+    assert compiled.find(str(config_dir / "dev/sdb")).core_id == 3
+    reloaded = opencas.compiled_config.from_file(
+        opencas.compiled_config.get_path(config_file),
+        opencas.compiled_config.get_key(config_file))
+    assert reloaded.find(str(config_dir / "dev/sdb")).core_id == 3
+
+
+def test_compiled_config_touched(config_dir):
+    """
+    Check that config with only mtime changed is hashed, but not recompiled
+    """
+    config_file = str(config_dir / "opencas.conf")
+    opencas.compiled_config.load(config_file)
+    st = os.stat(config_file)
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    with patch("opencas.cas_config.from_file") as mock_from_file:
+        compiled = opencas.compiled_config.load(config_file)
+
+    mock_from_file.assert_not_called()
+    assert compiled.find(str(config_dir / "dev/sdb")).core_id == 2
+    assert opencas.compiled_config.from_file(
+        opencas.compiled_config.get_path(config_file),
+        opencas.compiled_config.get_stat_key(config_file)) is not None
+
+
+def test_compiled_config_corrupted(config_dir):
+    config_file = str(config_dir / "opencas.conf")
+    (config_dir / "run").mkdir()
+    with open(opencas.compiled_config.get_path(config_file), "w") as f:
+        f.write("{not json")
+
+    compiled = opencas.compiled_config.load(config_file)
+
+    assert compiled.find(str(config_dir / "dev/sda")).core_id == 1
+
+
+def test_compiled_config_read_only_dir(config_dir):
+    """
+    Check that config is still usable if compiled form can't be stored
+    """
+    config_file = str(config_dir / "opencas.conf")
+
+    with patch("tempfile.mkstemp", side_effect=PermissionError()):
+        compiled = opencas.compiled_config.load(config_file)
+
+    assert compiled.find(str(config_dir / "dev/sda")).core_id == 1
+    assert not os.path.exists(opencas.compiled_config.get_path(config_file))
@@ -0,0 +1,127 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+import opencas
+import helpers as h
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path, monkeypatch):
+    """
+    Fake /sys/class/block with disks sda, sdb and partitions sda1, sda2, sdb1
+    """
+    devices = tmp_path / "devices"
+    block = tmp_path / "block"
+    block.mkdir()
+    for disk, parts in [("sda", ["sda1", "sda2"]), ("sdb", ["sdb1"]), ("sdc", [])]:
+        disk_dir = devices / disk
+        disk_dir.mkdir(parents=True)
+        (block / disk).symlink_to(disk_dir)
+        for part in parts:
+            (disk_dir / part).mkdir()
+            (disk_dir / part / "partition").write_text("1")
+            (block / part).symlink_to(disk_dir / part)
+
+    monkeypatch.setattr(opencas, "sysfs_block_dir", str(block))
+    return block
+
+
+def get_list(cores):
+    dev_list = [
+        {"type": "cache", "id": "1", "disk": "/dev/nvme0n1", "status": "Running",
+            "write policy": "wb", "device": "-"},
+    ]
+    for core_id, disk in cores:
+        dev_list.append({
+            "type": "core", "id": str(core_id), "disk": disk, "status": "Active",
+            "write policy": "-", "device": "/dev/cas1-{}".format(core_id)})
+    return dev_list
+
+
+def test_get_physical_device(fake_sysfs):
+    assert opencas.get_physical_device("/dev/sda1") == "sda"
+    assert opencas.get_physical_device("/dev/sda") == "sda"
+    assert opencas.get_physical_device("/dev/sdb1") == "sdb"
+    assert opencas.get_physical_device("/dev/missing") == "missing"
+
+
+def test_get_core_physical_device_stacked(fake_sysfs):
+    state = opencas.DeviceStateSnapshot(get_list([(1, "/dev/sda2")]) + [
+        {"type": "cache", "id": "2", "disk": "/dev/nvme1n1", "status": "Running",
+            "write policy": "wb", "device": "-"},
+        {"type": "core", "id": "1", "disk": "/dev/cas1-1", "status": "Active",
+            "write policy": "-", "device": "/dev/cas2-1"},
+    ])
+
+    assert opencas.get_core_physical_device(state.get_core(2, 1), state) == "sda"
+
+
+@patch("opencas.casadm.remove_core")
+def test_detach_serial_per_physical_device(mock_remove, fake_sysfs):
+    """
+    Check that cores on one disk are never flushed at the same time while
+    different disks are flushed concurrently
+    """
+    state = opencas.DeviceStateSnapshot(get_list(
+        [(1, "/dev/sda1"), (2, "/dev/sdb1"), (3, "/dev/sda2"), (4, "/dev/sdc")]))
+    disks = {1: "sda", 2: "sdb", 3: "sda", 4: "sdc"}
+    lock = threading.Lock()
+    running = []
+    max_running = [0]
+    overlaps = []
+
+    def remove_core(cache_id, core_id, **kwargs):
+        disk = disks[int(core_id)]
+        with lock:
+            if disk in running:
+                overlaps.append(disk)
+            running.append(disk)
+            max_running[0] = max(max_running[0], len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(disk)
+
+    mock_remove.side_effect = remove_core
+
+    opencas.detach_all_cores(True, state, jobs=3)
+
+    assert overlaps == []
+    assert max_running[0] > 1
+    assert mock_remove.call_count == 4
+    sda_order = [c[0][1] for c in mock_remove.call_args_list
+                 if disks[int(c[0][1])] == "sda"]
+    assert sda_order == [1, 3]
+
+
+@patch("opencas.casadm.remove_core")
+def test_detach_progress_and_errors(mock_remove, fake_sysfs):
+    state = opencas.DeviceStateSnapshot(get_list(
+        [(1, "/dev/sda1"), (2, "/dev/sdb1"), (3, "/dev/sda2")]))
+    progress = []
+
+    def remove_core(cache_id, core_id, **kwargs):
+        if core_id in [1, 2]:
+            raise opencas.casadm.CasadmError(
+                h.get_process_mock(1, "", "error {}".format(core_id)))
+
+    mock_remove.side_effect = remove_core
+
+    with pytest.raises(opencas.CompoundException) as e:
+        opencas.detach_all_cores(False, state, jobs=2,
+                                 progress=lambda done, total: progress.append((done, total)))
+
+    assert len(e.value.exception_list) == 2
+    assert "error 1" in str(e.value)
+    assert "error 2" in str(e.value)
+    # Failure on one core doesn't stop flushing remaining cores on same disk
+    assert mock_remove.call_count == 3
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    assert state.is_core_active(state.get_core(1, 1))
+    assert not state.is_core_active(state.get_core(1, 3))
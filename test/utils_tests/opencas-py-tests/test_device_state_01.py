@@ -0,0 +1,177 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import pytest
+from unittest.mock import patch, call
+
+import opencas
+import helpers as h
+
+
+def get_stacked_list():
+    """
+    Two level configuration - cores of cache 2 are exported volumes of cache 1
+    """
+    return [
+        {"type": "core pool", "id": "-", "disk": "-", "status": "-",
+            "write policy": "-", "device": "-"},
+        {"type": "core", "id": "-", "disk": "/dev/pool_core", "status": "Detached",
+            "write policy": "-", "device": "-"},
+        {"type": "cache", "id": "1", "disk": "/dev/cache1", "status": "Running",
+            "write policy": "wt", "device": "-"},
+        {"type": "core", "id": "1", "disk": "/dev/sda", "status": "Active",
+            "write policy": "-", "device": "/dev/cas1-1"},
+        {"type": "core", "id": "10", "disk": "/dev/sdb", "status": "Active",
+            "write policy": "-", "device": "/dev/cas1-10"},
+        {"type": "cache", "id": "2", "disk": "/dev/cache2", "status": "Running",
+            "write policy": "wb", "device": "-"},
+        {"type": "core", "id": "1", "disk": "/dev/cas1-1", "status": "Active",
+            "write policy": "-", "device": "/dev/cas2-1"},
+        {"type": "core", "id": "2", "disk": "/dev/cas1-10", "status": "Active",
+            "write policy": "-", "device": "/dev/cas2-2"},
+        {"type": "core", "id": "3", "disk": "/dev/sdc", "status": "Inactive",
+            "write policy": "-", "device": "/dev/cas2-3"},
+    ]
+
+
+@patch("opencas.get_caches_list")
+def test_device_state_snapshot_indexes(mock_list):
+    mock_list.return_value = get_stacked_list()
+
+    state = opencas.DeviceStateSnapshot.fetch()
+
+    assert state.get_cache(1).disk == "/dev/cache1"
+    assert state.get_cache("2").write_policy == "wb"
+    assert state.get_cache(3) is None
+    assert state.get_core(2, 1).disk == "/dev/cas1-1"
+    assert state.get_core("1", "10").cache_id == 1
+    assert state.get_by_path("/dev/sdb").device == "/dev/cas1-10"
+    assert state.get_by_path("/dev/cas2-3").status == "Inactive"
+    assert state.get_by_path("/dev/pool_core").status == "Detached"
+    assert state.get_by_path("/dev/cache1") is state.get_cache(1)
+    assert [c.device for c in state.get_cores_on("/dev/cas1-1")] == ["/dev/cas2-1"]
+    assert len(state.core_pool) == 1
+
+    # Cores are held by their caches in listing order
+    assert [c.id for c in state.get_cache(1).cores] == [1, 10]
+    assert [c.id for c in state.get_cache(2).cores] == [1, 2, 3]
+    assert [c.key for c in state.get_cores()] == [(1, 1), (1, 10), (2, 1), (2, 2), (2, 3)]
+
+
+@patch("opencas.get_caches_list")
+def test_device_state_snapshot_shared(mock_list):
+    """
+    Check that helpers reuse one listing until state changing command is run
+    """
+    mock_list.return_value = get_stacked_list()
+
+    assert opencas.is_cache_started(opencas.cas_config.cache_config(1, "/dev/x", "wt"))
+    assert not opencas.is_cache_started(opencas.cas_config.cache_config(3, "/dev/x", "wt"))
+    assert opencas.is_core_added(opencas.cas_config.core_config(2, 3, "/dev/sdc"))
+    assert not opencas.is_core_added(opencas.cas_config.core_config(2, 4, "/dev/sdd"))
+
+    assert mock_list.call_count == 1
+
+
+@patch("time.monotonic")
+@patch("opencas.get_caches_list")
+def test_device_state_snapshot_expires(mock_list, mock_monotonic):
+    """
+    Check that shared snapshot is refetched after max_age, so that changes
+    made by other processes are seen
+    """
+    mock_list.return_value = get_stacked_list()
+    mock_monotonic.return_value = 100.0
+    cache = opencas.cas_config.cache_config(3, "/dev/x", "wt")
+
+    assert not opencas.is_cache_started(cache)
+
+    mock_list.return_value = get_stacked_list() + [
+        {"type": "cache", "id": "3", "disk": "/dev/x", "status": "Running",
+            "write policy": "wt", "device": "-"}]
+    mock_monotonic.return_value += opencas.DeviceStateSnapshot.max_age / 2
+    assert not opencas.is_cache_started(cache)
+
+    mock_monotonic.return_value += opencas.DeviceStateSnapshot.max_age
+    assert opencas.is_cache_started(cache)
+    assert mock_list.call_count == 2
+
+
+@patch("subprocess.run")
+@patch("opencas.get_caches_list")
+def test_device_state_snapshot_invalidated_by_casadm(mock_list, mock_run):
+    mock_list.return_value = get_stacked_list()
+    mock_run.return_value = h.get_process_mock(0, "", "")
+
+    opencas.DeviceStateSnapshot.current()
+    opencas.casadm.get_version()
+    opencas.DeviceStateSnapshot.current()
+
+    assert mock_list.call_count == 1
+
+    opencas.casadm.add_core("/dev/sdd", 2)
+    opencas.DeviceStateSnapshot.current()
+
+    assert mock_list.call_count == 2
+
+
+@patch("subprocess.run")
+@patch("opencas.get_caches_list")
+def test_device_state_snapshot_invalidated_on_casadm_error(mock_list, mock_run):
+    mock_list.return_value = get_stacked_list()
+    mock_run.return_value = h.get_process_mock(1, "", "error")
+
+    opencas.DeviceStateSnapshot.current()
+    with pytest.raises(opencas.casadm.CasadmError):
+        opencas.casadm.stop_cache(1)
+    opencas.DeviceStateSnapshot.current()
+
+    assert mock_list.call_count == 2
+
+
+@patch("opencas.casadm.stop_cache")
+@patch("opencas.casadm.remove_core")
+@patch("opencas.get_caches_list")
+def test_stop_stacked_single_listing(mock_list, mock_remove, mock_stop):
+    """
+    Check that stop lists devices once and detaches upper level cores first
+    """
+    mock_list.return_value = get_stacked_list()
+    fetch_count = opencas.DeviceStateSnapshot.fetch_count
+
+    opencas.stop(flush=True)
+
+    assert mock_list.call_count == 1
+    assert opencas.DeviceStateSnapshot.fetch_count - fetch_count == 1
+    removed = [c[0] for c in mock_remove.call_args_list]
+    assert set(removed[:2]) == {(2, 1), (2, 2)}
+    assert set(removed[2:]) == {(1, 1), (1, 10)}
+    assert all(c[1] == dict(detach=True, force=False) for c in mock_remove.call_args_list)
+    assert mock_stop.call_args_list == [call(1, True), call(2, True)]
+
+
+@patch("opencas.casadm.stop_cache")
+@patch("opencas.casadm.remove_core")
+@patch("opencas.get_caches_list")
+def test_stop_detach_error_continues(mock_list, mock_remove, mock_stop):
+    mock_list.return_value = get_stacked_list()
+
+    def remove_core(cache_id, core_id, **kwargs):
+        if (cache_id, core_id) == (2, 1):
+            raise opencas.casadm.CasadmError(h.get_process_mock(1, "", "busy"))
+
+    mock_remove.side_effect = remove_core
+
+    with pytest.raises(opencas.CompoundException) as e:
+        opencas.stop(flush=False)
+
+    assert "busy" in str(e.value)
+    # Failed upper level core blocks detaching core of cache 1 it sits on
+    assert "/dev/sda" in str(e.value)
+    assert len(e.value.exception_list) == 2
+    assert set(c[0] for c in mock_remove.call_args_list) == {
+        (2, 1), (2, 2), (1, 10)
+    }
+    assert mock_stop.call_count == 2
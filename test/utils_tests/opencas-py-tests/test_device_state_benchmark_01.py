@@ -0,0 +1,68 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import time
+import tracemalloc
+
+import opencas
+
+CACHES = 4
+CORES_PER_CACHE = 4000
+
+
+def get_synthetic_list():
+    """
+    Device listing of CACHES caches with CORES_PER_CACHE cores each, as
+    returned by get_caches_list()
+    """
+    dev_list = []
+    for cache_id in range(1, CACHES + 1):
+        dev_list.append({"type": "cache", "id": str(cache_id),
+                         "disk": "/dev/nvme{}n1".format(cache_id), "status": "Running",
+                         "write policy": "wb", "device": "-"})
+        for core_id in range(1, CORES_PER_CACHE + 1):
+            dev_list.append({"type": "core", "id": str(core_id),
+                             "disk": "/dev/disk{}-{}".format(cache_id, core_id),
+                             "status": "Active", "write policy": "-",
+                             "device": "/dev/cas{}-{}".format(cache_id, core_id)})
+    return dev_list
+
+
+def test_device_state_benchmark_16k():
+    """
+    Parse synthetic listing of 16k cores - tree of slotted objects must take
+    less memory than listing it is built from and answer lookups directly
+    """
+    dev_list = get_synthetic_list()
+
+    tracemalloc.start()
+    start = time.time()
+    state = opencas.DeviceStateSnapshot(dev_list)
+    duration = time.time() - start
+    state_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    list_size = tracemalloc.get_traced_memory()[0]
+    get_synthetic_list()
+    list_size = tracemalloc.get_traced_memory()[1] - list_size
+    tracemalloc.stop()
+
+    print("Parsed {0} devices in {1:.3f} s, {2} kB (listing {3} kB)".format(
+        len(dev_list), duration, state_size // 1024, list_size // 1024))
+
+    assert len(state.cores) == CACHES * CORES_PER_CACHE
+    assert state_size < list_size
+    assert duration < 5
+
+    start = time.time()
+    for cache_id in range(1, CACHES + 1):
+        for core_id in range(1, CORES_PER_CACHE + 1):
+            assert state.get_core(cache_id, core_id).cache_id == cache_id
+            assert state.get_by_path("/dev/cas{}-{}".format(cache_id, core_id)).id == core_id
+    lookup_duration = time.time() - start
+
+    assert lookup_duration < 5
+    assert len(state.get_devices_state()["cores"]) == CACHES * CORES_PER_CACHE
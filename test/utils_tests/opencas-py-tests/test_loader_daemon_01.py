@@ -0,0 +1,142 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import os
+import threading
+import time
+import pytest
+from unittest.mock import patch, Mock
+
+import opencas
+import helpers as h
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = opencas.loader_daemon.listen(str(tmp_path / "run/loader.sock"),
+                                          jobs=1, log=Mock())
+    daemon.path = str(tmp_path / "run/loader.sock")
+    yield daemon
+    daemon.close()
+
+
+def test_loader_daemon_socket_mode(daemon):
+    assert oct(os.stat(daemon.path).st_mode & 0o777) == oct(0o600)
+
+
+def test_notify_loader_daemon_not_running(tmp_path):
+    assert not opencas.notify_loader_daemon("/dev/sda", None,
+                                            str(tmp_path / "loader.sock"))
+
+
+def test_loader_daemon_coalesces_burst(daemon):
+    """
+    Check that events sent in quick succession are handled as single batch
+    with repeated devices merged
+    """
+    for device in ["/dev/sda", "/dev/sdb", "/dev/sda"]:
+        assert opencas.notify_loader_daemon(device, "/dev/disk/by-id/x-" + device[5:],
+                                            daemon.path)
+    assert opencas.notify_loader_daemon("/dev/sdc", None, daemon.path)
+
+    start = time.time()
+    batch = daemon.receive_batch(timeout=5)
+
+    assert time.time() - start < 1
+    assert batch == [
+        ("/dev/sda", ["/dev/disk/by-id/x-sda"]),
+        ("/dev/sdb", ["/dev/disk/by-id/x-sdb"]),
+        ("/dev/sdc", None),
+    ]
+    assert daemon.receive_batch(timeout=0.1) == []
+
+
+def test_loader_daemon_max_delay(daemon):
+    """
+    Check that steady stream of events doesn't postpone handling forever
+    """
+    daemon.coalesce_time = 0.2
+    daemon.max_delay = 0.3
+
+    def send_events():
+        for i in range(4):
+            opencas.notify_loader_daemon("/dev/sd{}".format(i), None, daemon.path)
+            time.sleep(0.15)
+
+    thread = threading.Thread(target=send_events)
+    thread.start()
+    first = daemon.receive_batch(timeout=1)
+    thread.join()
+    rest = daemon.receive_batch(timeout=1)
+
+    assert 0 < len(first) < 4
+    assert len(first) + len(rest) == 4
+
+
+def test_loader_daemon_ignores_remove(daemon):
+    sender = daemon.monitor.sock
+    sender.sendto(opencas.udev_monitor.format_event(
+        {"ACTION": "remove", "SUBSYSTEM": "block", "DEVNAME": "/dev/sda"}), daemon.path)
+    sender.sendto(opencas.udev_monitor.format_event(
+        {"ACTION": "add", "SUBSYSTEM": "block", "DEVNAME": "sdb"}), daemon.path)
+
+    assert daemon.receive_batch(timeout=1) == [("/dev/sdb", None)]
+
+
+@patch("opencas.wait_for_cas_ctrl")
+@patch("opencas.add_core")
+@patch("opencas.start_cache")
+@patch("opencas.compiled_config.load")
+def test_loader_daemon_process_caches_first(
+    mock_load, mock_start, mock_add, mock_wait, daemon
+):
+    cache = opencas.cas_config.cache_config(1, "/dev/nvme0n1", "wt")
+    core1 = opencas.cas_config.core_config(1, 1, "/dev/sda")
+    core2 = opencas.cas_config.core_config(1, 2, "/dev/sdb")
+    configs = {"/dev/sda": core1, "/dev/nvme0n1": cache, "/dev/sdb": core2}
+    mock_load.return_value.find.side_effect = lambda device, devlinks: configs.get(device)
+    calls = []
+    mock_start.side_effect = lambda cache, load: calls.append(("cache", cache.cache_id))
+    mock_add.side_effect = lambda core, attach: calls.append(("core", core.core_id))
+
+    daemon.process([("/dev/sda", None), ("/dev/other", None),
+                    ("/dev/nvme0n1", None), ("/dev/sdb", None)])
+
+    assert calls == [("cache", 1), ("core", 1), ("core", 2)]
+    mock_load.assert_called_once()
+    daemon.log.assert_not_called()
+
+
+@patch("opencas.wait_for_cas_ctrl")
+@patch("opencas.add_core")
+@patch("opencas.compiled_config.load")
+def test_loader_daemon_process_errors_logged(mock_load, mock_add, mock_wait, daemon):
+    core1 = opencas.cas_config.core_config(1, 1, "/dev/sda")
+    core2 = opencas.cas_config.core_config(1, 2, "/dev/sdb")
+    configs = {"/dev/sda": core1, "/dev/sdb": core2}
+    mock_load.return_value.find.side_effect = lambda device, devlinks: configs.get(device)
+
+    def add_core(core, attach):
+        if core.core_id == 1:
+            raise opencas.casadm.CasadmError(h.get_process_mock(1, "", "no cache"))
+
+    mock_add.side_effect = add_core
+
+    daemon.process([("/dev/sda", None), ("/dev/sdb", None)])
+
+    assert mock_add.call_count == 2
+    daemon.log.assert_called_once()
+    assert "no cache" in daemon.log.call_args[0][1]
+    assert "/dev/sda" in daemon.log.call_args[0][1]
+
+
+@patch("opencas.wait_for_cas_ctrl")
+@patch("opencas.compiled_config.load")
+def test_loader_daemon_process_unconfigured(mock_load, mock_wait, daemon):
+    mock_load.return_value.find.return_value = None
+
+    daemon.process([("/dev/sda", None)])
+
+    mock_wait.assert_not_called()
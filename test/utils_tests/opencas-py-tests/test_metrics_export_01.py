@@ -0,0 +1,105 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import importlib.util
+import os
+import re
+import pytest
+from unittest.mock import patch
+
+import opencas
+import helpers as h
+
+
+def load_functional_statistics():
+    path = os.path.join(h.find_repo_root(), "test/functional/api/cas/statistics.py")
+    spec = importlib.util.spec_from_file_location("functional_statistics", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_fake_device():
+    return h.FakeCtrlDevice(
+        caches={
+            1: {
+                "device": "/dev/nvme0n1",
+                "mode": "wb",
+                "stats": {"usage": {"dirty": 2}, "req": {"rd_hits": 10},
+                          "errors": {"total": 1}},
+                "io_classes": {0: {"req": {"rd_hits": 4}}},
+                "cores": {
+                    1: {"device": "/dev/sda",
+                        "stats": {"blocks": {"volume_rd": 3}},
+                        "io_classes": {0: {}, 5: {"req": {"wr_total": 6}}}},
+                },
+            },
+        },
+    )
+
+
+@pytest.fixture
+def sample():
+    with patch("opencas.ctrl_ioctl.open") as mock_open, \
+            patch("os.path.realpath", new=lambda x: x):
+        mock_open.return_value = get_fake_device()
+        return opencas.stats_sample.take(io_classes=True)
+
+
+def test_metrics_groups_match_casadm_statistics():
+    statistics = load_functional_statistics()
+    groups = {group: [name for _, name in counters]
+              for group, _, _, _, counters in opencas.stats_groups}
+
+    assert groups["usage"] == statistics.usage_stats
+    assert groups["req"] == statistics.request_stats
+    assert groups["blocks"] == statistics.block_stats_cache
+    assert groups["errors"] == statistics.error_stats
+
+
+def test_metrics_format(sample):
+    metrics = opencas.format_metrics(sample)
+    lines = metrics.splitlines()
+
+    assert 'opencas_usage_dirty_bytes{cache_id="1"} 8192' in lines
+    assert 'opencas_requests_rd_hits_total{cache_id="1"} 10' in lines
+    assert 'opencas_requests_rd_hits_total{cache_id="1",io_class="0"} 4' in lines
+    assert 'opencas_requests_wr_total{cache_id="1",core_id="1",io_class="5"} 6' in lines
+    assert 'opencas_blocks_volume_rd_bytes_total{cache_id="1",core_id="1"} 12288' in lines
+    assert 'opencas_errors_total{cache_id="1"} 1' in lines
+    assert 'opencas_core_info{cache_id="1",core_id="1",device="/dev/sda",' \
+        'exported_device="/dev/cas1-1",status="Active"} 1' in lines
+    assert "# TYPE opencas_usage_dirty_bytes gauge" in lines
+    assert "# TYPE opencas_requests_rd_hits_total counter" in lines
+    assert "# HELP opencas_requests_rd_hits_total Read hits" in lines
+
+    # Only configured io classes are exported
+    assert not [line for line in lines if 'io_class="1"' in line]
+
+    # Each metric is described once, before its samples
+    names = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    assert len(names) == len(set(names))
+    for line in lines:
+        if not line.startswith("#"):
+            name = line.split("{")[0]
+            assert re.fullmatch(r"[a-zA-Z_:][a-zA-Z0-9_:]*", name)
+            assert name in names
+
+
+def test_metrics_write_atomic(sample, tmp_path):
+    path = str(tmp_path / "opencas.prom")
+
+    opencas.write_metrics(path, sample)
+
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
+    content = open(path).read()
+
+    with patch("opencas.format_metrics", side_effect=RuntimeError()):
+        with pytest.raises(RuntimeError):
+            opencas.write_metrics(path, sample)
+
+    # Previous output is left intact and no temporary files remain
+    assert open(path).read() == content
+    assert os.listdir(str(tmp_path)) == ["opencas.prom"]
@@ -0,0 +1,51 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import threading
+import time
+
+import opencas
+
+
+def test_run_parallel_keeps_order_and_errors():
+    def func(item):
+        if item == 3:
+            raise ValueError("bad item")
+        time.sleep(0.01 * (5 - item))
+        return item * 10
+
+    tasks = opencas.run_parallel(func, [1, 2, 3, 4], jobs=4)
+
+    assert [task.item for task in tasks] == [1, 2, 3, 4]
+    assert [task.result for task in tasks] == [10, 20, None, 40]
+    assert isinstance(tasks[2].error, ValueError)
+    assert all(task.duration >= 0 for task in tasks)
+
+
+def test_run_parallel_bounded():
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def func(item):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    opencas.run_parallel(func, range(8), jobs=3)
+
+    assert 1 < max_running[0] <= 3
+
+
+def test_run_parallel_serial():
+    threads = set()
+
+    opencas.run_parallel(lambda item: threads.add(threading.current_thread()),
+                         range(4), jobs=1)
+
+    assert threads == {threading.current_thread()}
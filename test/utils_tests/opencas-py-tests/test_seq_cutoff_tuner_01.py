@@ -0,0 +1,140 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import io
+import json
+import pytest
+from unittest.mock import patch
+
+import opencas
+import helpers as h
+
+DEV_LIST = [
+    {"type": "cache", "id": "1", "disk": "/dev/nvme0n1", "status": "Running",
+        "write policy": "wt", "device": "-"},
+    {"type": "core", "id": "1", "disk": "/dev/sda", "status": "Active",
+        "write policy": "-", "device": "/dev/cas1-1"},
+]
+
+
+class workload(object):
+    """
+    Generates consecutive samples of single core and backing device busy time
+    """
+
+    def __init__(self):
+        self.time = 0
+        self.busy = 0
+        self.req = {"rd_total": 0, "wr_total": 0, "rd_hits": 0, "wr_hits": 0,
+                    "rd_pt": 0, "wr_pt": 0}
+
+    def step(self, utilization, requests, hits, pt):
+        self.time += 1
+        self.busy += utilization * 10
+        self.req["wr_total"] += requests
+        self.req["wr_hits"] += hits
+        self.req["wr_pt"] += pt
+        return opencas.stats_sample(
+            self.time, {(1, 1): {"req": dict(self.req)}}, {},
+            opencas.DeviceStateSnapshot(DEV_LIST))
+
+
+@pytest.fixture
+def load():
+    load = workload()
+    with patch("time.monotonic", new=lambda: load.time), \
+            patch("opencas.get_disk_busy_time", new=lambda disk: load.busy), \
+            patch("opencas.seq_cutoff_tuner.get_settings",
+                  return_value=(1024, "full")), \
+            patch("opencas.casadm.run_cmd") as mock_run:
+        load.run_cmd = mock_run
+        yield load
+
+
+def run(tuner, load, steps, **kwargs):
+    entries = []
+    previous = load.step(**kwargs)
+    for _ in range(steps):
+        sample = load.step(**kwargs)
+        entries += tuner.update(previous, sample)
+        previous = sample
+    return entries
+
+
+def test_get_disk_busy_time(tmp_path):
+    (tmp_path / "sda").mkdir()
+    (tmp_path / "sda/stat").write_text(
+        "  4032  1004  205412  1863  88  61  1192  97  0  1716  1960  0  0  0  0\n")
+
+    assert opencas.get_disk_busy_time("/dev/sda", str(tmp_path)) == 1716
+    assert opencas.get_disk_busy_time("/dev/sdb", str(tmp_path)) is None
+
+
+def test_seq_cutoff_tuner_raises_threshold_then_policy(load):
+    log = io.StringIO()
+    tuner = opencas.seq_cutoff_tuner(max_threshold=4096, hold=2, log=log)
+
+    entries = run(tuner, load, 8, utilization=95, requests=1000, hits=900, pt=500)
+
+    assert [(e["param"], e["new"]) for e in entries] == \
+        [("threshold", 2048), ("threshold", 4096), ("policy", "never")]
+    assert load.run_cmd.call_args_list[0][0][0][-6:] == \
+        ["--cache-id", "1", "--core-id", "1", "--threshold", "2048"]
+    assert load.run_cmd.call_args[0][0][-2:] == ["--policy", "never"]
+    logged = [json.loads(line) for line in log.getvalue().splitlines()]
+    assert logged == entries
+    assert logged[0]["utilization"] == 95
+    assert logged[0]["old"] == 1024
+
+
+def test_seq_cutoff_tuner_lowers_within_bounds(load):
+    tuner = opencas.seq_cutoff_tuner(min_threshold=256, policies=["always", "full"],
+                                     hold=1)
+
+    entries = run(tuner, load, 5, utilization=10, requests=1000, hits=50, pt=0)
+
+    assert [(e["param"], e["new"]) for e in entries] == \
+        [("policy", "always"), ("threshold", 512), ("threshold", 256)]
+
+
+def test_seq_cutoff_tuner_hysteresis(load):
+    tuner = opencas.seq_cutoff_tuner(hold=3)
+
+    # Alternating load never holds decision long enough
+    entries = []
+    previous = load.step(95, 1000, 900, 500)
+    for i in range(10):
+        sample = load.step(95 if i % 3 else 50, 1000, 900, 500)
+        entries += tuner.update(previous, sample)
+        previous = sample
+
+    assert entries == []
+    load.run_cmd.assert_not_called()
+
+
+def test_seq_cutoff_tuner_dry_run_and_errors(load):
+    tuner = opencas.seq_cutoff_tuner(hold=1, dry_run=True)
+    entries = run(tuner, load, 3, utilization=95, requests=1000, hits=900, pt=500)
+
+    load.run_cmd.assert_not_called()
+    assert [(e["new"], e["dry_run"]) for e in entries] == [(2048, True), (4096, True)]
+
+    load.run_cmd.side_effect = opencas.casadm.CasadmError(
+        h.get_process_mock(1, "", "Core is inactive"))
+    tuner = opencas.seq_cutoff_tuner(hold=1)
+    entries = run(tuner, load, 3, utilization=95, requests=1000, hits=900, pt=500)
+
+    # Failed change is retried from unchanged setting
+    assert [(e["new"], e["error"]) for e in entries] == \
+        [(2048, "Core is inactive"), (2048, "Core is inactive")]
+
+
+def test_seq_cutoff_tuner_invalid_bounds():
+    with pytest.raises(ValueError):
+        opencas.seq_cutoff_tuner(min_threshold=0)
+    with pytest.raises(ValueError):
+        opencas.seq_cutoff_tuner(min_threshold=1024, max_threshold=512)
+    with pytest.raises(ValueError):
+        opencas.seq_cutoff_tuner(policies=["sometimes"])
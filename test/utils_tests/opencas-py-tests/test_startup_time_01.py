@@ -0,0 +1,84 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import os
+import subprocess
+import sys
+
+import helpers as h
+
+# Time [us] allowed for modules pulled in by `import opencas` (python -X importtime
+# cumulative time of opencas minus its own). Heavy modules used only by some
+# of the commands have to be imported lazily to fit in.
+IMPORT_BUDGET_US = 20000
+
+# Modules which must not be imported just by importing opencas
+LAZY_MODULES = [
+    "argparse",
+    "cas_ioctl",
+    "concurrent.futures",
+    "csv",
+    "ctypes",
+    "hashlib",
+    "json",
+    "re",
+    "select",
+    "socket",
+    "subprocess",
+    "tempfile",
+    "threading",
+]
+
+
+def get_import_times(code):
+    """
+    Run code in fresh interpreter with -X importtime. Returns dict of module
+    name -> (self time, cumulative time) in microseconds.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.join(h.find_repo_root(), "utils")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE, universal_newlines=True, env=env, check=True
+    )
+
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+def get_dependencies_time(times):
+    self_us, cumulative_us = times["opencas"]
+    return cumulative_us - self_us
+
+
+def test_opencas_lazy_imports():
+    baseline = get_import_times("pass")
+    times = get_import_times("import opencas")
+
+    imported = set(times) - set(baseline)
+
+    assert "opencas" in imported
+    assert [module for module in LAZY_MODULES if module in imported] == []
+
+
+def test_opencas_import_budget():
+    # Best of few runs to filter out noise of loaded machine
+    dependencies_us = min(get_dependencies_time(get_import_times("import opencas"))
+                          for _ in range(3))
+
+    assert dependencies_us < IMPORT_BUDGET_US
+
+
+if __name__ == "__main__":
+    # Startup benchmark: python3 test_startup_time_01.py
+    times = get_import_times("import opencas")
+    print("import opencas: {0} us total, {1} us in dependencies (budget {2} us)".format(
+        times["opencas"][1], get_dependencies_time(times), IMPORT_BUDGET_US))
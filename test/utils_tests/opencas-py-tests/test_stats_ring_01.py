@@ -0,0 +1,151 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import os
+import struct
+import pytest
+from unittest.mock import patch
+
+import opencas
+
+RECORD_SIZE = struct.calcsize(opencas.stats_ring.record_format)
+
+
+def get_stats(**values):
+    stats = {group: {counter: 0 for counter, _ in counters}
+             for group, _, _, _, counters in opencas.stats_groups}
+    for name, value in values.items():
+        group, counter = name.split("__")
+        stats[group][counter] = value
+    return stats
+
+
+def get_sample(stats):
+    return opencas.stats_sample(0, stats, {})
+
+
+def add(recorder, sample, timestamp, monotonic=None):
+    """Add sample taken at given wall clock and monotonic time"""
+    with patch("time.monotonic",
+               return_value=timestamp if monotonic is None else monotonic):
+        return recorder.add(sample, timestamp)
+
+
+@pytest.fixture
+def ring_path(tmp_path):
+    return str(tmp_path / "stats.ring")
+
+
+def test_stats_ring_wraps(ring_path):
+    ring = opencas.stats_ring.create(ring_path, opencas.stats_ring.header_size +
+                                     10 * RECORD_SIZE)
+    fields = len(opencas.stats_ring.fields)
+
+    ring.append([(1000 + i, 1, None, [i] * fields) for i in range(25)])
+
+    assert ring.capacity == 10
+    assert os.path.getsize(ring_path) == opencas.stats_ring.get_file_size(10)
+    records = list(ring.read())
+    assert [r["time"] for r in records] == list(range(1015, 1025))
+    assert records[0]["requests_rd_hits"] == 15
+    assert records[0]["core_id"] is None
+    ring.close()
+
+
+def test_stats_ring_range_query(ring_path):
+    ring = opencas.stats_ring.create(ring_path, 1024 * 1024)
+    fields = len(opencas.stats_ring.fields)
+    for t in range(100, 200):
+        ring.append([(t, 1, None, [0] * fields), (t, 1, 2, [t] * fields)])
+    ring.close()
+
+    with opencas.stats_ring.open(ring_path) as ring:
+        records = list(ring.read(since=150, until=152, core_id=2))
+        assert [(r["time"], r["cache_id"], r["core_id"]) for r in records] == \
+            [(150, 1, 2), (151, 1, 2), (152, 1, 2)]
+        assert len(list(ring.read(since=190))) == 20
+        assert list(ring.read(since=300)) == []
+
+        # Range is found by binary search, not by scanning all records
+        with patch.object(ring, "get_key", wraps=ring.get_key) as ts:
+            list(ring.read(since=150, until=152))
+        assert ts.call_count < 20
+
+
+def test_stats_ring_reopen(ring_path):
+    size = opencas.stats_ring.header_size + 10 * RECORD_SIZE
+    fields = len(opencas.stats_ring.fields)
+    with opencas.stats_ring.create(ring_path, size) as ring:
+        ring.append([(1, 1, None, [0] * fields)])
+
+    # Same size - recording continues, different size - file is reinitialized
+    with opencas.stats_ring.create(ring_path, size) as ring:
+        ring.append([(2, 1, None, [0] * fields)])
+        assert [r["time"] for r in ring.read()] == [1, 2]
+    with opencas.stats_ring.create(ring_path, size + RECORD_SIZE) as ring:
+        assert list(ring.read()) == []
+
+    with open(ring_path, "r+b") as f:
+        f.write(b"garbage!")
+    with pytest.raises(ValueError):
+        opencas.stats_ring.open(ring_path)
+
+
+def test_stats_recorder_increments(ring_path):
+    ring = opencas.stats_ring.create(ring_path, 1024 * 1024)
+    recorder = opencas.stats_recorder(ring, keepalive=60)
+
+    # First sample only sets base for increments
+    assert add(recorder, get_sample({(1, 1): get_stats(req__rd_hits=100)}), 1000) == 0
+    assert add(recorder, get_sample({(1, 1): get_stats(
+        req__rd_hits=150, usage__dirty=8)}), 1001) == 1
+    # Counters restarted with cache
+    assert add(recorder, get_sample({(1, 1): get_stats(
+        req__rd_hits=30, usage__dirty=8)}), 1002) == 1
+
+    records = list(ring.read())
+    assert [r["requests_rd_hits"] for r in records] == [50, 30]
+    assert [r["usage_dirty"] for r in records] == [8, 8]
+    assert records[0]["core_id"] == 1
+    ring.close()
+
+
+def test_stats_recorder_skips_idle(ring_path):
+    ring = opencas.stats_ring.create(ring_path, 1024 * 1024)
+    recorder = opencas.stats_recorder(ring, keepalive=10)
+    idle = get_sample({(1, None): get_stats(usage__occupancy=5)})
+    busy = {(1, None): get_stats(usage__occupancy=5),
+            (1, 1): get_stats(req__total=1)}
+
+    add(recorder, get_sample(busy), 0)
+    recorded = [add(recorder, get_sample(busy), 1)]
+    recorded += [add(recorder, idle, t) for t in range(2, 15)]
+
+    # Idle cache is recorded again only after keepalive
+    assert recorded == [2] + [0] * 9 + [1] + [0] * 3
+    ring.close()
+
+
+def test_stats_recorder_wall_clock_step(ring_path):
+    ring = opencas.stats_ring.create(ring_path, 1024 * 1024)
+    recorder = opencas.stats_recorder(ring, keepalive=1)
+    sample = get_sample({(1, None): get_stats(usage__occupancy=5)})
+
+    for t in range(10):
+        # Wall clock steps back by 100s in the middle of recording
+        add(recorder, sample, 1000 + t - (100 if t >= 5 else 0), 50 + t)
+
+    records = list(ring.read())
+    assert [r["time"] for r in records] == \
+        [1001, 1002, 1003, 1004, 905, 906, 907, 908, 909]
+    # Range is searched by keys following monotonic clock
+    assert [r["time"] for r in ring.read(since=1003, until=1006)] == [1003, 1004, 905, 906]
+
+    # Keys of following recorder run don't go below recorded ones
+    recorder = opencas.stats_recorder(ring, keepalive=1)
+    add(recorder, sample, 500, 1)
+    add(recorder, sample, 502, 3)
+    assert [r["time"] for r in ring.read(since=1009)] == [909, 502]
+    ring.close()
@@ -0,0 +1,82 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+from unittest.mock import patch
+
+import cas_ioctl
+import opencas
+import helpers as h
+
+
+def get_fake_device(rd_hits, rd_total, volume_rd, dirty):
+    return h.FakeCtrlDevice(
+        caches={
+            1: {
+                "device": "/dev/dummy_cache",
+                "stats": {"req": {"total": rd_total, "rd_total": rd_total,
+                                  "rd_hits": rd_hits}},
+                "cores": {
+                    1: {"device": "/dev/dummy_core1",
+                        "stats": {"req": {"total": rd_total, "rd_total": rd_total,
+                                          "rd_hits": rd_hits, "rd_pt": rd_total // 10},
+                                  "blocks": {"volume_rd": volume_rd},
+                                  "usage": {"dirty": dirty}}},
+                    2: {"device": "/dev/dummy_core2"},
+                },
+            },
+        },
+    )
+
+
+@patch("os.path.realpath", new=lambda x: x)
+@patch("time.monotonic")
+@patch("opencas.ctrl_ioctl.open")
+def test_stats_rates(mock_open, mock_time):
+    mock_open.return_value = get_fake_device(0, 0, 0, 1000)
+    mock_time.return_value = 100.0
+    before = opencas.stats_sample.take()
+
+    mock_open.return_value = get_fake_device(1500, 2000, 512, 744)
+    mock_time.return_value = 102.0
+    after = opencas.stats_sample.take()
+
+    rates = {(r["cache_id"], r["core_id"]): r
+             for r in opencas.get_stats_rates(before, after)}
+
+    assert set(rates) == {(1, None), (1, 1), (1, 2)}
+    core = rates[(1, 1)]
+    assert core["name"] == "cas1-1"
+    assert core["iops"] == 1000
+    assert core["hit"] == 75
+    assert core["read"] == 1
+    assert core["write"] == 0
+    assert core["dirty"] == -0.5
+    assert core["pt"] == 100
+    assert rates[(1, None)]["name"] == "cache1"
+    assert rates[(1, 2)]["hit"] is None
+
+
+@patch("os.path.realpath", new=lambda x: x)
+@patch("opencas.ctrl_ioctl.open")
+def test_stats_sample_single_handle(mock_open):
+    """
+    Check that sample is taken over one control device handle, with one
+    stats request per cache and core
+    """
+    fake = get_fake_device(0, 0, 0, 0)
+    mock_open.return_value = fake
+
+    sample = opencas.stats_sample.take()
+
+    mock_open.assert_called_once()
+    assert len(sample.stats) == 3
+    assert fake.requests.count(cas_ioctl.KCAS_IOCTL_GET_STATS) == 3
+
+
+def test_stats_rates_new_device():
+    before = opencas.stats_sample(1.0, {}, {})
+    after = opencas.stats_sample(2.0, {(1, None): {}}, {(1, None): "cache1"})
+
+    assert opencas.get_stats_rates(before, after) == []
@@ -0,0 +1,125 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import json
+import pytest
+from unittest.mock import patch
+
+import opencas
+
+
+@pytest.fixture
+def journal(tmp_path):
+    path = str(tmp_path / "timeline.jsonl")
+    opencas.timeline.open("casctl init", path)
+    yield path
+    opencas.timeline.close()
+
+
+def read_journal(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def get_span(name, start, duration, kind="step", boot_id="boot1"):
+    return {"boot_id": boot_id, "process": "casctl init", "pid": 1, "kind": kind,
+            "name": name, "start": start, "duration": duration, "result": "ok"}
+
+
+def test_timeline_disabled(tmp_path):
+    with opencas.timeline.span("parse config"):
+        pass
+
+    assert opencas.timeline.fd is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_timeline_records_spans(journal):
+    with pytest.raises(SystemExit):
+        with opencas.timeline.operation("casctl init", args=["--force"]):
+            with opencas.timeline.span("parse config"):
+                pass
+            with pytest.raises(ValueError):
+                with opencas.timeline.span("wait for cas_ctrl"):
+                    raise ValueError("Timeout")
+            exit(2)
+
+    spans = read_journal(journal)
+
+    assert [(s["kind"], s["name"], s["result"]) for s in spans] == [
+        ("step", "parse config", "ok"),
+        ("step", "wait for cas_ctrl", "failed"),
+        ("operation", "casctl init", "failed"),
+    ]
+    assert spans[1]["error"] == "Timeout"
+    assert spans[2]["exit_code"] == 2
+    assert spans[2]["args"] == ["--force"]
+    assert spans[2]["start"] <= spans[0]["start"]
+    assert spans[2]["duration"] >= spans[0]["duration"] + spans[1]["duration"]
+    assert all(s["process"] == "casctl init" for s in spans)
+
+
+@patch("opencas.casadm.result")
+def test_timeline_casadm_spans(mock_result, journal):
+    mock_result.return_value = opencas.casadm.batch_result(1, "", "Device busy\n")
+
+    with pytest.raises(opencas.casadm.CasadmError):
+        opencas.casadm.start_cache("/dev/nvme0n1", cache_id=1, load=True)
+
+    span, = read_journal(journal)
+    assert span["name"] == "casadm --start-cache --load"
+    assert span["devices"] == ["/dev/nvme0n1"]
+    assert span["exit_code"] == 1
+    assert span["error"] == "Device busy"
+    assert span["result"] == "failed"
+    assert span["cmd"].startswith("/sbin/casadm --start-cache")
+    assert opencas.casadm.get_operation(
+        opencas.casadm.add_core_cmd("/dev/sda", 1)) == "casadm --add-core"
+
+
+def test_timeline_load_last_boot(tmp_path):
+    path = tmp_path / "timeline.jsonl"
+    path.write_text(
+        json.dumps(get_span("parse config", 5, 1, boot_id="boot1")) + "\n" +
+        json.dumps(get_span("settle wait", 2, 1, boot_id="boot2")) + "\n" +
+        '{"boot_id": "boot2", "name": "trunc\n' +
+        json.dumps(get_span("parse config", 1, 1, boot_id="boot2")) + "\n")
+
+    spans = opencas.timeline.load(str(path))
+
+    assert [(s["name"], s["boot_id"]) for s in spans] == \
+        [("parse config", "boot2"), ("settle wait", "boot2")]
+    assert len(opencas.timeline.load(str(path), boot_id="boot1")) == 1
+
+
+def test_timeline_critical_path():
+    spans = [
+        get_span("casctl settle", 1.0, 9.0, kind="operation"),
+        get_span("modprobe cas_cache", 1.0, 0.5),
+        get_span("wait for cas_ctrl", 1.2, 0.5, kind="wait"),
+        get_span("casadm --start-cache --load", 2.0, 3.0),
+        get_span("casadm --start-cache --load", 2.0, 1.0),
+        get_span("casadm --add-core", 5.5, 0.5),
+        get_span("casadm --add-core", 3.5, 0.2),
+        get_span("settle wait", 1.1, 4.9, kind="wait"),
+        get_span("settle wait", 6.0, 4.0, kind="wait"),
+    ]
+
+    path = opencas.timeline.get_critical_path(spans)
+
+    assert [(s["name"], s["start"], s["critical"]) for s in path] == [
+        ("modprobe cas_cache", 1.0, 0.5),
+        ("wait for cas_ctrl", 1.2, 0.2),
+        ("casadm --start-cache --load", 2.0, 3.0),
+        ("casadm --add-core", 5.5, 0.5),
+        ("settle wait", 6.0, 4.0),
+    ]
+    # Wait overlapping add core only covers time after it
+    spans[-1]["start"] = 5.8
+    spans[-1]["duration"] = 4.2
+    path = opencas.timeline.get_critical_path(spans)
+    assert [(s["name"], s["critical"]) for s in path[-2:]] == \
+        [("casadm --add-core", 0.5), ("settle wait", 4.0)]
+    assert opencas.timeline.get_critical_path(spans[:1]) == []
@@ -0,0 +1,132 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import socket
+import struct
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+import opencas
+
+
+def kernel_event(action, name, subsystem="block"):
+    return "{0}@/devices/virtual/block/{1}\0ACTION={0}\0DEVPATH=/devices/virtual/block/{1}\0" \
+        "SUBSYSTEM={2}\0DEVNAME={1}\0".format(action, name, subsystem).encode()
+
+
+def libudev_event(properties):
+    payload = "".join("{}={}\0".format(k, v) for k, v in properties.items()).encode()
+    # struct udev_monitor_netlink_header: prefix, magic (network byte order),
+    # header_size, properties_off, properties_len, filter hashes and bloom
+    # (host byte order)
+    header_size = 40
+    header = struct.pack(">8sI", b"libudev\0", 0xFEEDCAFE) + \
+        struct.pack("=III", header_size, header_size, len(payload))
+    return header + b"\0" * (header_size - len(header)) + payload
+
+
+@pytest.fixture
+def monitor():
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    with opencas.udev_monitor(receiver, ["/dev/disk/by-id/dummy-core"]) as m:
+        m.sender = sender
+        yield m
+    sender.close()
+
+
+def test_udev_monitor_parse():
+    assert opencas.udev_monitor.parse(kernel_event("add", "cas1-1")) == {
+        "ACTION": "add",
+        "DEVPATH": "/devices/virtual/block/cas1-1",
+        "SUBSYSTEM": "block",
+        "DEVNAME": "cas1-1",
+    }
+    assert opencas.udev_monitor.parse(libudev_event(
+        {"SUBSYSTEM": "block", "DEVNAME": "/dev/sdb", "DEVLINKS": "/dev/a /dev/b"}
+    )) == {"SUBSYSTEM": "block", "DEVNAME": "/dev/sdb", "DEVLINKS": "/dev/a /dev/b"}
+
+
+def test_udev_monitor_relevant(monitor):
+    assert monitor.is_relevant({"SUBSYSTEM": "block", "DEVNAME": "/dev/cas2-13"})
+    assert monitor.is_relevant({"SUBSYSTEM": "block", "DEVNAME": "/dev/sdx",
+                                "DEVLINKS": "/dev/disk/by-id/dummy-core /dev/x"})
+    assert not monitor.is_relevant({"SUBSYSTEM": "block", "DEVNAME": "/dev/sdx"})
+    assert not monitor.is_relevant({"SUBSYSTEM": "net", "DEVNAME": "cas1-1"})
+
+
+def test_udev_monitor_wait_coalesces(monitor):
+    monitor.sender.send(kernel_event("add", "sdx"))
+    monitor.sender.send(kernel_event("add", "cas1-1"))
+    monitor.sender.send(kernel_event("change", "cas1-1"))
+
+    start = time.time()
+    assert monitor.wait(5)
+    assert time.time() - start < 1
+
+    # All queued events were consumed by single wait
+    assert not monitor.wait(0.1)
+
+
+def test_udev_monitor_wait_ignores_irrelevant(monitor):
+    monitor.sender.send(kernel_event("add", "sdx"))
+    monitor.sender.send(kernel_event("add", "eth0", subsystem="net"))
+
+    assert not monitor.wait(0.2)
+
+
+@patch("opencas.cas_config.from_file")
+@patch("opencas.get_caches_list")
+def test_cas_settle_wakes_up_on_event(mock_list, mock_config, monitor):
+    """
+    Check that settle returns right after core shows up, not after interval
+    """
+    mock_config.return_value.get_startup_cores.return_value = [
+        opencas.cas_config.core_config(1, 1, "/dev/disk/by-id/dummy-core")
+    ]
+    started = [
+        {"type": "cache", "id": "1", "disk": "/dev/dummy_cache", "status": "Running",
+            "write policy": "wt", "device": "-"},
+        {"type": "core", "id": "1", "disk": "/dev/dummy", "status": "Active",
+            "write policy": "-", "device": "/dev/cas1-1"},
+    ]
+    mock_list.return_value = []
+
+    def add_core():
+        time.sleep(0.2)
+        mock_list.return_value = started
+        monitor.sender.send(kernel_event("add", "cas1-1"))
+
+    thread = threading.Thread(target=add_core)
+    thread.start()
+    start = time.time()
+    result = opencas.wait_for_startup(timeout=10, interval=5, monitor=monitor)
+    duration = time.time() - start
+    thread.join()
+
+    assert result == []
+    assert duration < 1
+    assert mock_list.call_count == 2
+
+
+@patch("opencas.udev_monitor.open")
+@patch("opencas.cas_config.from_file")
+@patch("opencas.get_caches_list")
+def test_cas_settle_polling_fallback(mock_list, mock_config, mock_open):
+    """
+    Check that state is polled every interval if events can't be received
+    """
+    mock_open.return_value = None
+    mock_config.return_value.get_startup_cores.return_value = [
+        opencas.cas_config.core_config(1, 1, "/dev/dummy")
+    ]
+    mock_list.return_value = []
+
+    result = opencas.wait_for_startup(timeout=1, interval=0.25)
+
+    assert len(result) == 1
+    assert mock_list.call_count == 4
+    mock_open.assert_called_once_with(["/dev/dummy"])
@@ -0,0 +1,118 @@
+#
+# Copyright(c) 2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import os
+import pytest
+from unittest.mock import patch
+
+import opencas
+import helpers as h
+
+
+@pytest.fixture
+def override_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "cas-load-override.rules")
+    monkeypatch.setattr(opencas, "udev_override_path", path)
+    return path
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "opencas.conf"
+    path.write_text(
+        "version=19.3.0\n"
+        "[caches]\n"
+        "1\t/dev/disk/by-id/nvme-INTEL_SSD_1234\tWB\n"
+        "[cores]\n"
+        "1\t1\t/dev/disk/by-id/wwn-0x5000c500a1b2c3d4\n"
+        "1\t2\t/dev/sdx\n"
+        "1\t3\t/dev/cas2-1\n"
+    )
+    return path
+
+
+def test_udev_rules_order():
+    """
+    Check that generated rules are run after by-id links are created, and
+    that override replaces shipped catch-all rule
+    """
+    rules_dir = os.path.join(h.find_repo_root(), "utils")
+    shipped = "60-persistent-storage-cas-load.rules"
+
+    assert os.path.exists(os.path.join(rules_dir, shipped))
+    assert sorted([os.path.basename(opencas.udev_rules_path),
+                   "60-persistent-storage.rules"])[0] == "60-persistent-storage.rules"
+    assert os.path.basename(opencas.udev_override_path) == shipped
+    assert os.path.dirname(opencas.udev_override_path) == \
+        os.path.dirname(opencas.udev_rules_path)
+
+
+def test_get_udev_match():
+    assert opencas.get_udev_match("/dev/disk/by-id/wwn-0x5000c500a1b2c3d4-part1") == \
+        'SYMLINK=="disk/by-id/wwn-0x5000c500a1b2c3d4-part1"'
+    assert opencas.get_udev_match("/dev/cas1-2") == 'KERNEL=="cas1-2"'
+    assert opencas.get_udev_match("/dev/nvme0n1") == 'KERNEL=="nvme0n1"'
+
+    with pytest.raises(ValueError):
+        opencas.get_udev_match("/tmp/dummy")
+
+
+@patch("opencas.cas_config.get_by_id_path")
+def test_update_udev_rules(mock_by_id, config_file, tmp_path, override_path):
+    mock_by_id.side_effect = lambda path: path
+    rules_path = str(tmp_path / "cas-load.rules")
+
+    assert opencas.update_udev_rules(str(config_file), rules_path)
+
+    rules = open(rules_path).read().splitlines()
+    matches = [line for line in rules if 'GOTO="cas_loader_run"' in line]
+    assert matches == [
+        'SYMLINK=="disk/by-id/nvme-INTEL_SSD_1234", GOTO="cas_loader_run"',
+        'SYMLINK=="disk/by-id/wwn-0x5000c500a1b2c3d4", GOTO="cas_loader_run"',
+        'KERNEL=="sdx", GOTO="cas_loader_run"',
+        'KERNEL=="cas2-1", GOTO="cas_loader_run"',
+    ]
+    # Loader is run only after one of configured devices matched
+    run = rules.index('RUN+="/lib/opencas/open-cas-loader /dev/$name"')
+    assert rules[run - 1] == 'LABEL="cas_loader_run"'
+    assert rules[run - 3] == 'GOTO="cas_loader_end"'
+    assert oct(os.stat(rules_path).st_mode & 0o777) == oct(0o644)
+    # Shipped catch-all rule is overridden with one without any rules
+    override = open(opencas.udev_override_path).read().splitlines()
+    assert override and all(line.startswith("#") for line in override)
+
+
+@patch("opencas.cas_config.get_by_id_path")
+def test_update_udev_rules_only_on_change(mock_by_id, config_file, tmp_path,
+                                          override_path):
+    mock_by_id.side_effect = lambda path: path
+    rules_path = str(tmp_path / "cas-load.rules")
+
+    assert opencas.update_udev_rules(str(config_file), rules_path)
+    assert not opencas.update_udev_rules(str(config_file), rules_path)
+    assert opencas.update_udev_rules(str(config_file), rules_path, force=True)
+
+    os.unlink(opencas.udev_override_path)
+    assert opencas.update_udev_rules(str(config_file), rules_path)
+    assert os.path.exists(opencas.udev_override_path)
+    assert not opencas.update_udev_rules(str(config_file), rules_path)
+
+    with open(str(config_file), "a") as f:
+        f.write("1\t4\t/dev/disk/by-id/wwn-0x5000c500deadbeef\n")
+
+    assert opencas.update_udev_rules(str(config_file), rules_path)
+    assert 'SYMLINK=="disk/by-id/wwn-0x5000c500deadbeef"' in open(rules_path).read()
+
+
+def test_update_udev_rules_empty_config(tmp_path, override_path):
+    config_file = tmp_path / "opencas.conf"
+    config_file.write_text("version=19.3.0\n[caches]\n[cores]\n")
+    rules_path = str(tmp_path / "cas-load.rules")
+
+    opencas.update_udev_rules(str(config_file), rules_path)
+
+    rules = open(rules_path).read()
+    assert "SYMLINK" not in rules and "KERNEL" not in rules
+    assert rules.index('GOTO="cas_loader_end"\n\nLABEL="cas_loader_run"') > 0
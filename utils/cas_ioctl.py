@@ -0,0 +1,609 @@
+#
+# Copyright(c) 2012-2020 Intel Corporation
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+
+import ctypes
+import errno
+import fcntl
+import os
+
+# Userspace mirror of modules/include/cas_ioctl_codes.h
+#
+# Structure sizes are encoded in ioctl request numbers, so a layout mismatch
+# between these definitions and the loaded kernel module is rejected by the
+# module (ENOTTY) instead of corrupting memory. Callers are expected to treat
+# any OSError as "native interface unavailable" and fall back to casadm.
+
+MAX_STR_LEN = 4096
+MAX_ELEVATOR_NAME = 16
+CACHE_LIST_ID_LIMIT = 20
+OCF_CORE_MAX = 4096
+OCF_IO_CLASS_MAX = 33
+OCF_IO_CLASS_INVALID = OCF_IO_CLASS_MAX
+
+OCF_CORE_ID_INVALID = OCF_CORE_MAX
+
+KiB = 1024
+
+# ocf_cache_state_t bits
+cache_states = ['Running', 'Stopping', 'Initializing', 'Incomplete']
+NOT_RUNNING_STATE = 'Not running'
+CACHE_STATE_RUNNING = 0
+
+# ocf_core_state_t
+core_states = ['Active', 'Inactive']
+
+# ocf_cache_mode_t
+cache_modes = ['wt', 'wb', 'wa', 'pt', 'wi', 'wo']
+
+cleaning_policies = ['nop', 'alru', 'acp']
+promotion_policies = ['always', 'nhit']
+seq_cutoff_policies = ['always', 'full', 'never']
+
+
+# OCF structures embedded in ioctl payloads
+
+
+class ocf_cache_info(ctypes.Structure):
+    class _inactive(ctypes.Structure):
+        _fields_ = [
+            ('occupancy', ctypes.c_uint32),
+            ('dirty', ctypes.c_uint32),
+        ]
+
+    class _fallback_pt(ctypes.Structure):
+        _fields_ = [
+            ('error_counter', ctypes.c_int),
+            ('status', ctypes.c_bool),
+        ]
+
+    _fields_ = [
+        ('attached', ctypes.c_bool),
+        ('volume_type', ctypes.c_uint8),
+        ('size', ctypes.c_uint32),
+        ('inactive', _inactive),
+        ('occupancy', ctypes.c_uint32),
+        ('dirty', ctypes.c_uint32),
+        ('dirty_initial', ctypes.c_uint32),
+        ('dirty_for', ctypes.c_uint32),
+        ('cache_mode', ctypes.c_int),
+        ('fallback_pt', _fallback_pt),
+        ('state', ctypes.c_uint8),
+        ('eviction_policy', ctypes.c_int),
+        ('cleaning_policy', ctypes.c_int),
+        ('promotion_policy', ctypes.c_int),
+        ('cache_line_size', ctypes.c_int),
+        ('flushed', ctypes.c_uint32),
+        ('core_count', ctypes.c_uint32),
+        ('metadata_footprint', ctypes.c_uint64),
+        ('metadata_end_offset', ctypes.c_uint32),
+    ]
+
+
+class ocf_core_info(ctypes.Structure):
+    _fields_ = [
+        ('core_size', ctypes.c_uint64),
+        ('core_size_bytes', ctypes.c_uint64),
+        ('dirty', ctypes.c_uint32),
+        ('flushed', ctypes.c_uint32),
+        ('dirty_for', ctypes.c_uint32),
+        ('seq_cutoff_threshold', ctypes.c_uint32),
+        ('seq_cutoff_policy', ctypes.c_int),
+    ]
+
+
+class ocf_stat(ctypes.Structure):
+    _fields_ = [
+        ('value', ctypes.c_uint64),
+        ('fraction', ctypes.c_uint64),
+    ]
+
+
+def _stat_fields(*names):
+    return [(name, ocf_stat) for name in names]
+
+
+class ocf_stats_usage(ctypes.Structure):
+    _fields_ = _stat_fields('occupancy', 'free', 'clean', 'dirty')
+
+
+class ocf_stats_requests(ctypes.Structure):
+    _fields_ = _stat_fields(
+        'rd_hits', 'rd_partial_misses', 'rd_full_misses', 'rd_total',
+        'wr_hits', 'wr_partial_misses', 'wr_full_misses', 'wr_total',
+        'rd_pt', 'wr_pt', 'serviced', 'total')
+
+
+class ocf_stats_blocks(ctypes.Structure):
+    _fields_ = _stat_fields(
+        'core_volume_rd', 'core_volume_wr', 'core_volume_total',
+        'cache_volume_rd', 'cache_volume_wr', 'cache_volume_total',
+        'volume_rd', 'volume_wr', 'volume_total')
+
+
+class ocf_stats_errors(ctypes.Structure):
+    _fields_ = _stat_fields(
+        'core_volume_rd', 'core_volume_wr', 'core_volume_total',
+        'cache_volume_rd', 'cache_volume_wr', 'cache_volume_total',
+        'total')
+
+
+# ioctl payloads
+
+
+class kcas_get_stats(ctypes.Structure):
+    _fields_ = [
+        ('cache_id', ctypes.c_uint16),
+        ('core_id', ctypes.c_uint16),
+        ('part_id', ctypes.c_uint16),
+        ('usage', ocf_stats_usage),
+        ('req', ocf_stats_requests),
+        ('blocks', ocf_stats_blocks),
+        ('errors', ocf_stats_errors),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_cache_info(ctypes.Structure):
+    _fields_ = [
+        ('cache_id', ctypes.c_uint16),
+        ('cache_path_name', ctypes.c_char * MAX_STR_LEN),
+        ('core_id', ctypes.c_uint16 * OCF_CORE_MAX),
+        ('info', ocf_cache_info),
+        ('metadata_mode', ctypes.c_uint8),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_core_info(ctypes.Structure):
+    _fields_ = [
+        ('core_path_name', ctypes.c_char * MAX_STR_LEN),
+        ('cache_id', ctypes.c_uint16),
+        ('core_id', ctypes.c_uint16),
+        ('info', ocf_core_info),
+        ('state', ctypes.c_int),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_core_pool_path(ctypes.Structure):
+    _fields_ = [
+        ('core_path_tab', ctypes.c_void_p),
+        ('core_pool_count', ctypes.c_int),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_cache_count(ctypes.Structure):
+    _fields_ = [
+        ('cache_count', ctypes.c_int),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_core_pool_count(ctypes.Structure):
+    _fields_ = [
+        ('core_pool_count', ctypes.c_int),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_cache_list(ctypes.Structure):
+    _fields_ = [
+        ('id_position', ctypes.c_uint32),
+        ('in_out_num', ctypes.c_uint32),
+        ('cache_id_tab', ctypes.c_uint16 * CACHE_LIST_ID_LIMIT),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_cache_check_device(ctypes.Structure):
+    _fields_ = [
+        ('path_name', ctypes.c_char * MAX_STR_LEN),
+        ('is_cache_device', ctypes.c_bool),
+        ('clean_shutdown', ctypes.c_bool),
+        ('cache_dirty', ctypes.c_bool),
+        ('format_atomic', ctypes.c_bool),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_get_core_param(ctypes.Structure):
+    _fields_ = [
+        ('cache_id', ctypes.c_uint16),
+        ('core_id', ctypes.c_uint16),
+        ('param_id', ctypes.c_int),
+        ('param_value', ctypes.c_uint32),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+class kcas_get_cache_param(ctypes.Structure):
+    _fields_ = [
+        ('cache_id', ctypes.c_uint16),
+        ('param_id', ctypes.c_int),
+        ('param_value', ctypes.c_uint32),
+        ('ext_err_code', ctypes.c_int),
+    ]
+
+
+# enum kcas_core_param_id
+core_param_seq_cutoff_threshold = 0
+core_param_seq_cutoff_policy = 1
+
+# enum kcas_cache_param_id
+cache_param_cleaning_policy_type = 0
+cache_param_cleaning_alru_wake_up_time = 1
+cache_param_cleaning_alru_stale_buffer_time = 2
+cache_param_cleaning_alru_flush_max_buffers = 3
+cache_param_cleaning_alru_activity_threshold = 4
+cache_param_cleaning_acp_wake_up_time = 5
+cache_param_cleaning_acp_flush_max_buffers = 6
+cache_param_promotion_policy_type = 7
+cache_param_promotion_nhit_insertion_threshold = 8
+cache_param_promotion_nhit_trigger_threshold = 9
+
+# Request codes, as generated by linux/ioctl.h macros
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+KCAS_IOCTL_MAGIC = 0xBA
+
+
+def _IOC(direction, nr, struct):
+    return ((direction << 30) | (ctypes.sizeof(struct) << 16)
+            | (KCAS_IOCTL_MAGIC << 8) | nr) & 0xffffffff
+
+
+def _IOR(nr, struct):
+    return _IOC(_IOC_READ, nr, struct)
+
+
+def _IOW(nr, struct):
+    return _IOC(_IOC_WRITE, nr, struct)
+
+
+def _IOWR(nr, struct):
+    return _IOC(_IOC_READ | _IOC_WRITE, nr, struct)
+
+
+KCAS_IOCTL_GET_CACHE_COUNT = _IOR(16, kcas_cache_count)
+KCAS_IOCTL_LIST_CACHE = _IOWR(17, kcas_cache_list)
+KCAS_IOCTL_CACHE_INFO = _IOWR(24, kcas_cache_info)
+KCAS_IOCTL_CORE_INFO = _IOWR(25, kcas_core_info)
+KCAS_IOCTL_GET_CORE_POOL_COUNT = _IOR(26, kcas_core_pool_count)
+KCAS_IOCTL_GET_CORE_POOL_PATHS = _IOWR(27, kcas_core_pool_path)
+KCAS_IOCTL_CACHE_CHECK_DEVICE = _IOWR(29, kcas_cache_check_device)
+KCAS_IOCTL_GET_CORE_PARAM = _IOW(31, kcas_get_core_param)
+KCAS_IOCTL_GET_CACHE_PARAM = _IOW(33, kcas_get_cache_param)
+KCAS_IOCTL_GET_STATS = _IOR(34, kcas_get_stats)
+
+
+class IoctlError(OSError):
+    def __init__(self, request, err, ext_err_code=0):
+        super(IoctlError, self).__init__(
+            err, 'ioctl {0:#x} failed ({1}, ext_err_code {2})'.format(
+                request, os.strerror(err), ext_err_code))
+        self.request = request
+        self.ext_err_code = ext_err_code
+
+
+class ctrl_device(object):
+    path = '/dev/cas_ctrl'
+
+    def __init__(self, path=None):
+        self.fd = os.open(path or self.path, os.O_RDWR)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def ioctl(self, request, cmd):
+        try:
+            fcntl.ioctl(self.fd, request, cmd, True)
+        except OSError as e:
+            raise IoctlError(request, e.errno,
+                             getattr(cmd, 'ext_err_code', 0))
+
+
+def _decode(path):
+    return path.decode(errors='replace')
+
+
+def _dev_path(path):
+    # Same as casadm get_dev_path() - show device special file, not link
+    return os.path.realpath(path)
+
+
+def _flush_progress(dirty, flushed):
+    if not flushed:
+        return 0
+    total_dirty = dirty + flushed
+    return 100. * flushed / total_dirty if total_dirty else 100
+
+
+def _struct_to_dict(struct):
+    ret = {}
+    for name, _ in struct._fields_:
+        value = getattr(struct, name)
+        if isinstance(value, ocf_stat):
+            value = value.value
+        elif isinstance(value, ctypes.Structure):
+            value = _struct_to_dict(value)
+        ret[name] = value
+    return ret
+
+
+# Queries
+
+
+def get_cache_count(dev):
+    cmd = kcas_cache_count()
+    dev.ioctl(KCAS_IOCTL_GET_CACHE_COUNT, cmd)
+    return cmd.cache_count
+
+
+def get_cache_ids(dev):
+    count = get_cache_count(dev)
+    cache_ids = []
+
+    cmd = kcas_cache_list()
+    cmd.id_position = 0
+    while len(cache_ids) < count:
+        cmd.in_out_num = CACHE_LIST_ID_LIMIT
+        try:
+            dev.ioctl(KCAS_IOCTL_LIST_CACHE, cmd)
+        except IoctlError as e:
+            # EINVAL marks end of list, remaining entries are still valid
+            if e.errno != errno.EINVAL:
+                raise
+        cache_ids += list(cmd.cache_id_tab[:cmd.in_out_num])
+        cmd.id_position += CACHE_LIST_ID_LIMIT
+        if cmd.in_out_num < CACHE_LIST_ID_LIMIT:
+            break
+
+    return cache_ids[:count]
+
+
+def get_cache_info(dev, cache_id):
+    cmd = kcas_cache_info()
+    cmd.cache_id = cache_id
+    try:
+        dev.ioctl(KCAS_IOCTL_CACHE_INFO, cmd)
+    except IoctlError as e:
+        # Info about not fully initialized cache is still filled in
+        if e.errno != errno.EINVAL:
+            raise
+    return cmd
+
+
+def get_core_info(dev, cache_id, core_id):
+    cmd = kcas_core_info()
+    cmd.cache_id = cache_id
+    cmd.core_id = core_id
+    dev.ioctl(KCAS_IOCTL_CORE_INFO, cmd)
+    return cmd
+
+
+def get_core_pool_paths(dev):
+    count_cmd = kcas_core_pool_count()
+    dev.ioctl(KCAS_IOCTL_GET_CORE_POOL_COUNT, count_cmd)
+    if count_cmd.core_pool_count <= 0:
+        return []
+
+    buf = ctypes.create_string_buffer(count_cmd.core_pool_count * MAX_STR_LEN)
+    cmd = kcas_core_pool_path()
+    cmd.core_path_tab = ctypes.addressof(buf)
+    cmd.core_pool_count = count_cmd.core_pool_count
+    dev.ioctl(KCAS_IOCTL_GET_CORE_POOL_PATHS, cmd)
+
+    paths = []
+    for i in range(min(cmd.core_pool_count, count_cmd.core_pool_count)):
+        raw = buf.raw[i * MAX_STR_LEN:(i + 1) * MAX_STR_LEN]
+        paths += [_decode(raw.split(b'\0', 1)[0])]
+    return paths
+
+
+def list_caches(dev):
+    """
+    Equivalent of `casadm --list-caches --output-format csv` parsed with
+    csv.DictReader - list of dicts keyed by CSV header columns.
+    """
+    devices = []
+
+    core_pool = get_core_pool_paths(dev)
+    if core_pool:
+        devices += [_list_entry('core pool', '-', '-', '-')]
+        for path in core_pool:
+            devices += [_list_entry('core', '-', _dev_path(path), 'Detached')]
+
+    for cache_id in get_cache_ids(dev):
+        cache = get_cache_info(dev, cache_id)
+        info = cache.info
+
+        mode = cache_modes[info.cache_mode] \
+            if 0 <= info.cache_mode < len(cache_modes) else 'Unknown'
+        cache_flush_prog = _flush_progress(info.dirty, info.flushed)
+        if cache_flush_prog:
+            status = 'Flushing ({0:3.1f} %)'.format(cache_flush_prog)
+            mode = 'wb->{0}'.format(mode)
+        else:
+            status = _cache_state_name(info.state)
+
+        devices += [_list_entry('cache', str(cache_id),
+                                _dev_path(_decode(cache.cache_path_name)),
+                                status, mode)]
+
+        if not info.state & (1 << CACHE_STATE_RUNNING):
+            continue
+
+        for core_id in cache.core_id[:info.core_count]:
+            core = get_core_info(dev, cache_id, core_id)
+
+            core_flush_prog = _flush_progress(core.info.dirty, core.info.flushed)
+            if not core_flush_prog and cache_flush_prog:
+                core_flush_prog = 0 if core.info.dirty else 100
+
+            if core_flush_prog or cache_flush_prog:
+                status = 'Flushing ({0:3.1f} %)'.format(core_flush_prog)
+            elif 0 <= core.state < len(core_states):
+                status = core_states[core.state]
+            else:
+                status = 'Invalid'
+
+            devices += [_list_entry(
+                'core', str(core_id),
+                _dev_path(_decode(core.core_path_name)), status,
+                device='/dev/cas{0}-{1}'.format(cache_id, core_id))]
+
+    return devices
+
+
+def _list_entry(dev_type, dev_id, disk, status, mode='-', device='-'):
+    return {
+        'type': dev_type,
+        'id': dev_id,
+        'disk': disk,
+        'status': status,
+        'write policy': mode,
+        'device': device,
+    }
+
+
+def _cache_state_name(state):
+    # Combined states like "running&stopping" are described by the latter
+    for i in reversed(range(len(cache_states))):
+        if state & (1 << i):
+            return cache_states[i]
+    return NOT_RUNNING_STATE
+
+
+def check_cache_device(dev, path):
+    """
+    Equivalent of parsed `casadm --script --check-cache-device` output
+    """
+    cmd = kcas_cache_check_device()
+    cmd.path_name = path.encode()
+    dev.ioctl(KCAS_IOCTL_CACHE_CHECK_DEVICE, cmd)
+
+    if not cmd.is_cache_device:
+        return {'Is cache': 'no', 'Clean Shutdown': '-', 'Cache dirty': '-'}
+
+    return {
+        'Is cache': 'yes',
+        'Clean Shutdown': 'yes' if cmd.clean_shutdown else 'no',
+        'Cache dirty': 'yes' if cmd.cache_dirty else 'no',
+    }
+
+
+def get_stats(dev, cache_id, core_id=None, io_class_id=None):
+    """
+    Raw statistics counters of cache, core or io class as nested dicts
+    (groups: usage, req, blocks, errors), values in 4KiB blocks / requests.
+    """
+    cmd = kcas_get_stats()
+    cmd.cache_id = cache_id
+    cmd.core_id = OCF_CORE_ID_INVALID if core_id is None else core_id
+    cmd.part_id = OCF_IO_CLASS_INVALID if io_class_id is None else io_class_id
+    dev.ioctl(KCAS_IOCTL_GET_STATS, cmd)
+
+    return {
+        'usage': _struct_to_dict(cmd.usage),
+        'req': _struct_to_dict(cmd.req),
+        'blocks': _struct_to_dict(cmd.blocks),
+        'errors': _struct_to_dict(cmd.errors),
+    }
+
+
+def _seq_cutoff_threshold(value):
+    return value // KiB
+
+
+# Parameters reported by `casadm --get-param` per namespace:
+# (param id, parameter name, value names or transform function)
+cache_param_namespaces = {
+    'cleaning': [
+        (cache_param_cleaning_policy_type, 'Cleaning policy type',
+            cleaning_policies),
+    ],
+    'cleaning-alru': [
+        (cache_param_cleaning_alru_wake_up_time, 'Wake up time [s]', None),
+        (cache_param_cleaning_alru_stale_buffer_time, 'Stale buffer time [s]',
+            None),
+        (cache_param_cleaning_alru_flush_max_buffers, 'Flush max buffers',
+            None),
+        (cache_param_cleaning_alru_activity_threshold,
+            'Activity threshold [ms]', None),
+    ],
+    'cleaning-acp': [
+        (cache_param_cleaning_acp_wake_up_time, 'Wake up time [ms]', None),
+        (cache_param_cleaning_acp_flush_max_buffers, 'Flush max buffers',
+            None),
+    ],
+    'promotion': [
+        (cache_param_promotion_policy_type, 'Promotion policy type',
+            promotion_policies),
+    ],
+    'promotion-nhit': [
+        (cache_param_promotion_nhit_insertion_threshold,
+            'Insertion threshold', None),
+        (cache_param_promotion_nhit_trigger_threshold, 'Policy trigger [%]',
+            None),
+    ],
+}
+
+core_param_namespaces = {
+    'seq-cutoff': [
+        (core_param_seq_cutoff_threshold, 'Sequential cutoff threshold [KiB]',
+            _seq_cutoff_threshold),
+        (core_param_seq_cutoff_policy, 'Sequential cutoff policy',
+            seq_cutoff_policies),
+    ],
+}
+
+
+def _format_param(value, fmt):
+    if fmt is None:
+        return str(value)
+    if callable(fmt):
+        return str(fmt(value))
+    return fmt[value] if 0 <= value < len(fmt) else 'Unknown'
+
+
+def get_params(dev, namespace, cache_id, core_id=None):
+    """
+    Equivalent of parsed `casadm --get-param -o csv` output - dict mapping
+    parameter name to value string.
+    """
+    params = {}
+
+    if namespace in core_param_namespaces:
+        if core_id is None:
+            raise ValueError('Core id required for {0} namespace'.format(namespace))
+        for param_id, name, fmt in core_param_namespaces[namespace]:
+            cmd = kcas_get_core_param()
+            cmd.cache_id = cache_id
+            cmd.core_id = core_id
+            cmd.param_id = param_id
+            dev.ioctl(KCAS_IOCTL_GET_CORE_PARAM, cmd)
+            params[name] = _format_param(cmd.param_value, fmt)
+    elif namespace in cache_param_namespaces:
+        for param_id, name, fmt in cache_param_namespaces[namespace]:
+            cmd = kcas_get_cache_param()
+            cmd.cache_id = cache_id
+            cmd.param_id = param_id
+            dev.ioctl(KCAS_IOCTL_GET_CACHE_PARAM, cmd)
+            params[name] = _format_param(cmd.param_value, fmt)
+    else:
+        raise ValueError('Unknown parameter namespace {0}'.format(namespace))
+
+    return params
@@ -3,23 +3,40 @@
 # SPDX-License-Identifier: BSD-3-Clause-Clear
 #
 
-import subprocess
-import csv
-import re
+import functools
 import os
 import stat
 import time
 
+# Entry points using this module (casctl, open-cas-loader) are short lived
+# processes run on boot critical path, so modules needed only by some of
+# the commands are imported where they are used.
+
 # Casadm functionality
 
 
+def invalidates_device_state(func):
+    """Mark casadm command as changing runtime device state"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DeviceStateSnapshot.invalidate()
+
+    return wrapper
+
+
 class casadm:
     casadm_path = '/sbin/casadm'
 
     class result:
-        def __init__(self, cmd):
+        def __init__(self, cmd, input=None):
+            import subprocess
+
+            kwargs = {'input': input} if input is not None else {}
             p = subprocess.run(cmd, universal_newlines=True, stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
+                               stderr=subprocess.PIPE, **kwargs)
             self.exit_code = p.returncode
             self.stdout = p.stdout
             self.stderr = p.stderr
@@ -29,38 +46,126 @@ class casadm:
             super(casadm.CasadmError, self).__init__('casadm error')
             self.result = result
 
+    class batch_result:
+        def __init__(self, exit_code, stdout, stderr):
+            self.exit_code = exit_code
+            self.stdout = stdout
+            self.stderr = stderr
+
+    @staticmethod
+    def get_operation(cmd):
+        """Short description of casadm command used as timeline span name"""
+        # --script only switches casadm to hidden commands (e.g. --add-core)
+        args = [arg for arg in cmd[1:3] if arg != '--script']
+        name = ' '.join(['casadm'] + args[:1])
+        if '--load' in cmd:
+            name += ' --load'
+        return name
+
+    @staticmethod
+    def get_devices(cmd):
+        return [value for option, value in zip(cmd, cmd[1:])
+                if option in ('--cache-device', '--core-device')]
+
     @classmethod
     def run_cmd(cls, cmd):
-        result = cls.result(cmd)
-        if result.exit_code != 0:
-            raise cls.CasadmError(result)
+        with timeline.span(cls.get_operation(cmd), cmd=' '.join(cmd),
+                           devices=cls.get_devices(cmd)) as span:
+            result = cls.result(cmd)
+            span.fields['exit_code'] = result.exit_code
+            if result.exit_code != 0:
+                raise cls.CasadmError(result)
         return result
 
+    @staticmethod
+    def decode_batch_output(text):
+        """
+        Batch escapes every non-ASCII byte of output as \\u00XX - map them
+        back to bytes and decode as UTF-8, replacing invalid sequences.
+        """
+        try:
+            return text.encode('latin-1').decode('utf-8', 'replace')
+        except UnicodeEncodeError:
+            return text
+
     @classmethod
-    def get_version(cls):
+    @invalidates_device_state
+    def run_batch(cls, cmds):
+        """
+        Run commands (as built by *_cmd methods) in single casadm process.
+        Returns list of batch_result in order of commands - failure of single
+        command doesn't stop the following ones and isn't raised. CasadmError
+        is raised only if batch itself couldn't be run.
+        """
+        import json
+        import shlex
+
+        lines = []
+        for cmd in cmds:
+            if cmd and cmd[0] == cls.casadm_path:
+                cmd = cmd[1:]
+            lines.append(' '.join(shlex.quote(arg) for arg in cmd))
+
+        devices = [device for cmd in cmds for device in cls.get_devices(cmd)]
+        with timeline.span('casadm --batch', cmd=lines, devices=devices) as span:
+            result = cls.result([cls.casadm_path, '--batch'],
+                                input='\n'.join(lines) + '\n')
+            span.fields['exit_code'] = result.exit_code
+
+            try:
+                results = [json.loads(line) for line in result.stdout.splitlines()
+                           if line.strip()]
+                results = [cls.batch_result(r['exit_code'],
+                                            cls.decode_batch_output(r['stdout']),
+                                            cls.decode_batch_output(r['stderr']))
+                           for r in results]
+            except (ValueError, KeyError, TypeError):
+                raise cls.CasadmError(result)
+
+            if len(results) != len(cmds):
+                raise cls.CasadmError(result)
+
+            span.fields['exit_codes'] = [r.exit_code for r in results]
+
+        return results
+
+    @classmethod
+    def get_version_cmd(cls):
         cmd = [cls.casadm_path,
                 '--version',
                 '--output-format', 'csv']
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def list_caches(cls):
+    def get_version(cls):
+        return cls.run_cmd(cls.get_version_cmd())
+
+    @classmethod
+    def list_caches_cmd(cls):
         cmd = [cls.casadm_path,
                     '--list-caches',
                     '--output-format', 'csv']
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def check_cache_device(cls, device):
+    def list_caches(cls):
+        return cls.run_cmd(cls.list_caches_cmd())
+
+    @classmethod
+    def check_cache_device_cmd(cls, device):
         cmd = [cls.casadm_path,
                     '--script',
                     '--check-cache-device',
                     '--cache-device', device]
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def start_cache(cls, device, cache_id=None, cache_mode=None,
-                    cache_line_size=None, load=False, force=False):
+    def check_cache_device(cls, device):
+        return cls.run_cmd(cls.check_cache_device_cmd(device))
+
+    @classmethod
+    def start_cache_cmd(cls, device, cache_id=None, cache_mode=None,
+                        cache_line_size=None, load=False, force=False):
         cmd = [cls.casadm_path,
                     '--start-cache',
                     '--cache-device', device]
@@ -74,10 +179,17 @@ class casadm:
             cmd += ['--load']
         if force:
             cmd += ['--force']
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def add_core(cls, device, cache_id, core_id=None, try_add=False):
+    @invalidates_device_state
+    def start_cache(cls, device, cache_id=None, cache_mode=None,
+                    cache_line_size=None, load=False, force=False):
+        return cls.run_cmd(cls.start_cache_cmd(device, cache_id, cache_mode,
+                                               cache_line_size, load, force))
+
+    @classmethod
+    def add_core_cmd(cls, device, cache_id, core_id=None, try_add=False):
         cmd = [cls.casadm_path,
                     '--script',
                     '--add-core',
@@ -87,19 +199,29 @@ class casadm:
             cmd += ['--core-id', str(core_id)]
         if try_add:
             cmd += ['--try-add']
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def stop_cache(cls, cache_id, no_flush=False):
+    @invalidates_device_state
+    def add_core(cls, device, cache_id, core_id=None, try_add=False):
+        return cls.run_cmd(cls.add_core_cmd(device, cache_id, core_id, try_add))
+
+    @classmethod
+    def stop_cache_cmd(cls, cache_id, no_flush=False):
         cmd = [cls.casadm_path,
                     '--stop-cache',
                     '--cache-id', str(cache_id)]
         if no_flush:
             cmd += ['--no-data-flush']
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def remove_core(cls, cache_id, core_id, detach=False, force=False):
+    @invalidates_device_state
+    def stop_cache(cls, cache_id, no_flush=False):
+        return cls.run_cmd(cls.stop_cache_cmd(cache_id, no_flush))
+
+    @classmethod
+    def remove_core_cmd(cls, cache_id, core_id, detach=False, force=False):
         cmd = [cls.casadm_path,
                     '--script',
                     '--remove-core',
@@ -109,10 +231,15 @@ class casadm:
             cmd += ['--detach']
         if force:
             cmd += ['--no-flush']
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def set_param(cls, namespace, cache_id, **kwargs):
+    @invalidates_device_state
+    def remove_core(cls, cache_id, core_id, detach=False, force=False):
+        return cls.run_cmd(cls.remove_core_cmd(cache_id, core_id, detach, force))
+
+    @classmethod
+    def set_param_cmd(cls, namespace, cache_id, **kwargs):
         cmd = [cls.casadm_path,
                     '--set-param', '--name', namespace,
                     '--cache-id', str(cache_id)]
@@ -120,10 +247,15 @@ class casadm:
         for param, value in kwargs.items():
             cmd += ['--'+param.replace('_', '-'), str(value)]
 
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def get_params(cls, namespace, cache_id, **kwargs):
+    @invalidates_device_state
+    def set_param(cls, namespace, cache_id, **kwargs):
+        return cls.run_cmd(cls.set_param_cmd(namespace, cache_id, **kwargs))
+
+    @classmethod
+    def get_params_cmd(cls, namespace, cache_id, **kwargs):
         cmd = [cls.casadm_path,
                     '--get-param', '--name', namespace,
                     '--cache-id', str(cache_id)]
@@ -133,30 +265,279 @@ class casadm:
 
         cmd += ['-o', 'csv']
 
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def flush_parameters(cls, cache_id, policy_type):
+    def get_params(cls, namespace, cache_id, **kwargs):
+        return cls.run_cmd(cls.get_params_cmd(namespace, cache_id, **kwargs))
+
+    @classmethod
+    def flush_parameters_cmd(cls, cache_id, policy_type):
         cmd = [cls.casadm_path,
                     '--flush-parameters',
                     '--cache-id', str(cache_id),
                     '--cleaning-policy-type', policy_type]
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def io_class_load_config(cls, cache_id, ioclass_file):
+    @invalidates_device_state
+    def flush_parameters(cls, cache_id, policy_type):
+        return cls.run_cmd(cls.flush_parameters_cmd(cache_id, policy_type))
+
+    @classmethod
+    def io_class_load_config_cmd(cls, cache_id, ioclass_file):
         cmd = [cls.casadm_path,
                     '--io-class',
                     '--load-config',
                     '--cache-id', str(cache_id),
                     '--file', ioclass_file]
-        return cls.run_cmd(cmd)
+        return cmd
 
     @classmethod
-    def start_upgrade(cls):
+    @invalidates_device_state
+    def io_class_load_config(cls, cache_id, ioclass_file):
+        return cls.run_cmd(cls.io_class_load_config_cmd(cache_id, ioclass_file))
+
+    @classmethod
+    def io_class_list_cmd(cls, cache_id):
+        cmd = [cls.casadm_path,
+                    '--io-class',
+                    '--list',
+                    '--cache-id', str(cache_id),
+                    '--output-format', 'csv']
+        return cmd
+
+    @classmethod
+    def io_class_list(cls, cache_id):
+        return cls.run_cmd(cls.io_class_list_cmd(cache_id))
+
+    @classmethod
+    def set_cache_mode_cmd(cls, cache_id, cache_mode, flush=None):
+        cmd = [cls.casadm_path,
+                    '--set-cache-mode',
+                    '--cache-mode', cache_mode,
+                    '--cache-id', str(cache_id)]
+        if flush is not None:
+            cmd += ['--flush-cache', 'yes' if flush else 'no']
+        return cmd
+
+    @classmethod
+    @invalidates_device_state
+    def set_cache_mode(cls, cache_id, cache_mode, flush=None):
+        return cls.run_cmd(cls.set_cache_mode_cmd(cache_id, cache_mode, flush))
+
+    @classmethod
+    def start_upgrade_cmd(cls):
         cmd = [cls.casadm_path, '--script', '--upgrade-in-flight']
 
-        return cls.run_cmd(cmd)
+        return cmd
+
+    @classmethod
+    @invalidates_device_state
+    def start_upgrade(cls):
+        return cls.run_cmd(cls.start_upgrade_cmd())
+
+# Native control device access - casadm equivalents without fork/exec
+
+
+class ctrl_ioctl:
+    device_path = '/dev/cas_ctrl'
+    enabled = True
+
+    @classmethod
+    def open(cls):
+        import cas_ioctl
+
+        return cas_ioctl.ctrl_device(cls.device_path)
+
+    @classmethod
+    def query(cls, func, *args, **kwargs):
+        """
+        Run cas_ioctl query on control device. Returns None if it can't be
+        done natively, so that caller can fall back to casadm.
+        """
+        if not cls.enabled:
+            return None
+
+        try:
+            with cls.open() as dev:
+                return func(dev, *args, **kwargs)
+        except (OSError, ValueError):
+            return None
+
+# Block device event notifications
+
+
+class udev_monitor:
+    """
+    Listener of block device uevents. By default subscribes to netlink
+    messages broadcast by udev after rules for device have been processed
+    (so that RUN+= actions like open-cas-loader are already finished). Any
+    datagram socket carrying kernel or libudev formatted uevents may be used
+    instead (e.g. socketpair in tests).
+    """
+    NETLINK_KOBJECT_UEVENT = 15
+    GROUP_UDEV = 2
+    LIBUDEV_PREFIX = b'libudev\0'
+    # Only magic is in network byte order, header_size, properties_off and
+    # properties_len which follow it are in host byte order
+    LIBUDEV_MAGIC = '!8sI'
+    LIBUDEV_HEADER = '=III'
+    enabled = True
+
+    def __init__(self, sock, devices=()):
+        self.sock = sock
+        self.paths = set(devices)
+        self.names = set(os.path.basename(os.path.realpath(device))
+                         for device in devices)
+
+    @classmethod
+    def open(cls, devices=()):
+        """
+        Subscribe to udev netlink events. Returns None if it's not possible,
+        so that caller can fall back to polling.
+        """
+        if not cls.enabled:
+            return None
+
+        import socket
+
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                 cls.NETLINK_KOBJECT_UEVENT)
+        except (OSError, AttributeError):
+            return None
+
+        try:
+            sock.bind((0, cls.GROUP_UDEV))
+        except OSError:
+            sock.close()
+            return None
+
+        return cls(sock, devices)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def parse(cls, data):
+        """Uevent properties as dict (both kernel and libudev format)"""
+        if data.startswith(cls.LIBUDEV_PREFIX):
+            import struct
+
+            _, offset, length = struct.unpack_from(
+                cls.LIBUDEV_HEADER, data, struct.calcsize(cls.LIBUDEV_MAGIC))
+            data = data[offset:offset + length]
+        else:
+            # Kernel format - first field is ACTION@DEVPATH summary
+            data = data.partition(b'\0')[2]
+
+        properties = dict()
+        for field in data.split(b'\0'):
+            key, sep, value = field.decode('utf-8', 'replace').partition('=')
+            if sep:
+                properties[key] = value
+
+        return properties
+
+    def is_relevant(self, properties):
+        """
+        Check if event may change state of configured devices - it concerns
+        one of them or exported CAS device.
+        """
+        import re
+
+        if properties.get('SUBSYSTEM') != 'block':
+            return False
+
+        name = os.path.basename(properties.get('DEVNAME', ''))
+        if name in self.names or re.fullmatch(r'cas\d+-\d+', name):
+            return True
+
+        return any(link in self.paths
+                   for link in properties.get('DEVLINKS', '').split())
+
+    @staticmethod
+    def format_event(properties):
+        """Kernel formatted uevent with given properties"""
+        summary = '{0}@{1}'.format(properties.get('ACTION', 'change'),
+                                   properties.get('DEVPATH', properties.get('DEVNAME', '')))
+        fields = [summary] + ['{0}={1}'.format(key, value)
+                              for key, value in properties.items()]
+        return ('\0'.join(fields) + '\0').encode('utf-8')
+
+    def receive(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever if None) for events. Returns
+        properties of received event together with all events already queued
+        behind it, so that burst of events is handled at once.
+        """
+        import select
+
+        events = []
+        stop_time = None if timeout is None else time.time() + timeout
+
+        while True:
+            if events:
+                remaining = 0
+            elif stop_time is not None:
+                remaining = max(stop_time - time.time(), 0)
+            else:
+                remaining = None
+            ready, _, _ = select.select([self.sock], [], [], remaining)
+            if not ready:
+                return events
+
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return events
+
+            events.append(self.parse(data))
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for relevant event. Returns True if
+        relevant event was received.
+        """
+        stop_time = time.time() + timeout
+
+        while True:
+            events = self.receive(max(stop_time - time.time(), 0))
+            if not events:
+                return False
+
+            if any(self.is_relevant(event) for event in events):
+                return True
+
+    async def wait_async(self, timeout):
+        """Coroutine version of wait() for use in asyncio event loop"""
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        stop_time = loop.time() + timeout
+        readable = asyncio.Event()
+        loop.add_reader(self.sock, readable.set)
+
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(readable.wait(),
+                                           max(stop_time - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    return False
+
+                readable.clear()
+                if any(self.is_relevant(event) for event in self.receive(0)):
+                    return True
+        finally:
+            loop.remove_reader(self.sock)
 
 # Configuration file parser
 
@@ -170,14 +551,58 @@ class cas_config(object):
     class AlreadyConfiguredException(ValueError):
         pass
 
+    class RecursiveCoreConfigException(ValueError):
+        def __init__(self, core):
+            super(cas_config.RecursiveCoreConfigException, self).__init__(
+                'Recursive core configuration!')
+            self.core = core
+
+    cas_device_pattern = r'/dev/cas(\d{1,5})-(\d{1,4})'
+
     @staticmethod
     def get_by_id_path(path):
-        for id_path in os.listdir('/dev/disk/by-id'):
-            full_path = '/dev/disk/by-id/{0}'.format(id_path)
-            if os.path.realpath(full_path) == os.path.realpath(path):
-                return full_path
+        device = os.path.realpath(path)
+        by_id_path = cas_config.get_by_id_index().get(device)
+        # Link may have been retargeted without directory mtime change
+        if by_id_path is not None and os.path.realpath(by_id_path) != device:
+            by_id_path = cas_config.get_by_id_index(rebuild=True).get(device)
+        if by_id_path is None:
+            raise ValueError('By-id device link not found for {0}'.format(path))
+
+        return by_id_path
+
+    by_id_dir = '/dev/disk/by-id'
+    _by_id_index = dict()
+    _by_id_index_key = None
+
+    @staticmethod
+    def get_by_id_index(rebuild=False):
+        """
+        Map of resolved device path to its /dev/disk/by-id link. Built with
+        single directory scan and reused until directory is modified (or
+        rebuild is requested). If multiple links point to the same device,
+        lexicographically first one is chosen.
+        """
+        try:
+            mtime = os.stat(cas_config.by_id_dir).st_mtime_ns
+        except OSError:
+            return dict()
+
+        key = (cas_config.by_id_dir, mtime)
+        if not rebuild and key == cas_config._by_id_index_key:
+            return cas_config._by_id_index
+
+        index = dict()
+        with os.scandir(cas_config.by_id_dir) as entries:
+            for entry in entries:
+                device = os.path.realpath(entry.path)
+                if device not in index or entry.path < index[device]:
+                    index[device] = entry.path
+
+        cas_config._by_id_index = index
+        cas_config._by_id_index_key = key
 
-        raise ValueError('By-id device link not found for {0}'.format(path))
+        return index
 
     @staticmethod
     def check_block_device(path):
@@ -256,15 +681,20 @@ class cas_config(object):
                 raise ValueError('{0} is invalid cache id'.format(cache_id))
 
         def check_cache_device_empty(self):
-            try:
-                result = casadm.run_cmd(['lsblk', '-o', 'NAME',  '-l', '-n', self.device])
-            except:
-                # lsblk returns non-0 if it can't probe for partitions
-                # this means that we're probably dealing with atomic device
-                # let it through
-                return
-
-            if len(list(filter(lambda a: a != '', result.stdout.split('\n')))) > 1:
+            children = get_block_device_children(self.device)
+            if children is None:
+                # Device not found in sysfs - fall back to lsblk
+                try:
+                    result = casadm.run_cmd(['lsblk', '-o', 'NAME',  '-l', '-n', self.device])
+                except:
+                    # lsblk returns non-0 if it can't probe for partitions
+                    # this means that we're probably dealing with atomic device
+                    # let it through
+                    return
+
+                children = list(filter(lambda a: a != '', result.stdout.split('\n')))[1:]
+
+            if children:
                 raise ValueError(
                         'Partitions found on device {0}. Use force option to ignore'.
                         format(self.device))
@@ -402,20 +832,70 @@ class cas_config(object):
 
         self.version_tag = version_tag
 
+        # Conflict detection indexes keyed by resolved device path, so that
+        # inserting device doesn't need to resolve paths of all others
+        self._realpaths = dict()
+        self._cache_by_device = dict()
+        self._core_by_device = dict()
+        self._core_by_id = dict()
+
+        for cache in self.caches.values():
+            self._cache_by_device.setdefault(self.realpath(cache.device), cache)
+            for core in cache.cores.values():
+                self._index_core(core)
+
+    def realpath(self, path):
+        """os.path.realpath memoized for lifetime of config"""
+        try:
+            return self._realpaths[path]
+        except KeyError:
+            resolved = self._realpaths[path] = os.path.realpath(path)
+            return resolved
+
+    def _index_core(self, core):
+        self._core_by_device.setdefault(self.realpath(core.device), core)
+        self._core_by_id[(core.cache_id, core.core_id)] = core
+
+    @classmethod
+    def from_file(cls, config_file, allow_incomplete=False, jobs=None):
+        config, errors = cls.parse_file(config_file, allow_incomplete, jobs)
+        if errors:
+            raise errors[0][1]
+
+        return config
+
+    @classmethod
+    def validate_file(cls, config_file, allow_incomplete=False, jobs=None):
+        """
+        Validate whole config file. Returns list of (line number, exception)
+        for all invalid lines, empty if config is valid.
+        """
+        return cls.parse_file(config_file, allow_incomplete, jobs)[1]
+
     @classmethod
-    def from_file(cls, config_file, allow_incomplete=False):
+    def parse_file(cls, config_file, allow_incomplete=False, jobs=None):
+        """
+        Parse config file without stopping at first invalid line. All lines
+        are parsed and checked for consistency one after another first, then
+        checks of devices (block device presence, partitions on cache
+        devices) of all parsed entries run concurrently, at most jobs at a
+        time. Returns config and list of (line number, exception) sorted by
+        line number.
+        """
         section_caches = False
         section_cores = False
+        entries = []
+        errors = []
 
         try:
             with open(config_file, 'r') as conf:
                 version_tag = conf.readline()
-                if not re.findall(r'^version=.*$', version_tag):
+                if not version_tag.startswith('version='):
                     raise ValueError('No version tag found!')
 
                 config = cls(version_tag=version_tag)
 
-                for line in conf:
+                for number, line in enumerate(conf, 2):
                     line = line.split('#')[0].rstrip()
                     if not line:
                         continue
@@ -429,85 +909,100 @@ class cas_config(object):
                         section_cores = True
                         continue
 
-                    if section_caches:
-                        cache = cas_config.cache_config.from_line(line, allow_incomplete)
-                        config.insert_cache(cache)
-                    elif section_cores:
-                        core = cas_config.core_config.from_line(line, allow_incomplete)
-                        config.insert_core(core)
+                    try:
+                        if section_caches:
+                            entry = cas_config.cache_config.from_line(line, True)
+                            config.insert_cache(entry)
+                        elif section_cores:
+                            entry = cas_config.core_config.from_line(line, True)
+                            config.insert_core(entry)
+                        else:
+                            continue
+                    except (ValueError, KeyError) as e:
+                        errors.append((number, e))
+                        continue
+
+                    entries.append((number, entry))
         except ValueError:
             raise
         except IOError:
             raise Exception('Couldn\'t open config file')
-        except:
-            raise
 
-        return config
+        if not allow_incomplete:
+            def validate_devices(item):
+                entry = item[1]
+                if isinstance(entry, cas_config.cache_config):
+                    entry.validate_config(False)
+                else:
+                    entry.validate_config()
+
+            for task in run_parallel(validate_devices, entries, jobs):
+                if task.error:
+                    errors.append((task.item[0], task.error))
+
+        errors.sort(key=lambda error: error[0])
+        return config, errors
 
     def insert_cache(self, new_cache_config):
+        device = self.realpath(new_cache_config.device)
+
         if new_cache_config.cache_id in self.caches:
-            if (os.path.realpath(self.caches[new_cache_config.cache_id].device)
-                    != os.path.realpath(new_cache_config.device)):
+            if (self.realpath(self.caches[new_cache_config.cache_id].device)
+                    != device):
                 raise cas_config.ConflictingConfigException(
                         'Other cache device configured under this id')
             else:
                 raise cas_config.AlreadyConfiguredException(
                                 'Cache already configured')
 
-        for cache_id, cache in self.caches.items():
-            if cache_id != new_cache_config.cache_id:
-                if (os.path.realpath(new_cache_config.device)
-                        == os.path.realpath(cache.device)):
-                    raise cas_config.ConflictingConfigException(
-                            'This cache device is already configured as a cache')
+        if device in self._cache_by_device:
+            raise cas_config.ConflictingConfigException(
+                    'This cache device is already configured as a cache')
 
-            for _, core in cache.cores.items():
-                if (os.path.realpath(core.device)
-                        == os.path.realpath(new_cache_config.device)):
-                    raise cas_config.ConflictingConfigException(
-                            'This cache device is already configured as a core')
+        if device in self._core_by_device:
+            raise cas_config.ConflictingConfigException(
+                    'This cache device is already configured as a core')
 
         try:
             new_cache_config.device = cas_config.get_by_id_path(new_cache_config.device)
         except:
             pass
 
+        self._realpaths.setdefault(new_cache_config.device, device)
+        self._cache_by_device[device] = new_cache_config
         self.caches[new_cache_config.cache_id] = new_cache_config
 
     def insert_core(self, new_core_config):
         if new_core_config.cache_id not in self.caches:
             raise KeyError('Cache id {0} doesn\'t exist'.format(new_core_config.cache_id))
 
-        try:
-            for cache_id, cache in self.caches.items():
-                if (os.path.realpath(cache.device)
-                        == os.path.realpath(new_core_config.device)):
-                    raise cas_config.ConflictingConfigException(
-                            'Core device already configured as a cache')
-
-                for core_id, core in cache.cores.items():
-                    if (cache_id == new_core_config.cache_id
-                            and core_id == new_core_config.core_id):
-                        if (os.path.realpath(core.device)
-                                == os.path.realpath(new_core_config.device)):
-                            raise cas_config.AlreadyConfiguredException(
-                                    'Core already configured')
-                        else:
-                            raise cas_config.ConflictingConfigException(
-                                    'Other core device configured under this id')
-                    else:
-                        if (os.path.realpath(core.device)
-                                == os.path.realpath(new_core_config.device)):
-                            raise cas_config.ConflictingConfigException(
-                                    'This core device is already configured as a core')
-        except KeyError:
-            pass
+        device = self.realpath(new_core_config.device)
+
+        if device in self._cache_by_device:
+            raise cas_config.ConflictingConfigException(
+                    'Core device already configured as a cache')
+
+        core = self._core_by_id.get(
+                (new_core_config.cache_id, new_core_config.core_id))
+        if core:
+            if self.realpath(core.device) == device:
+                raise cas_config.AlreadyConfiguredException(
+                        'Core already configured')
+            else:
+                raise cas_config.ConflictingConfigException(
+                        'Other core device configured under this id')
+
+        if device in self._core_by_device:
+            raise cas_config.ConflictingConfigException(
+                    'This core device is already configured as a core')
 
         try:
             new_core_config.device = cas_config.get_by_id_path(new_core_config.device)
         except:
             pass
 
+        self._realpaths.setdefault(new_core_config.device, device)
+        self._index_core(new_core_config)
         self.caches[new_core_config.cache_id].cores[new_core_config.core_id] = new_core_config
         self.cores += [new_core_config]
 
@@ -517,23 +1012,74 @@ class cas_config(object):
 
         return True
 
-    def write(self, config_file):
-        try:
-            with open(config_file, 'w') as conf:
-                conf.write('{0}\n'.format(self.version_tag))
-                conf.write('# This config was automatically generated\n')
-
-                conf.write('[caches]\n')
-                for _, cache in self.caches.items():
-                    conf.write(cache.to_line())
+    def to_text(self):
+        # Version tag read from file keeps its newline
+        lines = ['{0}\n'.format(self.version_tag.rstrip('\n')),
+                 '# This config was automatically generated\n',
+                 '[caches]\n']
+        lines += [cache.to_line() for cache in self.caches.values()]
+        lines.append('\n[cores]\n')
+        lines += [core.to_line() for core in self.cores]
 
-                conf.write('\n[cores]\n')
-                for core in self.cores:
-                    conf.write(core.to_line())
+        return ''.join(lines)
 
+    def write(self, config_file):
+        """
+        Replace config file with this configuration. New content is synced
+        to disk before it's renamed over the old one, so that crash leaves
+        either previous or new config, never truncated one.
+        """
+        try:
+            write_file_atomic(config_file, self.to_text())
         except:
             raise Exception('Couldn\'t write config file')
 
+        compiled_config.invalidate(config_file)
+
+    def get_core_levels(self):
+        """
+        Split cores into dependency levels. Cores of each level use as
+        backend only exported devices (/dev/casX-Y) of cores from previous
+        levels, so cores within one level may be added independently.
+        """
+        import re
+
+        depends_on = dict()
+        users = dict()
+        for core in self.cores:
+            depends_on[core] = 0
+            users[core] = []
+
+        for core in self.cores:
+            match = re.match(cas_config.cas_device_pattern, core.device)
+            if not match:
+                continue
+            cache_id, core_id = match.groups()
+            try:
+                lower_core = self.caches[int(cache_id)].cores[int(core_id)]
+            except KeyError:
+                continue
+            depends_on[core] += 1
+            users[lower_core].append(core)
+
+        levels = []
+        level = [core for core in self.cores if depends_on[core] == 0]
+        while level:
+            levels.append(level)
+            next_level = []
+            for core in level:
+                for user in users[core]:
+                    depends_on[user] -= 1
+                    if depends_on[user] == 0:
+                        next_level.append(user)
+            level = next_level
+
+        for core in self.cores:
+            if depends_on[core] > 0:
+                raise cas_config.RecursiveCoreConfigException(core)
+
+        return levels
+
     def get_startup_cores(self):
         return [
             core
@@ -544,193 +1090,1234 @@ class cas_config(object):
 # Config helper functions
 
 
-def start_cache(cache, load, force=False):
-    casadm.start_cache(
-            device=cache.device,
-            cache_id=cache.cache_id,
-            cache_mode=cache.cache_mode,
-            cache_line_size=cache.params.get('cache_line_size'),
-            load=load,
-            force=force)
+def write_file_atomic(path, data, mode=None):
+    """
+    Write data to temporary file in directory of path, sync it and rename it
+    over path. Mode defaults to mode of replaced file (0644 for new one).
+    """
+    import tempfile
 
-def configure_cache(cache):
-    if "cleaning_policy" in cache.params:
-        casadm.set_param(
-            "cleaning", cache_id=cache.cache_id, policy=cache.params["cleaning_policy"]
-        )
-    if "promotion_policy" in cache.params:
-        casadm.set_param(
-            "promotion", cache_id=cache.cache_id, policy=cache.params["promotion_policy"]
-        )
-    if "ioclass_file" in cache.params:
-        casadm.io_class_load_config(
-            cache_id=cache.cache_id, ioclass_file=cache.params["ioclass_file"]
-        )
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
 
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
 
-def add_core(core, attach):
-    casadm.add_core(
-            device=core.device,
-            cache_id=core.cache_id,
-            core_id=core.core_id,
-            try_add=attach)
+    # Make rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+# Compiled configuration used to match hotplugged devices
+
+
+class compiled_config(object):
+    """
+    Device -> action index of opencas.conf, serialized under /run and valid
+    as long as config file mtime and size are unchanged (or, if only mtime
+    has changed, its hash). Lets open-cas-loader find device to start or add
+    without parsing and validating whole configuration on each block device
+    event.
+    """
+    format_version = 1
+    cache_dir = '/run/opencas'
+    suffix = '.compiled'
+
+    def __init__(self, key, entries):
+        self.key = key
+        # config device path -> {'type', 'line', 'realpath'}
+        self.entries = entries
+        self.by_realpath = dict()
+        for path, entry in entries.items():
+            self.by_realpath.setdefault(entry['realpath'], path)
 
-# Another helper functions
+    @staticmethod
+    def get_key(config_file):
+        import hashlib
 
-def is_cache_started(cache_config):
-    dev_list = get_caches_list()
-    for dev in dev_list:
-        if dev['type'] == 'cache' and int(dev['id']) == cache_config.cache_id:
-            return True
+        with open(config_file, 'rb') as conf:
+            st = os.fstat(conf.fileno())
+            digest = hashlib.sha256(conf.read()).hexdigest()
 
-    return False
+        return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'sha256': digest}
 
-def is_core_added(core_config):
-    dev_list = get_caches_list()
-    cache_id = 0
-    for dev in dev_list:
-        if dev['type'] == 'cache':
-            cache_id = int(dev['id'])
-
-        if (dev['type'] == 'core' and
-                cache_id == core_config.cache_id and
-                int(dev['id']) == core_config.core_id):
-            return True
+    @staticmethod
+    def get_stat_key(config_file):
+        """Part of config file key which doesn't require reading the file"""
+        st = os.stat(config_file)
 
-    return False
+        return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
 
-def get_caches_list():
-    result = casadm.list_caches()
-    return list(csv.DictReader(result.stdout.split('\n')))
+    @classmethod
+    def get_path(cls, config_file):
+        """Compiled config location, e.g. /run/opencas/etc-opencas-opencas.conf.compiled"""
+        name = os.path.abspath(config_file).strip('/').replace('/', '-')
 
-def check_cache_device(device):
-    result = casadm.check_cache_device(device)
-    return list(csv.DictReader(result.stdout.split('\n')))[0]
+        return os.path.join(cls.cache_dir, name + cls.suffix)
 
-def get_cas_version():
-    version = casadm.get_version()
+    @classmethod
+    def compile(cls, config_file, key=None):
+        if key is None:
+            key = cls.get_key(config_file)
+        config = cas_config.from_file(config_file, allow_incomplete=True)
 
-    ret = {}
-    for line in version.stdout.split('\n')[1:]:
-        try:
-            component, version = line.split(',')
-        except:
-            continue
-        ret[component] = version
+        entries = dict()
+        for cache in config.caches.values():
+            entries[cache.device] = {'type': 'cache', 'line': cache.to_line(),
+                                     'realpath': config.realpath(cache.device)}
+            for core in cache.cores.values():
+                entries[core.device] = {'type': 'core', 'line': core.to_line(),
+                                        'realpath': config.realpath(core.device)}
 
-    return ret
+        return cls(key, entries)
 
+    @classmethod
+    def from_file(cls, path, key):
+        """
+        Compiled config stored in path, None if missing, invalid or stale.
+        Only fields present in key are compared with stored key.
+        """
+        import json
 
-class CompoundException(Exception):
-    def __init__(self):
-        super(CompoundException, self).__init__()
-        self.exception_list = list()
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
 
-    def __str__(self):
-        s = "Multiple exceptions occured:\n" if len(self.exception_list) > 1 else ""
+        if (not isinstance(data, dict)
+                or data.get('version') != cls.format_version
+                or not isinstance(data.get('key'), dict)
+                or any(data['key'].get(field) != value for field, value in key.items())):
+            return None
 
-        for e in self.exception_list:
-            s += '{0}\n'.format(str(e))
+        return cls(data['key'], data['entries'])
 
-        return s
+    def write(self, path):
+        """Atomically store compiled config, so that readers never see partial file"""
+        import json
 
-    def add_exception(self, e):
-        if type(e) is CompoundException:
-            self.exception_list += e.exception_list
-        else:
-            self.exception_list += [e]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file_atomic(path, json.dumps({'version': self.format_version, 'key': self.key,
+                                            'entries': self.entries}))
 
-    def is_empty(self):
-        return len(self.exception_list) == 0
+    @classmethod
+    def invalidate(cls, config_file):
+        """
+        Remove compiled config of rewritten config file, so that it's rebuilt
+        on next use instead of being kept for config it doesn't describe.
+        """
+        try:
+            os.unlink(cls.get_path(config_file))
+        except OSError:
+            pass
 
-    def raise_nonempty(self):
-        if self.is_empty():
-            return
+    @classmethod
+    def load(cls, config_file=None):
+        """
+        Compiled form of config file - stored one if fresh, otherwise compiled
+        from scratch and stored for next use (if cache directory is writable).
+        Config file is read and hashed only if its mtime or size has changed.
+        """
+        if config_file is None:
+            config_file = cas_config.default_location
+        path = cls.get_path(config_file)
+
+        compiled = cls.from_file(path, cls.get_stat_key(config_file))
+        if compiled is not None:
+            return compiled
+
+        key = cls.get_key(config_file)
+        compiled = cls.from_file(path, {'sha256': key['sha256']})
+        if compiled is not None:
+            # Config was only touched - refresh stored key
+            compiled.key = key
         else:
-            raise self
+            compiled = cls.compile(config_file, key)
 
-def detach_core_recursive(cache_id, core_id, flush):
-    # Catching exceptions is left to uppermost caller of detach_core_recursive
-    # as the immediate caller that made a recursive call depends on the callee
-    # to remove core and thus release reference to lower level cache volume.
-    l_cache_id = ''
-    for dev in get_caches_list():
-        if dev['type'] == 'cache':
-            l_cache_id = dev['id']
-        elif dev['type'] == 'core' and dev['status'] == 'Active':
-            if '/dev/cas{0}-{1}'.format(cache_id, core_id) in dev['disk']:
-                detach_core_recursive(l_cache_id, dev['id'], flush)
-        elif l_cache_id == cache_id and dev['id'] == core_id and dev['status'] != 'Active':
+        try:
+            compiled.write(path)
+        except OSError:
+            pass
+
+        return compiled
+
+    def find(self, device, devlinks=None):
+        """
+        Cache or core config of given block device (None if not configured).
+        devlinks are symlinks of the device as reported by udev - if given,
+        configured paths are matched against them, otherwise against
+        resolved paths of all configured devices.
+        """
+        device = os.path.realpath(device)
+
+        if devlinks is not None:
+            candidates = [self.by_realpath.get(device)] + list(devlinks)
+        else:
+            candidates = self.entries
+
+        for path in candidates:
+            entry = self.entries.get(path)
+            if entry and os.path.realpath(path) == device:
+                config_type = (cas_config.cache_config if entry['type'] == 'cache'
+                               else cas_config.core_config)
+                return config_type.from_line(entry['line'], allow_incomplete=True)
+
+        return None
+
+
+# Device hotplug loader daemon
+
+
+loader_socket_path = '/run/opencas/loader.sock'
+
+def notify_loader_daemon(device, devlinks=None, path=None):
+    """
+    Hand block device event over to running loader daemon. Returns False if
+    there is no daemon listening, so that caller can handle device itself.
+    """
+    import socket
+
+    properties = {'ACTION': 'add', 'SUBSYSTEM': 'block', 'DEVNAME': device}
+    if devlinks is not None:
+        properties['DEVLINKS'] = devlinks
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(udev_monitor.format_event(properties), path or loader_socket_path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+    return True
+
+
+class loader_daemon(object):
+    """
+    Long running replacement of per event open-cas-loader. Block device
+    events are collected until there is coalesce_time long break (but no
+    longer than max_delay), then caches configured on received devices are
+    loaded and afterwards cores are added, each at most jobs at a time.
+    """
+    coalesce_time = 0.1
+    max_delay = 1
+
+    def __init__(self, sock, config_file=None, jobs=None, log=None):
+        self.monitor = udev_monitor(sock)
+        self.config_file = config_file or cas_config.default_location
+        self.jobs = jobs
+        self.log = log if log else (lambda priority, message: None)
+
+    @classmethod
+    def listen(cls, path=None, **kwargs):
+        """Create daemon receiving events sent by notify_loader_daemon()"""
+        import socket
+
+        path = path or loader_socket_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Socket is created with restrictive permissions right away, there
+        # is no window in which others could connect to it
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        except:
+            sock.close()
+            raise
+        finally:
+            os.umask(old_umask)
+
+        return cls(sock, **kwargs)
+
+    def close(self):
+        self.monitor.close()
+
+    def receive_batch(self, timeout=None):
+        """
+        List of (device, devlinks) of block devices from next burst of events.
+        Empty if no event arrived within timeout.
+        """
+        import collections
+
+        devices = collections.OrderedDict()
+        events = self.monitor.receive(timeout)
+        stop_time = time.time() + self.max_delay
+
+        while events:
+            for event in events:
+                device = event.get('DEVNAME')
+                if (not device or event.get('SUBSYSTEM') != 'block'
+                        or event.get('ACTION') == 'remove'):
+                    continue
+                if not device.startswith('/'):
+                    device = os.path.join('/dev', device)
+                devlinks = event.get('DEVLINKS')
+                devices[device] = devlinks.split() if devlinks is not None else None
+
+            remaining = stop_time - time.time()
+            if remaining <= 0:
+                break
+            events = self.monitor.receive(min(self.coalesce_time, remaining))
+
+        return list(devices.items())
+
+    @staticmethod
+    def get_reason(error):
+        if isinstance(error, casadm.CasadmError):
+            return error.result.stderr
+        return str(error)
+
+    def process(self, batch):
+        """Load caches and add cores configured on devices from batch"""
+        import syslog
+
+        with timeline.span('load compiled config'):
+            config = compiled_config.load(self.config_file)
+
+        caches = []
+        cores = []
+        for device, devlinks in batch:
+            device_config = config.find(device, devlinks)
+            if isinstance(device_config, cas_config.cache_config):
+                caches.append(device_config)
+            elif isinstance(device_config, cas_config.core_config):
+                cores.append(device_config)
+
+        if not caches and not cores:
             return
 
-    casadm.remove_core(cache_id, core_id, detach = True, force = not flush)
+        wait_for_cas_ctrl()
+
+        for task in run_parallel(lambda cache: start_cache(cache, True),
+                                 caches, self.jobs):
+            if task.error:
+                self.log(syslog.LOG_WARNING,
+                         'Unable to load cache {0} ({1}). Reason: {2}'.format(
+                             task.item.cache_id, task.item.device,
+                             self.get_reason(task.error)))
+
+        for task in run_parallel(lambda core: add_core(core, True),
+                                 cores, self.jobs):
+            if task.error:
+                self.log(syslog.LOG_WARNING,
+                         'Unable to attach core {0} from cache {1}. Reason: {2}'.format(
+                             task.item.device, task.item.cache_id,
+                             self.get_reason(task.error)))
+
+    def serve_forever(self):
+        import syslog
+
+        while True:
+            batch = self.receive_batch()
+            try:
+                with timeline.operation('handle devices',
+                                        devices=[device for device, _ in batch]):
+                    self.process(batch)
+            except Exception as e:
+                self.log(syslog.LOG_ERR,
+                         'Unable to handle devices {0}. Reason: {1}'.format(
+                             ', '.join(device for device, _ in batch), str(e)))
+
+
+# Udev rules limiting open-cas-loader to configured devices
+
+
+# Generated rules must sort after 60-persistent-storage.rules, which creates
+# /dev/disk/by-id links matched by them
+udev_rules_path = '/etc/udev/rules.d/69-persistent-storage-cas-load.rules'
+# Overrides shipped rule running loader for every block device
+udev_override_path = '/etc/udev/rules.d/60-persistent-storage-cas-load.rules'
+udev_loader_path = '/lib/opencas/open-cas-loader'
+
+def get_udev_match(device):
+    """
+    Udev match key of configured device path - symlink for persistent names
+    (e.g. /dev/disk/by-id/wwn-*), kernel name for plain /dev nodes.
+    """
+    name = os.path.relpath(os.path.normpath(device), '/dev')
+    if name.startswith('..'):
+        raise ValueError('Device {0} is not in /dev'.format(device))
+
+    if '/' in name:
+        return 'SYMLINK=="{0}"'.format(name)
+
+    return 'KERNEL=="{0}"'.format(name)
+
+def generate_udev_rules(config, key):
+    """
+    Loader rules matching only devices configured in config. Config file
+    key (see compiled_config.get_key()) is stored in header, so that stale
+    rules can be detected.
+    """
+    import json
+
+    devices = []
+    for cache in config.caches.values():
+        devices.append(cache.device)
+        devices += [core.device for core in cache.cores.values()]
+
+    lines = [
+        '# Generated by casctl from {0} - do not edit'.format(
+            cas_config.default_location),
+        '# config: {0}'.format(json.dumps(key, sort_keys=True)),
+        'ACTION=="remove", GOTO="cas_loader_end"',
+        'SUBSYSTEM!="block", GOTO="cas_loader_end"',
+        '',
+    ]
+    lines += ['{0}, GOTO="cas_loader_run"'.format(get_udev_match(device))
+              for device in devices]
+    lines += [
+        'GOTO="cas_loader_end"',
+        '',
+        'LABEL="cas_loader_run"',
+        'RUN+="{0} /dev/$name"'.format(udev_loader_path),
+        '',
+        'LABEL="cas_loader_end"',
+    ]
+
+    return '\n'.join(lines) + '\n'
+
+def generate_udev_override(rules_path):
+    """Rules replacing shipped catch-all loader rule with nothing"""
+    return (
+        '# Generated by casctl - do not edit\n'
+        '# Disables open-cas-loader run for every block device, configured\n'
+        '# devices are matched in {0}\n'.format(rules_path)
+    )
+
+def get_udev_rules_key(rules_path):
+    """Config key stored in generated rules file, None if there is none"""
+    import json
 
-def detach_all_cores(flush):
-    error = CompoundException()
+    try:
+        with open(rules_path, 'r') as rules:
+            for line in rules:
+                if line.startswith('# config: '):
+                    return json.loads(line[len('# config: '):])
+                if not line.startswith('#'):
+                    break
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+def update_udev_rules(config_file=None, rules_path=None, force=False,
+                      override_path=None):
+    """
+    Regenerate loader udev rules if config file has changed since they were
+    generated, and override shipped catch-all rule if not done yet. Returns
+    True if any rules file was written.
+    """
+    config_file = config_file or cas_config.default_location
+    rules_path = rules_path or udev_rules_path
+    override_path = override_path or udev_override_path
+
+    updated = False
 
+    override = generate_udev_override(rules_path)
     try:
+        with open(override_path, 'r') as f:
+            current_override = f.read()
+    except OSError:
+        current_override = None
+    if force or current_override != override:
+        write_file_atomic(override_path, override, 0o644)
+        updated = True
+
+    key = compiled_config.get_key(config_file)
+    if not force and get_udev_rules_key(rules_path) == key:
+        return updated
+
+    config = cas_config.from_file(config_file, allow_incomplete=True)
+    rules = generate_udev_rules(config, key)
+
+    write_file_atomic(rules_path, rules, 0o644)
+
+    return True
+
+
+def start_cache_cmd(cache, load, force=False):
+    return casadm.start_cache_cmd(
+            device=cache.device,
+            cache_id=cache.cache_id,
+            cache_mode=cache.cache_mode,
+            cache_line_size=cache.params.get('cache_line_size'),
+            load=load,
+            force=force)
+
+def start_cache(cache, load, force=False):
+    casadm.start_cache(
+            device=cache.device,
+            cache_id=cache.cache_id,
+            cache_mode=cache.cache_mode,
+            cache_line_size=cache.params.get('cache_line_size'),
+            load=load,
+            force=force)
+
+def configure_cache_cmds(cache):
+    cmds = []
+    if "cleaning_policy" in cache.params:
+        cmds.append(casadm.set_param_cmd(
+            "cleaning", cache_id=cache.cache_id, policy=cache.params["cleaning_policy"]
+        ))
+    if "promotion_policy" in cache.params:
+        cmds.append(casadm.set_param_cmd(
+            "promotion", cache_id=cache.cache_id, policy=cache.params["promotion_policy"]
+        ))
+    if "ioclass_file" in cache.params:
+        cmds.append(casadm.io_class_load_config_cmd(
+            cache_id=cache.cache_id, ioclass_file=cache.params["ioclass_file"]
+        ))
+    return cmds
+
+@invalidates_device_state
+def configure_cache(cache):
+    for cmd in configure_cache_cmds(cache):
+        casadm.run_cmd(cmd)
+
+
+def add_core_cmd(core, attach):
+    return casadm.add_core_cmd(
+            device=core.device,
+            cache_id=core.cache_id,
+            core_id=core.core_id,
+            try_add=attach)
+
+def add_core(core, attach):
+    casadm.add_core(
+            device=core.device,
+            cache_id=core.cache_id,
+            core_id=core.core_id,
+            try_add=attach)
+
+# Parallel execution
+
+
+class TaskResult(object):
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.duration = 0.0
+
+
+def run_parallel(func, items, jobs=None):
+    """
+    Call func(item) for every item, running at most jobs calls at a time.
+    Exceptions are not propagated but stored in returned list of TaskResult,
+    which follows the order of items.
+    """
+    results = [TaskResult(item) for item in items]
+
+    def run(task):
+        start_time = time.time()
+        try:
+            task.result = func(task.item)
+        except Exception as e:
+            task.error = e
+        task.duration = time.time() - start_time
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs <= 1 or len(results) <= 1:
+        for task in results:
+            run(task)
+        return results
+
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(run, results))
+
+    return results
+
+# Boot timeline - timing spans of casctl and open-cas-loader operations
+#
+# Every span is single JSON line appended to journal in /run (available
+# early in boot and cleared on reboot), so that spans of concurrently run
+# processes don't interleave. Operations are whole commands or handled
+# device events, steps are casadm commands, module probe etc. inside them
+# and waits are time spent waiting for module, devices or other processes.
+# Start is CLOCK_MONOTONIC time (seconds since boot).
+
+
+class timeline_span(object):
+    def __init__(self, kind, name, fields):
+        self.kind = kind
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.timestamp = time.time()
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self.start
+        if exc_type is SystemExit:
+            code = exc.code if exc.code is not None else 0
+            if code != 0:
+                self.fields['exit_code'] = code
+        elif exc_type is casadm.CasadmError:
+            self.fields['error'] = exc.result.stderr.strip()
+        elif exc_type is not None:
+            self.fields['error'] = str(exc) or exc_type.__name__
+
+        failed = ('error' in self.fields or self.fields.get('exit_code', 0) != 0
+                  or any(self.fields.get('exit_codes', [])))
+        timeline.record(self.kind, self.name, self.start, duration,
+                        self.timestamp, 'failed' if failed else 'ok', self.fields)
+        return False
+
+
+class timeline(object):
+    """
+    Journal of timing spans. Spans are recorded only after open() - in
+    other processes (and tests) they cost just two clock reads.
+    """
+    path = '/run/opencas/timeline.jsonl'
+    fd = None
+    process = None
+    boot_id = None
+
+    @classmethod
+    def open(cls, process, path=None):
+        """Start recording spans of process. Journal errors only disable recording."""
+        path = path or cls.path
+        try:
+            with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+                cls.boot_id = f.read().strip()
+        except OSError:
+            cls.boot_id = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            cls.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError:
+            cls.fd = None
+        cls.process = process
+
+    @classmethod
+    def close(cls):
+        if cls.fd is not None:
+            os.close(cls.fd)
+            cls.fd = None
+
+    @staticmethod
+    def span(name, **fields):
+        """Context manager timing single step"""
+        return timeline_span('step', name, fields)
+
+    @staticmethod
+    def wait(name, **fields):
+        """Context manager timing wait for something done outside of process"""
+        return timeline_span('wait', name, fields)
+
+    @staticmethod
+    def operation(name, **fields):
+        """Context manager timing whole command or event handling"""
+        return timeline_span('operation', name, fields)
+
+    @classmethod
+    def record(cls, kind, name, start, duration, timestamp, result, fields):
+        if cls.fd is None:
+            return
+
+        import json
+
+        entry = {'boot_id': cls.boot_id, 'process': cls.process, 'pid': os.getpid(),
+                 'kind': kind, 'name': name, 'start': round(start, 6),
+                 'duration': round(duration, 6), 'timestamp': round(timestamp, 6),
+                 'result': result}
+        entry.update(fields)
+        try:
+            os.write(cls.fd, (json.dumps(entry) + '\n').encode())
+        except OSError:
+            pass
+
+    @classmethod
+    def load(cls, path=None, boot_id=None):
+        """
+        Spans recorded during given boot (by default the last one found in
+        journal), ordered by start. Damaged lines are skipped.
+        """
+        import json
+
+        spans = []
+        with open(path or cls.path, 'r') as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                    span['start'] = float(span['start'])
+                    span['duration'] = float(span['duration'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                spans.append(span)
+
+        if boot_id is None and spans:
+            boot_id = spans[-1].get('boot_id')
+
+        spans = [span for span in spans if span.get('boot_id') == boot_id]
+        return sorted(spans, key=lambda span: span['start'])
+
+    @staticmethod
+    def get_critical_path(spans):
+        """
+        Chain of steps boot waited for, as copies of spans with added
+        'critical' time they contributed. Walking back from the end of the
+        last span, each previous element is the step which ended last before
+        the current one started. Waits (for module, devices etc.) only cover
+        time after the step preceding them, so that e.g. settle polling
+        doesn't hide the work it was waiting for.
+        """
+        import bisect
+
+        def get_end(span):
+            return span['start'] + span['duration']
+
+        def get_index(kind):
+            items = sorted((span for span in spans if span.get('kind') == kind),
+                           key=get_end)
+            return items, [get_end(span) for span in items]
+
+        steps, step_ends = get_index('step')
+        waits, wait_ends = get_index('wait')
+        if not steps and not waits:
+            return []
+
+        # Each span is used at most once, so search ranges only shrink
+        step_hi, wait_hi = len(steps), len(waits)
+        current = max(step_ends[-1:] + wait_ends[-1:])
+        path = []
+        while True:
+            # Allow for rounding of recorded times
+            step_hi = min(step_hi, bisect.bisect_right(step_ends, current + 1e-6))
+            wait_hi = min(wait_hi, bisect.bisect_right(wait_ends, current + 1e-6))
+            step = steps[step_hi - 1] if step_hi > 0 else None
+            wait = waits[wait_hi - 1] if wait_hi > 0 else None
+
+            if wait and (not step or get_end(wait) > get_end(step) + 1e-6):
+                span = wait
+                begin = max(wait['start'], get_end(step) if step else 0)
+                wait_hi -= 1
+            elif step:
+                span = step
+                begin = step['start']
+                step_hi -= 1
+            else:
+                break
+
+            path.append(dict(span, critical=round(get_end(span) - begin, 6)))
+            current = begin
+
+        return path[::-1]
+
+# Another helper functions
+
+def is_cache_started(cache_config):
+    state = DeviceStateSnapshot.current()
+    return state.get_cache(cache_config.cache_id) is not None
+
+def is_core_added(core_config):
+    state = DeviceStateSnapshot.current()
+    return state.get_core(core_config.cache_id, core_config.core_id) is not None
+
+def get_caches_list():
+    import cas_ioctl
+    import csv
+
+    dev_list = ctrl_ioctl.query(cas_ioctl.list_caches)
+    if dev_list is not None:
+        return dev_list
+
+    result = casadm.list_caches()
+    return list(csv.DictReader(result.stdout.split('\n')))
+
+def check_cache_device(device):
+    import cas_ioctl
+    import csv
+
+    status = ctrl_ioctl.query(cas_ioctl.check_cache_device, device)
+    if status is not None:
+        return status
+
+    result = casadm.check_cache_device(device)
+    return list(csv.DictReader(result.stdout.split('\n')))[0]
+
+def get_params(namespace, cache_id, core_id=None):
+    import cas_ioctl
+    import csv
+
+    params = ctrl_ioctl.query(cas_ioctl.get_params, namespace, cache_id, core_id)
+    if params is not None:
+        return params
+
+    if core_id is not None:
+        result = casadm.get_params(namespace, cache_id, core_id=core_id)
+    else:
+        result = casadm.get_params(namespace, cache_id)
+    return {row['Parameter name']: row['Value']
+            for row in csv.DictReader(result.stdout.split('\n'))}
+
+def get_cas_version():
+    version = casadm.get_version()
+
+    ret = {}
+    for line in version.stdout.split('\n')[1:]:
+        try:
+            component, version = line.split(',')
+        except:
+            continue
+        ret[component] = version
+
+    return ret
+
+
+class CompoundException(Exception):
+    def __init__(self):
+        super(CompoundException, self).__init__()
+        self.exception_list = list()
+
+    def __str__(self):
+        s = "Multiple exceptions occured:\n" if len(self.exception_list) > 1 else ""
+
+        for e in self.exception_list:
+            s += '{0}\n'.format(str(e))
+
+        return s
+
+    def add_exception(self, e):
+        if type(e) is CompoundException:
+            self.exception_list += e.exception_list
+        else:
+            self.exception_list += [e]
+
+    def is_empty(self):
+        return len(self.exception_list) == 0
+
+    def raise_nonempty(self):
+        if self.is_empty():
+            return
+        else:
+            raise self
+
+class cache_device(object):
+    """Cache instance from device listing, with its cores in listing order"""
+    __slots__ = ('id', 'disk', 'status', 'write_policy', 'cores')
+
+    def __init__(self, cache_id, disk, status, write_policy):
+        self.id = cache_id
+        self.disk = disk
+        self.status = status
+        self.write_policy = write_policy
+        self.cores = []
+
+
+class core_device(object):
+    """
+    Core from device listing. Cores in core pool have no id, cache and
+    exported device (None).
+    """
+    __slots__ = ('id', 'cache_id', 'disk', 'status', 'device')
+
+    def __init__(self, core_id, cache_id, disk, status, device):
+        self.id = core_id
+        self.cache_id = cache_id
+        self.disk = disk
+        self.status = status
+        self.device = device
+
+    @property
+    def key(self):
+        return (self.cache_id, self.id)
+
+
+class DeviceStateSnapshot(object):
+    """
+    Runtime state of CAS devices, fetched with single get_caches_list() call
+    and parsed into tree of cache_device objects holding their core_device
+    objects, plus core pool. Devices are indexed by cache id, (cache id,
+    core id) and device path (both core backing device and exported
+    /dev/casX-Y).
+
+    Shared snapshot returned by current() is dropped whenever casadm command
+    changing device state is issued, and expires after max_age seconds, so
+    that changes made by other processes (another casctl, udev triggered
+    loader) are seen. Operations holding their own snapshot record their
+    effects with mark_core_detached().
+    """
+
+    # Time [s] shared snapshot is reused for
+    max_age = 1.0
+
+    _current = None
+    _fetch_time = None
+    fetch_count = 0
+
+    def __init__(self, dev_list):
+        import collections
+
+        self.core_pool = []
+        self.caches = collections.OrderedDict()
+        self.cores = collections.OrderedDict()
+        self.by_path = {}
+        self._cores_by_disk = {}
+        self._detached = set()
+
+        # Cores follow cache (or core pool header) they belong to
+        cache = None
+        core_pool = False
+
+        for dev in dev_list:
+            dev_type = dev['type']
+            if dev_type == 'core':
+                if core_pool:
+                    core = core_device(None, None, dev['disk'], dev['status'], None)
+                    self.core_pool.append(core)
+                    self.by_path[core.disk] = core
+                    continue
+
+                core = core_device(int(dev['id']), cache.id, dev['disk'],
+                                   dev['status'], dev['device'])
+                cache.cores.append(core)
+                self.cores[core.key] = core
+                self.by_path.setdefault(core.disk, core)
+                self.by_path[core.device] = core
+                self._cores_by_disk.setdefault(core.disk, []).append(core)
+            elif dev_type == 'cache':
+                core_pool = False
+                cache = cache_device(int(dev['id']), dev['disk'], dev['status'],
+                                     dev['write policy'])
+                self.caches[cache.id] = cache
+                self.by_path[cache.disk] = cache
+            elif dev_type == 'core pool':
+                core_pool = True
+
+    @classmethod
+    def fetch(cls):
+        """Fetch fresh state and make it shared snapshot"""
         dev_list = get_caches_list()
+        cls.fetch_count += 1
+        cls._current = cls(dev_list)
+        cls._fetch_time = time.monotonic()
+        return cls._current
+
+    @classmethod
+    async def fetch_async(cls):
+        """Coroutine version of fetch()"""
+        dev_list = await get_caches_list_async()
+        cls.fetch_count += 1
+        cls._current = cls(dev_list)
+        cls._fetch_time = time.monotonic()
+        return cls._current
+
+    @classmethod
+    def current(cls):
+        """Shared snapshot, fetched only if invalidated or expired since last use"""
+        if (cls._current is None
+                or time.monotonic() - cls._fetch_time > cls.max_age):
+            return cls.fetch()
+        return cls._current
+
+    @classmethod
+    def invalidate(cls):
+        cls._current = None
+
+    def get_cache(self, cache_id):
+        return self.caches.get(int(cache_id))
+
+    def get_core(self, cache_id, core_id):
+        return self.cores.get((int(cache_id), int(core_id)))
+
+    def get_by_path(self, path):
+        return self.by_path.get(path)
+
+    def get_caches(self):
+        return list(self.caches.values())
+
+    def get_cores(self):
+        return list(self.cores.values())
+
+    def get_cores_on(self, path):
+        """Cores using given device (e.g. exported /dev/casX-Y) as backend"""
+        return list(self._cores_by_disk.get(path, []))
+
+    def is_core_active(self, core):
+        return core.status == 'Active' and core.key not in self._detached
+
+    def mark_core_detached(self, cache_id, core_id):
+        self._detached.add((int(cache_id), int(core_id)))
+
+    def get_devices_state(self):
+        return {
+            "core_pool": [
+                {"device": core.disk, "status": core.status}
+                for core in self.core_pool
+            ],
+            "caches": {
+                cache_id: {"device": cache.disk, "status": cache.status}
+                for cache_id, cache in self.caches.items()
+            },
+            "cores": {
+                key: {
+                    "device": core.disk,
+                    "status": core.status,
+                    "cache_id": core.cache_id,
+                }
+                for key, core in self.cores.items()
+            },
+        }
+
+
+def fetch_device_state():
+    try:
+        return DeviceStateSnapshot.fetch()
     except casadm.CasadmError as e:
         raise Exception('Unable to list caches. Reason:\n{0}'.format(
             e.result.stderr))
     except:
         raise Exception('Unable to list caches.')
 
-    for dev in dev_list:
-        if dev['type'] == 'cache':
-            cache_id = dev['id']
-        elif dev['type'] == 'core' and dev['status'] == "Active":
+def detach_core_recursive(cache_id, core_id, flush, state=None):
+    # Catching exceptions is left to uppermost caller of detach_core_recursive
+    # as the immediate caller that made a recursive call depends on the callee
+    # to remove core and thus release reference to lower level cache volume.
+    if state is None:
+        state = DeviceStateSnapshot.current()
+
+    exported_path = '/dev/cas{0}-{1}'.format(cache_id, core_id)
+    for upper_core in state.get_cores_on(exported_path):
+        if state.is_core_active(upper_core):
+            detach_core_recursive(upper_core.cache_id, upper_core.id,
+                                  flush, state)
+
+    core = state.get_core(cache_id, core_id)
+    if core is not None and not state.is_core_active(core):
+        return
+
+    casadm.remove_core(cache_id, core_id, detach = True, force = not flush)
+    state.mark_core_detached(cache_id, core_id)
+
+sysfs_block_dir = '/sys/class/block'
+
+def get_physical_device(path):
+    """
+    Name of whole disk holding given block device - parent disk in case of
+    partition, device itself otherwise.
+    """
+    name = os.path.basename(os.path.realpath(path))
+    sys_path = os.path.join(sysfs_block_dir, name)
+
+    if os.path.exists(os.path.join(sys_path, 'partition')):
+        return os.path.basename(os.path.dirname(os.path.realpath(sys_path)))
+
+    return name
+
+def get_block_device_children(path):
+    """
+    Names of partitions and holders (e.g. device mapper or md devices built
+    on it) of block device, read from sysfs - same devices lsblk lists under
+    it. None if device can't be found in sysfs.
+    """
+    name = os.path.basename(os.path.realpath(path))
+    sys_path = os.path.join(sysfs_block_dir, name)
+    try:
+        entries = os.listdir(sys_path)
+    except OSError:
+        return None
+
+    children = [entry for entry in entries
+                if os.path.isfile(os.path.join(sys_path, entry, 'partition'))]
+    try:
+        children += os.listdir(os.path.join(sys_path, 'holders'))
+    except OSError:
+        pass
+
+    return sorted(children)
+
+def get_core_physical_device(core, state):
+    # Exported volumes of lower level cores are followed down to the disk
+    # actually receiving flushed data
+    import re
+
+    disk = core.disk
+    for _ in range(len(state.cores)):
+        match = re.fullmatch(cas_config.cas_device_pattern, disk)
+        lower_core = state.get_core(*match.groups()) if match else None
+        if lower_core is None:
+            break
+        disk = lower_core.disk
+
+    return get_physical_device(disk)
+
+def get_detach_levels(state):
+    """
+    Active cores split into levels to be detached one after another - cores
+    using exported volume of other core are in earlier level than that core.
+    """
+    heights = dict()
+
+    def get_height(core):
+        key = core.key
+        if key not in heights:
+            heights[key] = 0
+            users = [user for user in state.get_cores_on(core.device)
+                     if state.is_core_active(user)]
+            heights[key] = 1 + max([get_height(user) for user in users] + [-1])
+        return heights[key]
+
+    levels = []
+    for core in state.get_cores():
+        if not state.is_core_active(core):
+            continue
+        height = get_height(core)
+        while len(levels) <= height:
+            levels.append([])
+        levels[height].append(core)
+
+    return levels
+
+def get_detach_groups(level, state):
+    """Cores of single detach level grouped by physical device"""
+    groups = dict()
+    for core in level:
+        groups.setdefault(get_core_physical_device(core, state), []).append(core)
+
+    return [groups[device] for device in sorted(groups)]
+
+def get_blocking_error(core, state, failed):
+    """
+    Error of core which can't be detached, because core using its exported
+    volume failed to detach. None if there is no such core.
+    """
+    blocking = [user for user in state.get_cores_on(core.device)
+                if user.key in failed]
+    if not blocking:
+        return None
+
+    return Exception(
+        'Unable to detach core {0}. Reason:\n'
+        'Core {1} using it could not be detached.'.format(
+            core.disk, blocking[0].device))
+
+def detach_all_cores(flush, state=None, jobs=None, progress=None):
+    """
+    Detach all active cores. Cores are grouped by physical device they are
+    stored on - groups are processed in parallel (at most jobs at a time),
+    cores within a group one after another, so that flushing doesn't make
+    single disk seek between many streams.
+
+    progress(done, total) is called after each detached (or failed) core.
+    """
+    import threading
+
+    error = CompoundException()
+
+    if state is None:
+        state = fetch_device_state()
+
+    levels = get_detach_levels(state)
+    total = sum(len(level) for level in levels)
+    done = [0]
+    failed = set()
+    lock = threading.Lock()
+
+    def core_done(core, exception=None):
+        with lock:
+            if exception:
+                failed.add(core.key)
+            done[0] += 1
+            if progress:
+                progress(done[0], total)
+
+    def detach_group(cores):
+        errors = []
+        for core in cores:
+            e = get_blocking_error(core, state, failed)
+            if not e:
+                try:
+                    casadm.remove_core(core.cache_id, core.id,
+                                       detach = True, force = not flush)
+                    state.mark_core_detached(core.cache_id, core.id)
+                except casadm.CasadmError as err:
+                    e = Exception('Unable to detach core {0}. Reason:\n{1}'.format(
+                        core.disk, err.result.stderr))
+                except:
+                    e = Exception('Unable to detach core {0}.'.format(core.disk))
+
             # In case of exception we proceed with detaching remaining core instances
             # to gracefully shutdown as many cache instances as possible.
-            try:
-                detach_core_recursive(cache_id, dev['id'], flush)
-            except casadm.CasadmError as e:
-                error.add_exception(Exception(
-                    'Unable to detach core {0}. Reason:\n{1}'.format(
-                        dev['disk'], e.result.stderr)))
-            except:
-                error.add_exception(Exception(
-                    'Unable to detach core {0}.'.format(dev['disk'])))
+            if e:
+                errors.append(e)
+            core_done(core, e)
+        return errors
+
+    for level in levels:
+        tasks = run_parallel(detach_group, get_detach_groups(level, state), jobs)
+        for task in tasks:
+            if task.error:
+                error.add_exception(task.error)
+            else:
+                for e in task.result:
+                    error.add_exception(e)
 
     error.raise_nonempty()
 
-def stop_all_caches(flush):
+def stop_all_caches(flush, state=None):
     error = CompoundException()
 
-    try:
-        dev_list = get_caches_list()
-    except casadm.CasadmError as e:
-        raise Exception('Unable to list caches. Reason:\n{0}'.format(
-            e.result.stderr))
-    except:
-        raise Exception('Unable to list caches.')
+    if state is None:
+        state = fetch_device_state()
 
-    for dev in dev_list:
-        if dev['type'] == 'cache':
-            # In case of exception we proceed with stopping subsequent cache instances
-            # to gracefully shutdown as many cache instances as possible.
-            try:
-                casadm.stop_cache(dev['id'], not flush)
-            except casadm.CasadmError as e:
-                error.add_exception(Exception(
-                    'Unable to stop cache {0}. Reason:\n{1}'.format(
-                        dev['disk'], e.result.stderr)))
-            except:
-                error.add_exception(Exception(
-                    'Unable to stop cache {0}.'.format(dev['disk'])))
+    for cache in state.get_caches():
+        # In case of exception we proceed with stopping subsequent cache instances
+        # to gracefully shutdown as many cache instances as possible.
+        try:
+            casadm.stop_cache(cache.id, not flush)
+        except casadm.CasadmError as e:
+            error.add_exception(Exception(
+                'Unable to stop cache {0}. Reason:\n{1}'.format(
+                    cache.disk, e.result.stderr)))
+        except:
+            error.add_exception(Exception(
+                'Unable to stop cache {0}.'.format(cache.disk)))
 
     error.raise_nonempty()
 
-def stop(flush):
+def stop(flush, jobs=None, progress=None):
     error = CompoundException()
 
+    # Single device listing serves whole stop - detaching cores doesn't
+    # change set of caches, and detached cores are tracked in snapshot.
+    state = fetch_device_state()
+
     try:
-        detach_all_cores(flush)
+        detach_all_cores(flush, state, jobs, progress)
     except Exception as e:
         error.add_exception(e)
 
     try:
-        stop_all_caches(False)
+        stop_all_caches(False, state)
     except Exception as e:
         error.add_exception(e)
 
@@ -738,74 +2325,1465 @@ def stop(flush):
 
 
 def get_devices_state():
-    device_list = get_caches_list()
+    return DeviceStateSnapshot.fetch().get_devices_state()
 
-    devices = {"core_pool": [], "caches": {}, "cores": {}}
 
-    core_pool = False
-    prev_cache_id = -1
+def wait_for_cas_ctrl():
+    with timeline.wait('wait for cas_ctrl'):
+        for i in range(30):  # timeout 30s
+            if os.path.exists('/dev/cas_ctrl'):
+                return
+            time.sleep(1)
 
-    for device in device_list:
-        if device["type"] == "core pool":
-            core_pool = True
-            continue
 
-        if device["type"] == "cache":
-            core_pool = False
-            prev_cache_id = int(device["id"])
-            devices["caches"].update(
-                {
-                    int(device["id"]): {
-                        "device": device["disk"],
-                        "status": device["status"],
-                    }
-                }
+def get_startup_target():
+    """Startup cores of configuration, which have to be Active after startup"""
+    try:
+        with timeline.span('parse config'):
+            config = cas_config.from_file(
+                cas_config.default_location, allow_incomplete=True
             )
-        elif device["type"] == "core":
-            core = {"device": device["disk"], "status": device["status"]}
-            if core_pool:
-                devices["core_pool"].append(core)
+    except Exception as e:
+        raise Exception("Unable to load opencas config. Reason: {0}".format(str(e)))
+
+    return config.get_startup_cores()
+
+
+def get_not_initialized(target_core_state, devices_state):
+    """Cores from target_core_state which aren't Active in devices_state"""
+    runtime_core_state = devices_state["cores"]
+    not_initialized = []
+
+    for core in target_core_state:
+        runtime_state = runtime_core_state.get((core.cache_id, core.core_id), None)
+        if not runtime_state or runtime_state["status"] != "Active":
+            not_initialized.append(core)
+
+    return not_initialized
+
+
+def wait_for_startup(timeout=300, interval=5, monitor=None):
+    """
+    Wait until all startup cores are Active. State is re-checked whenever
+    udev reports change of relevant block device, and every interval seconds
+    in case events are missed or can't be received at all.
+    """
+    target_core_state = get_startup_target()
+    stop_time = time.time() + int(timeout)
+    not_initialized = None
+
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = udev_monitor.open([core.device for core in target_core_state])
+
+    try:
+        while stop_time > time.time():
+            not_initialized = get_not_initialized(target_core_state,
+                                                  get_devices_state())
+            if not not_initialized:
+                break
+
+            wait_time = min(interval, max(stop_time - time.time(), 0))
+            with timeline.wait('settle wait', cores=len(not_initialized)):
+                if monitor:
+                    monitor.wait(wait_time)
+                else:
+                    time.sleep(wait_time)
+    finally:
+        if own_monitor and monitor:
+            monitor.close()
+
+    return not_initialized
+
+# Reconciliation of runtime state with configuration
+
+
+def get_io_classes(lines):
+    """
+    IO classes from io class configuration (or `casadm --io-class --list -o
+    csv` output) lines, as sorted list of (id, name, eviction priority,
+    allocation) comparable between both.
+    """
+    import csv
+
+    io_classes = []
+    for row in csv.DictReader(lines):
+        try:
+            io_classes.append((int(row['IO class id']), row['IO class name'].strip(),
+                               row['Eviction priority'].strip(),
+                               float(row['Allocation'])))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+
+    return sorted(io_classes)
+
+def get_runtime_io_classes(cache_id):
+    return get_io_classes(casadm.io_class_list(cache_id).stdout.split('\n'))
+
+
+class apply_operation(object):
+    """
+    Single step of apply plan - casadm commands run one after another on
+    behalf of one cache
+    """
+    __slots__ = ('cache_id', 'description', 'cmds')
+
+    def __init__(self, cache_id, description, cmds):
+        self.cache_id = cache_id
+        self.description = description
+        self.cmds = cmds
+
+
+class apply_plan(object):
+    """
+    Operations taking running caches to configuration, split into steps run
+    one after another. Operations of single step are independent - they are
+    grouped by cache and groups are run in parallel. Differences which can't
+    be applied without stopping cache are listed in conflicts.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.conflicts = []
+
+    def add_step(self, operations):
+        if operations:
+            self.steps.append(operations)
+
+    def is_empty(self):
+        return not self.steps
+
+    @staticmethod
+    def same_device(path, other):
+        return os.path.realpath(path) == os.path.realpath(other)
+
+    @classmethod
+    def get_cache_operations(cls, cache, device):
+        """Operations changing settings of running cache to configured ones"""
+        operations = []
+
+        if device.write_policy.lower() != cache.cache_mode:
+            # Dirty data has to be flushed when leaving write-back modes
+            flush = True if device.write_policy.lower() in ['wb', 'wo'] else None
+            operations.append(apply_operation(cache.cache_id,
+                'set cache {0} mode {1} -> {2}'.format(
+                    cache.cache_id, device.write_policy.lower(), cache.cache_mode),
+                [casadm.set_cache_mode_cmd(cache.cache_id, cache.cache_mode, flush)]))
+
+        for param, namespace, name in [
+                ('cleaning_policy', 'cleaning', 'Cleaning policy type'),
+                ('promotion_policy', 'promotion', 'Promotion policy type')]:
+            if param not in cache.params:
+                continue
+            current = get_params(namespace, cache.cache_id)[name]
+            wanted = cache.params[param].lower()
+            if current != wanted:
+                operations.append(apply_operation(cache.cache_id,
+                    'set cache {0} {1} policy {2} -> {3}'.format(
+                        cache.cache_id, namespace, current, wanted),
+                    [casadm.set_param_cmd(namespace, cache_id=cache.cache_id,
+                                          policy=wanted)]))
+
+        if 'ioclass_file' in cache.params:
+            with open(cache.params['ioclass_file']) as f:
+                wanted = get_io_classes(f)
+            if get_runtime_io_classes(cache.cache_id) != wanted:
+                operations.append(apply_operation(cache.cache_id,
+                    'load io classes of cache {0} from {1}'.format(
+                        cache.cache_id, cache.params['ioclass_file']),
+                    [casadm.io_class_load_config_cmd(cache.cache_id,
+                                                     cache.params['ioclass_file'])]))
+
+        return operations
+
+    @classmethod
+    def compute(cls, config, state):
+        """Plan taking runtime state (DeviceStateSnapshot) to config"""
+        plan = cls()
+
+        caches = [cache for cache in config.caches.values()
+                  if cache.cache_id not in state.caches]
+        stopped = [device for cache_id, device in state.caches.items()
+                   if cache_id not in config.caches]
+        conflicting = set()
+        configure = []
+
+        for cache in config.caches.values():
+            device = state.caches.get(cache.cache_id)
+            if device is None:
+                continue
+            if not cls.same_device(cache.device, device.disk):
+                plan.conflicts.append(
+                    'Cache {0} is running on {1}, but configured on {2}. '
+                    'Cache has to be stopped to apply configuration.'.format(
+                        cache.cache_id, device.disk, cache.device))
+                conflicting.add(cache.cache_id)
+                continue
+            configure += cls.get_cache_operations(cache, device)
+
+        # Cores are matched by id - core configured with different device is
+        # removed and added again. Cores of stopped caches go with them.
+        removed = set()
+        for core in state.get_cores():
+            if core.cache_id not in config.caches or core.cache_id in conflicting:
+                continue
+            wanted = config.caches[core.cache_id].cores.get(core.id)
+            if wanted is None or not cls.same_device(wanted.device, core.disk):
+                removed.add(core.key)
+        added = set((core.cache_id, core.core_id) for core in config.cores
+                    if core.cache_id not in conflicting)
+        added = set(key for key in added if key in removed or key not in state.cores)
+
+        # Cores using exported volumes of other cores are removed first
+        for level in get_detach_levels(state):
+            plan.add_step([
+                apply_operation(core.cache_id,
+                    'remove core {0} ({1}) from cache {2}'.format(
+                        core.id, core.disk, core.cache_id),
+                    [casadm.remove_core_cmd(core.cache_id, core.id)])
+                for core in level if core.key in removed])
+        inactive = [core for core in state.get_cores()
+                    if core.key in removed and not state.is_core_active(core)]
+        plan.add_step([
+            apply_operation(core.cache_id,
+                'remove inactive core {0} ({1}) from cache {2}'.format(
+                    core.id, core.disk, core.cache_id),
+                [casadm.remove_core_cmd(core.cache_id, core.id)])
+            for core in inactive])
+
+        plan.add_step([
+            apply_operation(device.id,
+                'stop cache {0} ({1})'.format(device.id, device.disk),
+                [casadm.stop_cache_cmd(device.id)])
+            for device in stopped])
+
+        plan.add_step([
+            apply_operation(cache.cache_id,
+                'start cache {0} ({1}) in {2} mode'.format(
+                    cache.cache_id, cache.device, cache.cache_mode),
+                [start_cache_cmd(cache, False)] + configure_cache_cmds(cache))
+            for cache in caches] + configure)
+
+        # Cores are added level by level, as in initial configuration
+        for level in config.get_core_levels():
+            plan.add_step([
+                apply_operation(core.cache_id,
+                    'add core {0} ({1}) to cache {2}'.format(
+                        core.core_id, core.device, core.cache_id),
+                    [add_core_cmd(core, False)])
+                for core in level if (core.cache_id, core.core_id) in added])
+
+        return plan
+
+    def run(self, jobs=None):
+        """
+        Run plan step by step. Operations of each cache within step are run
+        in single casadm batch. Returns list of (operation, error) pairs,
+        error being None for successful operation or casadm error output.
+        """
+        results = []
+
+        def run_group(operations):
+            cmds = [cmd for operation in operations for cmd in operation.cmds]
+            try:
+                cmd_results = casadm.run_batch(cmds)
+            except casadm.CasadmError as e:
+                cmd_results = [e.result] * len(cmds)
+
+            group_results = []
+            for operation in operations:
+                failed = [result for result in cmd_results[:len(operation.cmds)]
+                          if result.exit_code != 0]
+                cmd_results = cmd_results[len(operation.cmds):]
+                group_results.append(
+                    (operation, failed[0].stderr.strip() if failed else None))
+            return group_results
+
+        for step in self.steps:
+            groups = dict()
+            for operation in step:
+                groups.setdefault(operation.cache_id, []).append(operation)
+            groups = [groups[cache_id] for cache_id in sorted(groups)]
+
+            for task in run_parallel(run_group, groups, jobs):
+                if task.error:
+                    raise task.error
+                results += task.result
+
+        return results
+
+
+# Statistics sampling
+
+stats_block_size = 4096
+MiB = 1024 * 1024
+
+class stats_sample(object):
+    """
+    Raw statistics counters of all running caches and their cores taken at
+    single moment, keyed by (cache id, None) for caches and (cache id, core
+    id) for cores. Sample costs one device listing and one stats ioctl per
+    cache and per core, all over single control device handle - no casadm
+    processes are spawned.
+
+    With io_classes, counters of each configured io class are sampled as well
+    (keyed by (cache id, core id or None, io class id)), at cost of stats
+    ioctl per possible io class of every device.
+    """
+    __slots__ = ('time', 'stats', 'names', 'state', 'io_class_stats')
+
+    def __init__(self, sample_time, stats, names, state=None, io_class_stats=None):
+        self.time = sample_time
+        self.stats = stats
+        self.names = names
+        self.state = state
+        self.io_class_stats = io_class_stats or {}
+
+    @classmethod
+    def take(cls, io_classes=False):
+        import cas_ioctl
+
+        stats = dict()
+        names = dict()
+        io_class_stats = dict()
+        with ctrl_ioctl.open() as dev:
+            state = DeviceStateSnapshot(cas_ioctl.list_caches(dev))
+            sample_time = time.monotonic()
+            for cache in state.get_caches():
+                keys = [(cache.id, None)] + [core.key for core in cache.cores]
+                names[(cache.id, None)] = 'cache{0}'.format(cache.id)
+                for core in cache.cores:
+                    names[core.key] = os.path.basename(core.device)
+                for key in keys:
+                    # Device may disappear or not be running - skip it
+                    try:
+                        stats[key] = cas_ioctl.get_stats(dev, *key)
+                    except OSError:
+                        continue
+
+                    if not io_classes:
+                        continue
+
+                    # Stats of io classes which aren't configured can't be read
+                    for io_class_id in range(cas_ioctl.OCF_IO_CLASS_MAX):
+                        try:
+                            io_class_stats[key + (io_class_id,)] = \
+                                cas_ioctl.get_stats(dev, key[0], key[1], io_class_id)
+                        except OSError:
+                            pass
+
+        return cls(sample_time, stats, names, state, io_class_stats)
+
+def get_stats_rates(before, after):
+    """
+    Per-second rates between two samples for every device present in both.
+    Returns list of dicts with: cache_id, core_id (None for cache), name,
+    iops, read and write (MiB/s), hit (% of serviced requests, None if there
+    were none), dirty (growth of dirty data, MiB/s) and pt (pass-through
+    requests/s).
+    """
+    interval = after.time - before.time
+    if interval <= 0:
+        return []
+
+    rates = []
+    for key, current in after.stats.items():
+        previous = before.stats.get(key)
+        if previous is None:
+            continue
+
+        def delta(group, *names):
+            return sum(current[group][name] - previous[group][name]
+                       for name in names)
+
+        requests = delta('req', 'rd_total', 'wr_total')
+        hits = delta('req', 'rd_hits', 'wr_hits')
+        block_rate = float(stats_block_size) / MiB / interval
+
+        rates.append({
+            'cache_id': key[0],
+            'core_id': key[1],
+            'name': after.names[key],
+            'iops': delta('req', 'total') / interval,
+            'read': delta('blocks', 'volume_rd') * block_rate,
+            'write': delta('blocks', 'volume_wr') * block_rate,
+            'hit': 100. * hits / requests if requests > 0 else None,
+            'dirty': delta('usage', 'dirty') * block_rate,
+            'pt': delta('req', 'rd_pt', 'wr_pt') / interval,
+        })
+
+    return rates
+
+
+# Statistics export - Prometheus text format (node_exporter textfile collector)
+
+metrics_prefix = 'opencas'
+
+# Statistics groups as reported by casadm -P: (group of cas_ioctl.get_stats,
+# metric name part, metric type, unit, [(counter, casadm statistic name)])
+stats_groups = [
+    ('usage', 'usage', 'gauge', 'bytes', [
+        ('occupancy', 'occupancy'),
+        ('free', 'free'),
+        ('clean', 'clean'),
+        ('dirty', 'dirty'),
+    ]),
+    ('req', 'requests', 'counter', None, [
+        ('rd_hits', 'read hits'),
+        ('rd_partial_misses', 'read partial misses'),
+        ('rd_full_misses', 'read full misses'),
+        ('rd_total', 'read total'),
+        ('wr_hits', 'write hits'),
+        ('wr_partial_misses', 'write partial misses'),
+        ('wr_full_misses', 'write full misses'),
+        ('wr_total', 'write total'),
+        ('rd_pt', 'pass-through reads'),
+        ('wr_pt', 'pass-through writes'),
+        ('serviced', 'serviced requests'),
+        ('total', 'total requests'),
+    ]),
+    ('blocks', 'blocks', 'counter', 'bytes', [
+        ('core_volume_rd', 'reads from core(s)'),
+        ('core_volume_wr', 'writes to core(s)'),
+        ('core_volume_total', 'total to/from core(s)'),
+        ('cache_volume_rd', 'reads from cache'),
+        ('cache_volume_wr', 'writes to cache'),
+        ('cache_volume_total', 'total to/from cache'),
+        ('volume_rd', 'reads from exported object(s)'),
+        ('volume_wr', 'writes to exported object(s)'),
+        ('volume_total', 'total to/from exported object(s)'),
+    ]),
+    ('errors', 'errors', 'counter', None, [
+        ('cache_volume_rd', 'cache read errors'),
+        ('cache_volume_wr', 'cache write errors'),
+        ('cache_volume_total', 'cache total errors'),
+        ('core_volume_rd', 'core read errors'),
+        ('core_volume_wr', 'core write errors'),
+        ('core_volume_total', 'core total errors'),
+        ('total', 'total errors'),
+    ]),
+]
+
+def get_metric_name(group_name, counter, metric_type, unit):
+    name = '{0}_{1}_{2}'.format(metrics_prefix, group_name, counter)
+    if unit:
+        name += '_' + unit
+    if metric_type == 'counter' and not name.endswith('_total'):
+        name += '_total'
+    return name
+
+def format_metric_labels(labels):
+    return ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\')
+                                       .replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels)
+
+def format_metrics(sample):
+    """
+    Statistics of all caches, cores and io classes of sample in Prometheus
+    text exposition format. Metric names and labels don't depend on casadm
+    output formatting: cache_id for caches, cache_id and core_id for cores,
+    plus io_class for io class statistics.
+    """
+    series = dict()
+
+    def add(name, labels, value):
+        series.setdefault(name, []).append((labels, value))
+
+    def get_labels(key):
+        labels = [('cache_id', key[0])]
+        if key[1] is not None:
+            labels.append(('core_id', key[1]))
+        if len(key) > 2:
+            labels.append(('io_class', key[2]))
+        return labels
+
+    items = sorted(sample.stats.items(), key=lambda item: (item[0][0], item[0][1] or 0))
+    items += sorted(sample.io_class_stats.items(),
+                    key=lambda item: (item[0][0], item[0][1] or 0, item[0][2]))
+    for key, stats in items:
+        labels = get_labels(key)
+        for group, group_name, metric_type, unit, counters in stats_groups:
+            for counter, _ in counters:
+                value = stats[group][counter]
+                if unit == 'bytes':
+                    value *= stats_block_size
+                add(get_metric_name(group_name, counter, metric_type, unit),
+                    labels, value)
+
+    if sample.state is not None:
+        info = '{0}_cache_info'.format(metrics_prefix)
+        for cache in sample.state.get_caches():
+            add(info, [('cache_id', cache.id), ('device', cache.disk),
+                       ('status', cache.status), ('mode', cache.write_policy)], 1)
+        info = '{0}_core_info'.format(metrics_prefix)
+        for core in sample.state.get_cores():
+            add(info, [('cache_id', core.cache_id), ('core_id', core.id),
+                       ('device', core.disk), ('exported_device', core.device),
+                       ('status', core.status)], 1)
+
+    help_texts = dict()
+    for group, group_name, metric_type, unit, counters in stats_groups:
+        for counter, stat_name in counters:
+            name = get_metric_name(group_name, counter, metric_type, unit)
+            help_texts[name] = (stat_name.capitalize(), metric_type)
+    help_texts['{0}_cache_info'.format(metrics_prefix)] = ('Cache instance', 'gauge')
+    help_texts['{0}_core_info'.format(metrics_prefix)] = ('Core device', 'gauge')
+
+    lines = []
+    for name in sorted(series):
+        help_text, metric_type = help_texts[name]
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, metric_type))
+        for labels, value in series[name]:
+            lines.append('{0}{{{1}}} {2}'.format(name, format_metric_labels(labels), value))
+
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def write_metrics(path, sample):
+    """
+    Write metrics atomically - collector never reads partially written file
+    """
+    write_file_atomic(path, format_metrics(sample), 0o644)
+
+
+# Statistics history - fixed size ring file of binary samples
+
+
+class stats_ring(object):
+    """
+    Memory mapped ring file of fixed width statistics records. Header holds
+    capacity (in records) and head - number of records ever written, so that
+    record n is stored in slot n % capacity and readers can tell which
+    records are still present. Record is written before head is advanced.
+
+    Record: key (s), timestamp (s), cache id, core id (core_id_none for
+    cache), usage gauges (4KiB blocks) and increments of request, block and
+    error counters since previous record of the device. Records are ordered
+    and searched by key, which never decreases, while wall clock timestamp
+    (which may step back, e.g. on NTP or manual change) is only displayed.
+    """
+    magic = b'OCASRING'
+    version = 2
+    header_format = '<8sIIQQ'
+    header_size = 64
+    head_offset = 24
+    core_id_none = 0xFFFF
+    default_path = '/var/lib/opencas/stats.ring'
+
+    gauges = [(group, group_name, counter)
+              for group, group_name, metric_type, _, counters in stats_groups
+              if metric_type == 'gauge' for counter, _ in counters]
+    counters = [(group, group_name, counter)
+                for group, group_name, metric_type, _, counters in stats_groups
+                if metric_type == 'counter' for counter, _ in counters]
+    fields = ['{0}_{1}'.format(group_name, counter)
+              for _, group_name, counter in gauges + counters]
+    record_format = '<IIHH{0}Q{1}I'.format(len(gauges), len(counters))
+    counter_max = 0xFFFFFFFF
+
+    def __init__(self, f, mm):
+        import struct
+
+        self.file = f
+        self.mm = mm
+        self.record = struct.Struct(self.record_format)
+        magic, version, record_size, self.capacity, _ = struct.unpack_from(
+            self.header_format, mm, 0)
+        if magic != self.magic or version != self.version or \
+                record_size != self.record.size or self.capacity == 0 or \
+                len(mm) < self.header_size + self.capacity * record_size:
+            raise ValueError('Invalid statistics history file')
+
+    @classmethod
+    def get_file_size(cls, capacity):
+        import struct
+
+        return cls.header_size + capacity * struct.calcsize(cls.record_format)
+
+    @classmethod
+    def create(cls, path, size):
+        """
+        Open ring file of given size (bytes) for writing. File is
+        (re)initialized if it doesn't exist or has different layout or size,
+        otherwise recording continues after its last record.
+        """
+        import mmap
+        import struct
+
+        capacity = (size - cls.header_size) // struct.calcsize(cls.record_format)
+        if capacity <= 0:
+            raise ValueError('Statistics history size too small')
+
+        try:
+            with cls.open(path) as ring:
+                compatible = ring.capacity == capacity
+        except (OSError, ValueError):
+            compatible = False
+
+        if compatible:
+            return cls._map(open(path, 'r+b'), mmap.ACCESS_WRITE)
+
+        f = open(path, 'w+b')
+        try:
+            f.truncate(cls.get_file_size(capacity))
+            f.write(struct.pack(cls.header_format, cls.magic, cls.version,
+                                struct.calcsize(cls.record_format), capacity, 0))
+            f.flush()
+        except:
+            f.close()
+            raise
+
+        return cls._map(f, mmap.ACCESS_WRITE)
+
+    @classmethod
+    def open(cls, path):
+        """Open ring file for reading"""
+        import mmap
+
+        return cls._map(open(path, 'rb'), mmap.ACCESS_READ)
+
+    @classmethod
+    def _map(cls, f, access):
+        import mmap
+
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=access)
+        except (OSError, ValueError):
+            f.close()
+            raise
+        try:
+            return cls(f, mm)
+        except:
+            mm.close()
+            f.close()
+            raise
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def head(self):
+        import struct
+
+        return struct.unpack_from('<Q', self.mm, self.head_offset)[0]
+
+    def get_offset(self, index):
+        return self.header_size + (index % self.capacity) * self.record.size
+
+    def append(self, records, key=None):
+        """
+        Append (timestamp, cache id, core id, values) records. Key orders
+        them in the ring (their timestamp by default) and is raised to key of
+        the last record if lower, so that records stay sorted by key.
+        """
+        import struct
+
+        head = self.head
+        first, end = self.get_range()
+        last_key = self.get_key(end - 1) if end > first else 0
+        for timestamp, cache_id, core_id, values in records:
+            record_key = max(int(timestamp if key is None else key), last_key)
+            self.record.pack_into(self.mm, self.get_offset(head), record_key,
+                                  int(timestamp), cache_id,
+                                  self.core_id_none if core_id is None
+                                  else core_id, *values)
+            last_key = record_key
+            head += 1
+        struct.pack_into('<Q', self.mm, self.head_offset, head)
+
+    def get_range(self):
+        """Logical indexes [first, end) of records present in file"""
+        end = self.head
+        return max(end - self.capacity, 0), end
+
+    def get_key(self, index):
+        import struct
+
+        return struct.unpack_from('<I', self.mm, self.get_offset(index))[0]
+
+    def find(self, key, first, end):
+        """First index in [first, end) with record key not lower than key"""
+        while first < end:
+            middle = (first + end) // 2
+            if self.get_key(middle) < key:
+                first = middle + 1
             else:
-                core.update({"cache_id": prev_cache_id})
-                devices["cores"].update(
-                    {(prev_cache_id, int(device["id"])): core}
-                )
+                end = middle
+        return first
+
+    def read(self, since=None, until=None, cache_id=None, core_id=None):
+        """
+        Yield records from time range [since, until] as dicts with time,
+        cache_id, core_id (None for cache) and fields. Range is matched
+        against record keys, found by binary search and only records inside
+        it are read from the file.
+        """
+        first, end = self.get_range()
+        if since is not None:
+            first = self.find(since, first, end)
+        if until is not None:
+            end = self.find(until + 1, first, end)
+
+        for index in range(first, end):
+            values = self.record.unpack_from(self.mm, self.get_offset(index))
+            # Record might have been overwritten by writer in the meantime
+            if index < self.head - self.capacity:
+                continue
+            record_core_id = None if values[3] == self.core_id_none else values[3]
+            if cache_id is not None and values[2] != cache_id:
+                continue
+            if core_id is not None and record_core_id != core_id:
+                continue
+            record = dict(zip(self.fields, values[4:]))
+            record['time'] = values[1]
+            record['cache_id'] = values[2]
+            record['core_id'] = record_core_id
+            yield record
+
+
+class stats_recorder(object):
+    """
+    Stores consecutive stats_sample objects in stats_ring. Counters are
+    recorded as increments since previous sample. Devices which had no
+    activity and no usage change are recorded only every keepalive seconds,
+    which keeps idle periods cheap. Records are keyed by wall time of first
+    sample advanced by monotonic clock, so that steps of wall clock don't
+    break order of the ring.
+    """
+
+    def __init__(self, ring, keepalive=60):
+        self.ring = ring
+        self.keepalive = keepalive
+        self.previous = None
+        self.last_recorded = dict()
+        # (wall time, monotonic time) of first sample
+        self.clock = None
+
+    def get_key(self, timestamp):
+        now = time.monotonic()
+        if self.clock is None:
+            self.clock = (timestamp, now)
+        return self.clock[0] + now - self.clock[1]
+
+    def add(self, sample, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        key = self.get_key(timestamp)
+
+        records = []
+        previous = self.previous.stats if self.previous else {}
+        for device in sorted(sample.stats, key=lambda key: (key[0], key[1] or 0)):
+            current = sample.stats[device]
+            if device not in previous:
+                continue
+
+            gauges = [current[group][counter] for group, _, counter in self.ring.gauges]
+            increments = []
+            for group, _, counter in self.ring.counters:
+                increment = current[group][counter] - previous[device][group][counter]
+                # Counters start from zero after cache restart
+                if increment < 0:
+                    increment = current[group][counter]
+                increments.append(min(increment, self.ring.counter_max))
+
+            last = self.last_recorded.get(device)
+            if last and not any(increments) and last[1] == gauges and \
+                    key - last[0] < self.keepalive:
+                continue
+
+            self.last_recorded[device] = (key, gauges)
+            records.append((timestamp, device[0], device[1], gauges + increments))
+
+        self.ring.append(records, key)
+        self.previous = sample
+        return len(records)
+
+
+# Adaptive sequential cutoff - tunes seq-cutoff parameters of cores to load
+# of their backing devices
+
+seq_cutoff_threshold_max = 4194181
+# Sequential cutoff policies from the most to the least aggressive
+seq_cutoff_policies = ['always', 'full', 'never']
+
+# Fields of /sys/class/block/<name>/stat (times in ms)
+disk_stat_fields = ['reads', 'read_merges', 'read_sectors', 'read_ticks',
+                    'writes', 'write_merges', 'write_sectors', 'write_ticks',
+                    'in_flight', 'io_ticks', 'time_in_queue']
+
+def get_disk_stat(disk, sysfs_dir='/sys/class/block'):
+    """
+    IO statistics of block device (disk or partition) as dict keyed by
+    disk_stat_fields. None if they can't be read.
+    """
+    name = os.path.basename(os.path.realpath(disk))
+    try:
+        with open(os.path.join(sysfs_dir, name, 'stat')) as f:
+            values = [int(value) for value in f.read().split()]
+    except (OSError, ValueError):
+        return None
+
+    if len(values) < len(disk_stat_fields):
+        return None
+    return dict(zip(disk_stat_fields, values))
+
+def get_disk_busy_time(disk, sysfs_dir='/sys/class/block'):
+    """Time [ms] block device spent doing IO, None if it can't be read"""
+    stat = get_disk_stat(disk, sysfs_dir)
+    return stat['io_ticks'] if stat else None
+
+def get_disk_load(before, after, interval):
+    """
+    Load of block device between two get_disk_stat() results taken interval
+    seconds apart: utilization [%], average queue depth and average request
+    latency [ms] (None if there were no requests).
+    """
+    def delta(*names):
+        return sum(after[name] - before[name] for name in names)
+
+    requests = delta('reads', 'writes')
+    return {
+        'utilization': min(100. * delta('io_ticks') / 1000 / interval, 100.),
+        'queue_depth': float(delta('time_in_queue')) / 1000 / interval,
+        'latency': float(delta('read_ticks', 'write_ticks')) / requests
+            if requests > 0 else None,
+    }
+
+
+class seq_cutoff_tuner(object):
+    """
+    Adjusts sequential cutoff of every core from consecutive statistics
+    samples:
+
+    - backing device saturated (utilization at least high_util) while
+      requests are passed through to it - cutoff sends too much to the core.
+      Threshold is doubled up to max_threshold, then policy is relaxed
+      towards 'never'.
+    - backing device idle (utilization at most low_util) and hit ratio
+      under min_hit - cached sequential streams don't pay off. Policy is
+      tightened back towards 'always', then threshold is halved down to
+      min_threshold.
+
+    Utilization between low_util and high_util keeps current settings, and
+    decision has to repeat for hold consecutive intervals to be applied.
+    Only policies listed in policies are set. Every change is written to
+    decision log as JSON line.
+    """
+
+    class core_state(object):
+        __slots__ = ('threshold', 'policy', 'busy', 'direction', 'count')
+
+        def __init__(self, threshold, policy):
+            self.threshold = threshold
+            self.policy = policy
+            self.busy = None
+            self.direction = None
+            self.count = 0
+
+    def __init__(self, min_threshold=128, max_threshold=65536, policies=None,
+                 low_util=30, high_util=80, min_hit=20, hold=3, log=None,
+                 dry_run=False):
+        policies = policies or seq_cutoff_policies
+        if not 1 <= min_threshold <= max_threshold <= seq_cutoff_threshold_max:
+            raise ValueError('Invalid sequential cutoff threshold bounds '
+                             '({0}-{1} KiB)'.format(min_threshold, max_threshold))
+        for policy in policies:
+            if policy not in seq_cutoff_policies:
+                raise ValueError('Invalid sequential cutoff policy {0}'.format(policy))
+        if not 0 <= low_util < high_util <= 100:
+            raise ValueError('Invalid utilization bounds')
+
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.policies = sorted(set(policies), key=seq_cutoff_policies.index)
+        self.low_util = low_util
+        self.high_util = high_util
+        self.min_hit = min_hit
+        self.hold = hold
+        self.log = log
+        self.dry_run = dry_run
+        self.cores = dict()
+
+    @staticmethod
+    def get_settings(cache_id, core_id):
+        params = get_params('seq-cutoff', cache_id, core_id)
+        return (int(params['Sequential cutoff threshold [KiB]']),
+                params['Sequential cutoff policy'])
+
+    def decide(self, utilization, hit, pt):
+        if utilization >= self.high_util and pt > 0:
+            return 'up', 'backing device saturated with pass-through requests'
+        if utilization <= self.low_util and hit is not None and hit < self.min_hit:
+            return 'down', 'backing device idle with low hit ratio'
+        return None, None
+
+    def get_change(self, core, direction):
+        """Next (parameter, value) in given direction, None if at bound"""
+        order = seq_cutoff_policies.index(core.policy) \
+            if core.policy in seq_cutoff_policies else 0
+
+        if direction == 'up':
+            if core.threshold < self.max_threshold:
+                return 'threshold', min(max(core.threshold * 2, self.min_threshold),
+                                        self.max_threshold)
+            relaxed = [p for p in self.policies if seq_cutoff_policies.index(p) > order]
+            if relaxed:
+                return 'policy', relaxed[0]
+        else:
+            tightened = [p for p in self.policies if seq_cutoff_policies.index(p) < order]
+            if tightened:
+                return 'policy', tightened[-1]
+            if core.threshold > self.min_threshold:
+                return 'threshold', max(min(core.threshold // 2, self.max_threshold),
+                                        self.min_threshold)
+        return None
+
+    def apply(self, key, core, change, entry):
+        param, value = change
+        entry.update({'param': param, 'old': getattr(core, param), 'new': value})
+
+        if not self.dry_run:
+            try:
+                casadm.set_param('seq-cutoff', key[0], core_id=key[1], **{param: value})
+            except casadm.CasadmError as e:
+                entry['error'] = e.result.stderr.strip()
 
-    return devices
+        if 'error' not in entry:
+            setattr(core, param, value)
+        self.write_log(entry)
 
+    def write_log(self, entry):
+        import json
 
-def wait_for_cas_ctrl():
-    for i in range(30):  # timeout 30s
-        if os.path.exists('/dev/cas_ctrl'):
+        if self.log is None:
             return
-        time.sleep(1)
+        self.log.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.log.flush()
+
+    def update(self, before, after):
+        """
+        Process pair of consecutive samples (taken with device state).
+        Returns list of decision log entries of changes made.
+        """
+        entries = []
+        now = time.monotonic()
+
+        for device in after.state.get_cores():
+            key = device.key
+            core = self.cores.get(key)
+            if core is None:
+                try:
+                    core = self.core_state(*self.get_settings(*key))
+                except (casadm.CasadmError, OSError, KeyError, ValueError):
+                    continue
+                self.cores[key] = core
+
+            busy = get_disk_busy_time(device.disk)
+            previous_busy, core.busy = core.busy, (now, busy)
+            if busy is None or previous_busy is None or previous_busy[1] is None \
+                    or key not in before.stats or key not in after.stats:
+                continue
+            if now <= previous_busy[0]:
+                continue
+
+            def delta(group, *names):
+                return sum(after.stats[key][group][name] - before.stats[key][group][name]
+                           for name in names)
+
+            requests = delta('req', 'rd_total', 'wr_total')
+            if requests <= 0:
+                continue
+            utilization = min(100. * (busy - previous_busy[1]) / 1000 /
+                              (now - previous_busy[0]), 100.)
+            hit = 100. * delta('req', 'rd_hits', 'wr_hits') / requests
+            pt = delta('req', 'rd_pt', 'wr_pt')
+
+            direction, reason = self.decide(utilization, hit, pt)
+            if direction is None or direction != core.direction:
+                core.direction, core.count = direction, 0
+            if direction is None:
+                continue
+
+            core.count += 1
+            if core.count < self.hold:
+                continue
+            core.count = 0
+
+            change = self.get_change(core, direction)
+            if change is None:
+                continue
+
+            entry = {
+                'time': round(time.time(), 3),
+                'cache_id': key[0],
+                'core_id': key[1],
+                'utilization': round(utilization, 1),
+                'hit': round(hit, 1),
+                'pt_requests': pt,
+                'reason': reason,
+                'dry_run': self.dry_run,
+            }
+            self.apply(key, core, change, entry)
+            entries.append(entry)
+
+        # Forget removed cores - they start from their current settings
+        for key in set(self.cores) - set(after.state.cores):
+            del self.cores[key]
+
+        return entries
+
+
+# Adaptive cleaning - tunes ALRU and ACP parameters to dirty occupancy of
+# caches and load of their cores' backing devices
+
+# Tuned parameters per cleaning policy: (parameter namespace, [(parameter,
+# name reported by --get-param, min, max, True if higher value cleans more
+# aggressively)])
+cleaning_tuned_params = {
+    'alru': ('cleaning-alru', [
+        ('wake_up', 'Wake up time [s]', 0, 3600, False),
+        ('staleness_time', 'Stale buffer time [s]', 1, 3600, False),
+        ('flush_max_buffers', 'Flush max buffers', 1, 10000, True),
+        ('activity_threshold', 'Activity threshold [ms]', 0, 1000000, False),
+    ]),
+    'acp': ('cleaning-acp', [
+        ('wake_up', 'Wake up time [ms]', 0, 10000, False),
+        ('flush_max_buffers', 'Flush max buffers', 1, 10000, True),
+    ]),
+}
+
+class cleaning_tuner(object):
+    """
+    Drives cleaning parameters of caches using ALRU or ACP policy towards
+    target_dirty (% of cache size) within foreground latency budget.
+
+    Backing devices of cache's cores are over budget when any of them has
+    average request latency over latency_budget [ms], queue depth of at
+    least max_queue_depth or utilization of at least high_util [%]:
+
+    - dirty over target_dirty + tolerance - cleaning is made more aggressive
+      (flush_max_buffers doubled, wake up, staleness and activity times
+      halved), unless over budget,
+    - dirty under target_dirty - tolerance, or within tolerance and over
+      budget - cleaning is made less aggressive (reverse changes).
+
+    Decision has to repeat for hold consecutive intervals to be applied.
+    Parameters are kept within limits of cache engine. Every change is
+    written to decision log as JSON line.
+    """
+
+    class cache_state(object):
+        __slots__ = ('policy', 'params', 'disks', 'direction', 'count')
+
+        def __init__(self, policy, params):
+            self.policy = policy
+            self.params = params
+            self.disks = dict()
+            self.direction = None
+            self.count = 0
+
+    def __init__(self, target_dirty=30, tolerance=10, latency_budget=20,
+                 max_queue_depth=32, high_util=90, hold=3, log=None,
+                 dry_run=False):
+        if not 0 <= target_dirty - tolerance < target_dirty + tolerance <= 100:
+            raise ValueError('Invalid target dirty ratio ({0}% +/- {1}%)'.format(
+                target_dirty, tolerance))
+
+        self.target_dirty = target_dirty
+        self.tolerance = tolerance
+        self.latency_budget = latency_budget
+        self.max_queue_depth = max_queue_depth
+        self.high_util = high_util
+        self.hold = hold
+        self.log = log
+        self.dry_run = dry_run
+        self.caches = dict()
+
+    @staticmethod
+    def get_settings(cache_id):
+        """Cleaning policy of cache and its tuned parameters (None if not tuned)"""
+        policy = get_params('cleaning', cache_id)['Cleaning policy type']
+        if policy not in cleaning_tuned_params:
+            return policy, None
+
+        namespace, params = cleaning_tuned_params[policy]
+        values = get_params(namespace, cache_id)
+        return policy, {param: int(values[name]) for param, name, _, _, _ in params}
+
+    def get_load(self, cache, device, now):
+        """
+        Highest load of cache's cores backing devices since last update,
+        None if it wasn't measured for any of them
+        """
+        load = {'utilization': 0., 'queue_depth': 0., 'latency': None}
+        measured = False
+        disks = dict()
+
+        for core in device.cores:
+            stat = get_disk_stat(core.disk)
+            if stat is None:
+                continue
+            disks[core.disk] = (now, stat)
+
+            previous = cache.disks.get(core.disk)
+            if previous is None or now <= previous[0]:
+                continue
+
+            core_load = get_disk_load(previous[1], stat, now - previous[0])
+            measured = True
+            for name, value in core_load.items():
+                if value is not None and (load[name] is None or value > load[name]):
+                    load[name] = value
+
+        cache.disks = disks
+        return load if measured else None
+
+    def decide(self, dirty, load):
+        over_budget = load['utilization'] >= self.high_util or \
+            load['queue_depth'] >= self.max_queue_depth or \
+            (load['latency'] is not None and load['latency'] > self.latency_budget)
+
+        if dirty > self.target_dirty + self.tolerance:
+            if over_budget:
+                return None, None
+            return 'faster', 'dirty data over target'
+        if dirty < self.target_dirty - self.tolerance:
+            return 'slower', 'dirty data under target'
+        if over_budget:
+            return 'slower', 'foreground latency budget exceeded'
+        return None, None
+
+    def get_changes(self, cache, direction):
+        """New values of parameters for given direction, empty if all at bounds"""
+        changes = dict()
+        for param, _, low, high, aggressive in cleaning_tuned_params[cache.policy][1]:
+            value = cache.params[param]
+            if (direction == 'faster') == aggressive:
+                new = min(max(value * 2, low, 1), high)
+            else:
+                new = max(min(value // 2, high), low)
+            if new != value:
+                changes[param] = new
+        return changes
+
+    def write_log(self, entry):
+        import json
+
+        if self.log is None:
+            return
+        self.log.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.log.flush()
+
+    def update(self, before, after):
+        """
+        Process pair of consecutive samples (taken with device state).
+        Returns list of decision log entries of changes made.
+        """
+        entries = []
+        now = time.monotonic()
+
+        for device in after.state.get_caches():
+            key = (device.id, None)
+            cache = self.caches.get(device.id)
+            if cache is None:
+                try:
+                    cache = self.cache_state(*self.get_settings(device.id))
+                except (casadm.CasadmError, OSError, KeyError, ValueError):
+                    continue
+                self.caches[device.id] = cache
+            if cache.params is None:
+                continue
+
+            load = self.get_load(cache, device, now)
+            if load is None or key not in after.stats or key not in before.stats:
+                continue
+
+            usage = after.stats[key]['usage']
+            size = usage['occupancy'] + usage['free']
+            if size <= 0:
+                continue
+            dirty = 100. * usage['dirty'] / size
+
+            direction, reason = self.decide(dirty, load)
+            if direction is None or direction != cache.direction:
+                cache.direction, cache.count = direction, 0
+            if direction is None:
+                continue
+
+            cache.count += 1
+            if cache.count < self.hold:
+                continue
+            cache.count = 0
+
+            changes = self.get_changes(cache, direction)
+            if not changes:
+                continue
+
+            entry = {
+                'time': round(time.time(), 3),
+                'cache_id': device.id,
+                'policy': cache.policy,
+                'dirty': round(dirty, 1),
+                'utilization': round(load['utilization'], 1),
+                'queue_depth': round(load['queue_depth'], 1),
+                'latency': round(load['latency'], 1)
+                    if load['latency'] is not None else None,
+                'reason': reason,
+                'changes': {param: [cache.params[param], value]
+                            for param, value in changes.items()},
+                'dry_run': self.dry_run,
+            }
+
+            if not self.dry_run:
+                try:
+                    casadm.set_param(cleaning_tuned_params[cache.policy][0],
+                                     device.id, **changes)
+                except casadm.CasadmError as e:
+                    entry['error'] = e.result.stderr.strip()
+                    # Policy or parameters may have been changed meanwhile
+                    del self.caches[device.id]
+
+            if 'error' not in entry:
+                cache.params.update(changes)
+            self.write_log(entry)
+            entries.append(entry)
+
+        # Forget stopped caches - they start from their current settings
+        for cache_id in set(self.caches) - set(after.state.caches):
+            del self.caches[cache_id]
+
+        return entries
+
+
+# Asynchronous API - coroutine equivalents for use in asyncio event loop
+
+
+def async_casadm_command(build_cmd, invalidates=False):
+    async def command(cls, *args, **kwargs):
+        try:
+            return await cls.run_cmd(build_cmd(*args, **kwargs))
+        finally:
+            if invalidates:
+                DeviceStateSnapshot.invalidate()
+
+    return classmethod(command)
+
+class async_casadm:
+    """
+    Mirror of casadm running commands as asyncio subprocesses, so that they
+    don't block event loop. Methods are coroutines taking the same arguments
+    as their casadm counterparts and raising casadm.CasadmError on failure.
+    """
+
+    @classmethod
+    async def run_cmd(cls, cmd):
+        import asyncio
+
+        with timeline.span(casadm.get_operation(cmd), cmd=' '.join(cmd),
+                           devices=casadm.get_devices(cmd)) as span:
+            p = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await p.communicate()
+
+            result = casadm.batch_result(p.returncode, stdout.decode(), stderr.decode())
+            span.fields['exit_code'] = result.exit_code
+            if result.exit_code != 0:
+                raise casadm.CasadmError(result)
+        return result
+
+    get_version = async_casadm_command(casadm.get_version_cmd)
+    list_caches = async_casadm_command(casadm.list_caches_cmd)
+    check_cache_device = async_casadm_command(casadm.check_cache_device_cmd)
+    start_cache = async_casadm_command(casadm.start_cache_cmd, True)
+    add_core = async_casadm_command(casadm.add_core_cmd, True)
+    stop_cache = async_casadm_command(casadm.stop_cache_cmd, True)
+    remove_core = async_casadm_command(casadm.remove_core_cmd, True)
+    set_param = async_casadm_command(casadm.set_param_cmd, True)
+    get_params = async_casadm_command(casadm.get_params_cmd)
+    flush_parameters = async_casadm_command(casadm.flush_parameters_cmd, True)
+    io_class_load_config = async_casadm_command(casadm.io_class_load_config_cmd, True)
+    io_class_list = async_casadm_command(casadm.io_class_list_cmd)
+    set_cache_mode = async_casadm_command(casadm.set_cache_mode_cmd, True)
+    start_upgrade = async_casadm_command(casadm.start_upgrade_cmd, True)
+
+async def run_parallel_async(func, items, jobs=None):
+    """
+    Coroutine version of run_parallel() - awaits func(item) for every item,
+    running at most jobs coroutines at a time.
+    """
+    import asyncio
+
+    results = [TaskResult(item) for item in items]
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+    loop = asyncio.get_event_loop()
+
+    async def run(task):
+        async with semaphore:
+            start_time = loop.time()
+            try:
+                task.result = await func(task.item)
+            except Exception as e:
+                task.error = e
+            task.duration = loop.time() - start_time
+
+    if results:
+        await asyncio.gather(*[run(task) for task in results])
+
+    return results
+
+async def get_caches_list_async():
+    # Device listing over control device is quick enough to be done
+    # in place, casadm fallback runs as subprocess
+    import cas_ioctl
+    import csv
 
+    dev_list = ctrl_ioctl.query(cas_ioctl.list_caches)
+    if dev_list is not None:
+        return dev_list
 
-def wait_for_startup(timeout=300, interval=5):
+    result = await async_casadm.list_caches()
+    return list(csv.DictReader(result.stdout.split('\n')))
+
+async def fetch_device_state_async():
     try:
-        config = cas_config.from_file(
-            cas_config.default_location, allow_incomplete=True
-        )
-    except Exception as e:
-        raise Exception("Unable to load opencas config. Reason: {0}".format(str(e)))
+        return await DeviceStateSnapshot.fetch_async()
+    except casadm.CasadmError as e:
+        raise Exception('Unable to list caches. Reason:\n{0}'.format(
+            e.result.stderr))
+    except:
+        raise Exception('Unable to list caches.')
 
-    stop_time = time.time() + int(timeout)
+async def get_devices_state_async():
+    return (await DeviceStateSnapshot.fetch_async()).get_devices_state()
+
+async def wait_for_startup_async(timeout=300, interval=5, monitor=None):
+    """Coroutine version of wait_for_startup()"""
+    import asyncio
 
+    target_core_state = get_startup_target()
+    stop_time = time.time() + int(timeout)
     not_initialized = None
-    target_core_state = config.get_startup_cores()
 
-    while stop_time > time.time():
-        not_initialized = []
-        runtime_core_state = get_devices_state()["cores"]
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = udev_monitor.open([core.device for core in target_core_state])
 
-        for core in target_core_state:
-            runtime_state = runtime_core_state.get((core.cache_id, core.core_id), None)
-            if not runtime_state or runtime_state["status"] != "Active":
-                not_initialized.append(core)
+    try:
+        while stop_time > time.time():
+            not_initialized = get_not_initialized(target_core_state,
+                                                  await get_devices_state_async())
+            if not not_initialized:
+                break
+
+            wait_time = min(interval, max(stop_time - time.time(), 0))
+            with timeline.wait('settle wait', cores=len(not_initialized)):
+                if monitor:
+                    await monitor.wait_async(wait_time)
+                else:
+                    await asyncio.sleep(wait_time)
+    finally:
+        if own_monitor and monitor:
+            monitor.close()
 
-        if not not_initialized:
-            break
+    return not_initialized
 
-        time.sleep(interval)
+async def detach_all_cores_async(flush, state=None, jobs=None, progress=None):
+    """Coroutine version of detach_all_cores()"""
+    error = CompoundException()
 
-    return not_initialized
+    if state is None:
+        state = await fetch_device_state_async()
+
+    levels = get_detach_levels(state)
+    total = sum(len(level) for level in levels)
+    done = [0]
+    failed = set()
+
+    async def detach_group(cores):
+        errors = []
+        for core in cores:
+            e = get_blocking_error(core, state, failed)
+            if not e:
+                try:
+                    await async_casadm.remove_core(core.cache_id, core.id,
+                                                   detach = True, force = not flush)
+                    state.mark_core_detached(core.cache_id, core.id)
+                except casadm.CasadmError as err:
+                    e = Exception('Unable to detach core {0}. Reason:\n{1}'.format(
+                        core.disk, err.result.stderr))
+                except:
+                    e = Exception('Unable to detach core {0}.'.format(core.disk))
+
+            if e:
+                errors.append(e)
+                failed.add(core.key)
+            done[0] += 1
+            if progress:
+                progress(done[0], total)
+        return errors
+
+    for level in levels:
+        tasks = await run_parallel_async(detach_group,
+                                         get_detach_groups(level, state), jobs)
+        for task in tasks:
+            if task.error:
+                error.add_exception(task.error)
+            else:
+                for e in task.result:
+                    error.add_exception(e)
+
+    error.raise_nonempty()
+
+async def stop_all_caches_async(flush, state=None):
+    """
+    Coroutine version of stop_all_caches(). Caches are stopped one after
+    another in the same order, so that caches stacked on exported devices of
+    other caches are stopped before them.
+    """
+    error = CompoundException()
+
+    if state is None:
+        state = await fetch_device_state_async()
+
+    for cache in state.get_caches():
+        # In case of exception we proceed with stopping subsequent cache instances
+        # to gracefully shutdown as many cache instances as possible.
+        try:
+            await async_casadm.stop_cache(cache.id, not flush)
+        except casadm.CasadmError as e:
+            error.add_exception(Exception(
+                'Unable to stop cache {0}. Reason:\n{1}'.format(
+                    cache.disk, e.result.stderr)))
+        except:
+            error.add_exception(Exception(
+                'Unable to stop cache {0}.'.format(cache.disk)))
+
+    error.raise_nonempty()
+
+async def stop_async(flush, jobs=None, progress=None):
+    """Coroutine version of stop()"""
+    error = CompoundException()
+
+    state = await fetch_device_state_async()
+
+    try:
+        await detach_all_cores_async(flush, state, jobs, progress)
+    except Exception as e:
+        error.add_exception(e)
+
+    try:
+        await stop_all_caches_async(False, state)
+    except Exception as e:
+        error.add_exception(e)
+
+    error.raise_nonempty()
@@ -67,11 +67,16 @@ rm -rf $RPM_BUILD_ROOT
 systemctl daemon-reload
 systemctl -q enable open-cas-shutdown
 systemctl -q enable open-cas
+systemctl -q enable open-cas-udev-rules.path
 
 %preun
 if [ $1 -eq 0 ]; then
     systemctl -q disable open-cas-shutdown
     systemctl -q disable open-cas
+    systemctl -q disable open-cas-loader
+    systemctl -q disable open-cas-recorder
+    systemctl -q disable open-cas-tuner
+    systemctl -q disable open-cas-udev-rules.path
 fi
 
 %postun
@@ -107,11 +112,16 @@ fi
 %dir /lib/opencas/
 %dir /var/lib/opencas
 %config /etc/opencas/opencas.conf
+%ghost /etc/udev/rules.d/60-persistent-storage-cas-load.rules
+%ghost /etc/udev/rules.d/69-persistent-storage-cas-load.rules
 /etc/opencas/ioclass-config.csv
 /var/lib/opencas/cas_version
 /lib/opencas/casctl
 /lib/opencas/open-cas-loader
+/lib/opencas/open-cas-recorder
+/lib/opencas/open-cas-tuner
 /lib/opencas/opencas.py
+/lib/opencas/cas_ioctl.py
 /lib/udev/rules.d/60-persistent-storage-cas-load.rules
 /lib/udev/rules.d/60-persistent-storage-cas.rules
 /sbin/casadm
@@ -119,12 +129,21 @@ fi
 /usr/lib/systemd/system-shutdown/open-cas.shutdown
 /usr/lib/systemd/system/open-cas-shutdown.service
 /usr/lib/systemd/system/open-cas.service
+/usr/lib/systemd/system/open-cas-loader.service
+/usr/lib/systemd/system/open-cas-recorder.service
+/usr/lib/systemd/system/open-cas-tuner.service
+/usr/lib/systemd/system/open-cas-udev-rules.path
+/usr/lib/systemd/system/open-cas-udev-rules.service
 /usr/share/man/man5/opencas.conf.5.gz
 /usr/share/man/man8/casadm.8.gz
 /usr/share/man/man8/casctl.8.gz
 %ghost /var/log/opencas.log
+%ghost /var/log/opencas-tuner.log
+%ghost /var/lib/opencas/stats.ring
 %ghost /lib/opencas/opencas.pyc
 %ghost /lib/opencas/opencas.pyo
+%ghost /lib/opencas/cas_ioctl.pyc
+%ghost /lib/opencas/cas_ioctl.pyo
 
 %files  modules_%{kver_filename}
 %defattr(-, root, root)